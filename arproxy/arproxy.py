@@ -19,6 +19,7 @@ np = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 if np not in sys.path:
     sys.path.append(np)
 import util.log
+import util.wire
 
 from utils import parse_packet, craft_arp_packet, craft_eth_frame, craft_garp_response
 
@@ -54,7 +55,7 @@ class PctrlClient(object):
             except EOFError as ee:
                 rv = None
 
-            if not (rv and self.process_message(**json.loads(rv))):
+            if not (rv and self.process_message(**rv)):
                 self.close()
                 break
 
@@ -113,7 +114,7 @@ class PctrlClient(object):
         logger.debug("relay ARP-REQUEST to participant %s", self.addr)
         data = {}
         data['arp'] = [srcmac, ip]
-        self.conn.send(json.dumps(data))
+        self.conn.send(data)
 
 
     def close(self):
@@ -142,7 +143,8 @@ class PctrlListener(object):
     def start(self):
         logger.info("ARP Response Handler started")
         while True:
-            conn = self.listener_garp.accept()
+            # answers each participant controller in the wire format it uses
+            conn = util.wire.WireConnection(self.listener_garp.accept(), legacy_json=True)
             pc = PctrlClient(conn, self.listener_garp.last_accepted)
             t = Thread(target=pc.start)
             with clientPoolLock:
@@ -19,6 +19,7 @@ np = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 if np not in sys.path:
     sys.path.append(np)
 import util.log
+from util.trace import tracer, install_dump_handler, REFMON_RECEIVE, BARRIER_REPLY
 
 from lib import MultiSwitchController, MultiTableController, OneSwitchController, Config, InvalidConfigError
 from ofp10 import FlowMod as OFP10FlowMod
@@ -42,6 +43,13 @@ class RefMon(app_manager.RyuApp):
         self.logger = util.log.getLogger('ReferenceMonitor')
         self.logger.info('refmon: start')
 
+        # latency histograms are dumped with kill -USR1
+        tracer.configure('ReferenceMonitor', self.logger)
+        try:
+            install_dump_handler()
+        except ValueError:
+            self.logger.info('refmon: not in the main thread, latency histograms cannot be dumped on signal')
+
         # retrieve command line arguments
         CONF = cfg.CONF
 
@@ -81,6 +89,7 @@ class RefMon(app_manager.RyuApp):
             self.controller = OneSwitchController(self.config)
 
         # this must be set before Server, which uses it.
+        # (receive time, latency traces) of each flow mod request
         self.flow_mod_times = Queue()
 
         # start server receiving flowmod requests
@@ -117,15 +126,22 @@ class RefMon(app_manager.RyuApp):
             end_time = time()
 
             try:
-                start_time = self.flow_mod_times.get_nowait()
+                start_time, traces = self.flow_mod_times.get_nowait()
             except Empty:
-                pass
+                return
+
+            for trace in traces:
+                tracer.stamp(trace, BARRIER_REPLY)
+                tracer.finish(trace)
 
             if self.log:
                 self.log.write(str(start_time) + " " + str(end_time) + " " + str(end_time - start_time) + "\n")
 
     def process_flow_mods(self, msg):
-        self.flow_mod_times.put(time())
+        traces = msg.get("traces", [])
+        for trace in traces:
+            tracer.stamp(trace, REFMON_RECEIVE)
+        self.flow_mod_times.put((time(), traces))
 
         self.logger.debug('refmon: received flowmod request ' + json.dumps(msg))
 
@@ -1,14 +1,172 @@
-class BGPRoute:
+from collections import deque
+from threading import Lock
+
+
+class PathAttributes(object):
+    """
+    Immutable set of path attributes. A single instance is shared by all the routes
+    that carry the same attributes (e.g. all the prefixes of a BGP UPDATE).
+    """
+    __slots__ = ('id', 'key', 'refcount', 'origin', 'as_path', 'communities', 'med', 'atomic_aggregate')
+
+    def __init__(self, id, key):
+        self.id = id
+        self.key = key
+        self.refcount = 0
+        self.origin, self.as_path, self.communities, self.med, self.atomic_aggregate = key
+
+    def __hash__(self):
+        return hash(self.key)
+
+    def __eq__(self, other):
+        return isinstance(other, PathAttributes) and self.key == other.key
+
+    def __ne__(self, other):
+        return not self.__eq__(other)
+
+
+class PathAttributeTable(object):
+    """
+    Table of the interned path attributes. Every route holds a reference on its
+    attributes, which are dropped from the table once no route refers to them.
+
+    The references are counted under a plain Lock rather than a pure-Python
+    RLock. A route can be released by the garbage collector while the lock is
+    held, so the releases are only queued (deque.append is atomic) and are
+    counted by the next intern.
+    """
+    def __init__(self):
+        self.lock = Lock()
+        self.attributes = {}
+        self.released = deque()
+        self.next_id = 0
+
+    def intern(self, origin, as_path, communities, med, atomic_aggregate):
+        if as_path is not None and type(as_path) is not tuple:
+            # AS_SETs are nested lists
+            as_path = tuple(tuple(asn) if isinstance(asn, list) else asn for asn in as_path)
+        key = (origin, as_path, communities, med, atomic_aggregate)
+
+        with self.lock:
+            if self.released:
+                self.count_releases()
+            attributes = self.attributes.get(key)
+            if attributes is None:
+                attributes = PathAttributes(self.next_id, key)
+                self.next_id += 1
+                self.attributes[key] = attributes
+            attributes.refcount += 1
+
+        return attributes
+
+    def acquire(self, attributes):
+        "Another reference on attributes already interned"
+        with self.lock:
+            attributes.refcount += 1
+
+    def release(self, attributes):
+        self.released.append(attributes)
+
+    def count_releases(self):
+        "Must be called with the lock held"
+        released = self.released
+        while released:
+            attributes = released.popleft()
+            attributes.refcount -= 1
+            if attributes.refcount == 0 and self.attributes.get(attributes.key) is attributes:
+                del self.attributes[attributes.key]
+
+    def __len__(self):
+        with self.lock:
+            self.count_releases()
+            return len(self.attributes)
+
+
+path_attributes = PathAttributeTable()
+
+
+class BGPRoute(object):
+    __slots__ = ('prefix', 'neighbor', 'next_hop', 'as_path_vmac', 'attributes')
+
     def __init__(self, prefix, neighbor, next_hop, origin, as_path, as_path_vmac, communities, med, atomic_aggregate):
         self.prefix = prefix
         self.neighbor = neighbor
         self.next_hop = next_hop
-        self.origin = origin
-        self.as_path = as_path
         self.as_path_vmac = as_path_vmac
-        self.communities = communities
-        self.med = med
-        self.atomic_aggregate = atomic_aggregate
+        self.attributes = path_attributes.intern(origin, as_path, communities, med, atomic_aggregate)
+
+    @classmethod
+    def from_attributes(cls, prefix, neighbor, next_hop, as_path_vmac, attributes):
+        "Route with attributes already interned, e.g. shared with the other prefixes of an UPDATE"
+        route = cls.__new__(cls)
+        route.prefix = prefix
+        route.neighbor = neighbor
+        route.next_hop = next_hop
+        route.as_path_vmac = as_path_vmac
+        path_attributes.acquire(attributes)
+        route.attributes = attributes
+        return route
+
+    def __del__(self):
+        try:
+            path_attributes.release(self.attributes)
+        except (AttributeError, TypeError):
+            # partially initialized route or interpreter shutdown
+            pass
+
+    def __reduce__(self):
+        # the attributes are interned again on the receiving side
+        return (BGPRoute, (self.prefix, self.neighbor, self.next_hop, self.origin, self.as_path,
+                           self.as_path_vmac, self.communities, self.med, self.atomic_aggregate))
+
+    def replace_attributes(self, **kwargs):
+        "Swap the attributes of this route for the interned attributes with the given values changed"
+        values = dict(origin=self.origin, as_path=self.as_path, communities=self.communities,
+                      med=self.med, atomic_aggregate=self.atomic_aggregate)
+        values.update(kwargs)
+        old_attributes = self.attributes
+        self.attributes = path_attributes.intern(**values)
+        path_attributes.release(old_attributes)
+
+    @property
+    def origin(self):
+        return self.attributes.origin
+
+    @origin.setter
+    def origin(self, origin):
+        self.replace_attributes(origin=origin)
+
+    @property
+    def as_path(self):
+        return self.attributes.as_path
+
+    @as_path.setter
+    def as_path(self, as_path):
+        self.replace_attributes(as_path=as_path)
+
+    @property
+    def communities(self):
+        return self.attributes.communities
+
+    @communities.setter
+    def communities(self, communities):
+        self.replace_attributes(communities=communities)
+
+    @property
+    def med(self):
+        return self.attributes.med
+
+    @med.setter
+    def med(self, med):
+        self.replace_attributes(med=med)
+
+    @property
+    def atomic_aggregate(self):
+        return self.attributes.atomic_aggregate
+
+    @atomic_aggregate.setter
+    def atomic_aggregate(self, atomic_aggregate):
+        self.replace_attributes(atomic_aggregate=atomic_aggregate)
 
     def __cmp__(self, other):
         # Comparison according to BGP decision process:
@@ -48,4 +206,4 @@ class BGPRoute:
         return 0
 
     def __str__(self):
-        return '|' + str(self.prefix) + '\t|' + str(self.neighbor) + '\t|' + str(self.next_hop) + '\t|' + str(self.as_path)
\ No newline at end of file
+        return '|' + str(self.prefix) + '\t|' + str(self.neighbor) + '\t|' + str(self.next_hop) + '\t|' + str(self.as_path)
@@ -13,12 +13,14 @@ from ryu.lib import hub
 import os
 import sys
 
+from bgp_route import BGPRoute
 from peer import BGPPeer
 from participant_server import ParticipantServer
 
 np = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 if np not in sys.path:
     sys.path.append(np)
+import util.wire
 
 
 class PConfig(object):
@@ -59,6 +61,9 @@ class PConfig(object):
 
         self.Swift_vmac = config["SWIFT"]["Vmac"]
 
+        # format of the messages sent to XRS and to the ARP proxy
+        self.wire_format = config.get("Wire Format", util.wire.WIRE_PICKLE)
+
     def parse_various(self):
         config = self.config
 
@@ -98,7 +103,8 @@ class PConfig(object):
     def get_xrs_client(self, logger):
         config = self.config
         conn_info = config["Route Server"]
-        return GenericClient2(conn_info["AH_SOCKET"][0], conn_info["AH_SOCKET"][1], '', logger, 'xrs')
+        return GenericClient2(conn_info["AH_SOCKET"][0], conn_info["AH_SOCKET"][1], '', logger, 'xrs',
+                              self.wire_format, BGPRoute)
 
     def get_xrs_info(self, logger=None):
         config = self.config
@@ -126,7 +132,8 @@ class PConfig(object):
     def get_arp_client(self, logger):
         config = self.config
         conn_info = config["ARP Proxy"]
-        return GenericClient2(conn_info["GARP_SOCKET"][0], conn_info["GARP_SOCKET"][1], '', logger, 'arp')
+        return GenericClient2(conn_info["GARP_SOCKET"][0], conn_info["GARP_SOCKET"][1], '', logger, 'arp',
+                              self.wire_format)
 
     def get_refmon_client(self, logger):
         config = self.config
@@ -226,7 +233,7 @@ class GenericSockClient(object):
 
 
 class GenericClient2(object):
-    def __init__(self, address, port, key, logger, sname):
+    def __init__(self, address, port, key, logger, sname, wire_format=util.wire.WIRE_PICKLE, route_factory=None):
         self.address = address
         self.port = int(port)
         self.key = key
@@ -236,7 +243,8 @@ class GenericClient2(object):
         while True: # keep going until we break out inside the loop
             try:
                 self.logger.debug('Attempting to connect to '+self.serverName+' server at '+str(self.address)+' port '+str(self.port))
-                self.conn = Client((self.address, self.port))
+                self.conn = util.wire.WireConnection(Client((self.address, self.port)), wire_format,
+                                                     route_factory, legacy_json=True)
                 self.logger.debug('Connect to '+self.serverName+' successful.')
                 break
             except SocketError as serr:
@@ -251,7 +259,7 @@ class GenericClient2(object):
                 raise
 
     def send(self, msg):
-        self.conn.send(json.dumps(msg))
+        self.conn.send(msg)
 
     def poll(self, t):
         return self.conn.poll(t)
@@ -17,6 +17,7 @@ np = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 if np not in sys.path:
     sys.path.append(np)
 import util.log
+from util.trace import tracer, install_dump_handler, PCTRL_RECEIVE, PCTRL_DECISION, PCTRL_RULES, PUSH_DP, PCTRL_ANNOUNCE
 from xctrl.flowmodmsg import FlowModMsgBuilder
 
 from lib import PConfig
@@ -183,10 +184,11 @@ class ParticipantController(object):
         if 'changes' in rule_msgs:
             self.dp_queued.extend(rule_msgs["changes"])
 
-    def push_dp(self):
+    def push_dp(self, traces=()):
         '''
         (1) Check if there are any policies queued to be pushed
         (2) Send the queued policies to reference monitor
+        The latency traces of the updates behind these flow mods go along with them.
         '''
 
         self.logger.debug("Pushing current flow mod queue:")
@@ -205,7 +207,12 @@ class ParticipantController(object):
             self.dp_pushed.append(flowmod)
 
         self.dp_queued = []
-        self.refmon_client.send(json.dumps(fm_builder.get_msg()))
+        msg = fm_builder.get_msg()
+        if traces:
+            for trace in traces:
+                tracer.stamp(trace, PUSH_DP)
+            msg['traces'] = list(traces)
+        self.refmon_client.send(json.dumps(msg))
 
     def stop(self):
         "Stop the Participants' SDN Controller"
@@ -224,11 +231,10 @@ class ParticipantController(object):
             if not self.arp_client.poll(1):
                 continue
             try:
-                tmp = self.arp_client.recv()
+                data = self.arp_client.recv()
             except EOFError:
                 break
 
-            data = json.loads(tmp)
             self.logger.debug("ARP Event received: %s", data)
 
             # Starting a thread for independently processing each incoming network event
@@ -282,6 +288,12 @@ class ParticipantController(object):
             #self.logger.debug("BGP Route received: "+str(route)+" "+str(type(route)))
             self.process_bgp_route(update)
 
+        elif 'bgp_batch' in data:
+            # Batch of BGP updates coalesced by XRS, processed in order
+            self.logger.debug("Event Received: batch of %d BGP Updates.", len(data['bgp_batch']))
+            for update in data['bgp_batch']:
+                self.process_bgp_route(update)
+
         elif 'policy' in data:
             # Process the event requesting change of participants' policies
             self.logger.debug("Event Received: Policy change.")
@@ -508,10 +520,11 @@ class ParticipantController(object):
             #self.logger.debug("Repeat :: "+str(hsh))
         return self.prefix_lock[hsh]
 
-    def process_bgp_route(self, update):
+    def process_bgp_route(self, update, push=True):
 
-        "Process each incoming BGP advertisement"
+        "Process each incoming BGP advertisement. Without push, the flow mods stay queued for the caller to push"
         tstart = time.time()
+        trace = tracer.stamp(update.get('trace'), PCTRL_RECEIVE)
 
         #Check for local failure, push fast reroute rules if local failure
         #self.deal_with_local_failure(routes)
@@ -530,6 +543,7 @@ class ParticipantController(object):
         self.BEC.assignment(update)
         #assign VNH to FEC, BEC pair of prefix
         self.vnh_assignment(update)
+        tracer.stamp(trace, PCTRL_DECISION)
 
         if TIMING:
             elapsed = time.time() - tstart
@@ -594,8 +608,10 @@ class ParticipantController(object):
             # TODO: similar logic for MDS
             self.logger.debug("Creating ctrlr messages for MDS scheme")
 
-        if len(self.dp_queued) != 0:
-            self.push_dp()
+        tracer.stamp(trace, PCTRL_RULES)
+
+        if push and len(self.dp_queued) != 0:
+            self.push_dp([trace] if trace else ())
 
         if TIMING:
             elapsed = time.time() - tstart
@@ -631,6 +647,9 @@ class ParticipantController(object):
             self.logger.debug("Time taken to send garps/announcements: " + str(elapsed))
             tstart = time.time()
 
+        tracer.stamp(trace, PCTRL_ANNOUNCE)
+        tracer.finish(trace)
+
         #print self.id, "BEC_list", self.BEC_list
         #print self.id, "VHN_2_VMAC", self.VNH_2_vmac
 
@@ -687,6 +706,7 @@ class ParticipantController(object):
                     self.vnh_2_BFEC[vnh] = [self.prefix_2_BEC[prefix], self.prefix_2_FEC[prefix]]
 
     def deal_with_local_failure(self,down_ip):
+        "Withdraw all the routes of a neighbor whose session went down, with a single push to the dataplane"
         route_list = []
 
         #@TODO: PUSH BACKUP RULES IF NECESSARY
@@ -697,8 +717,13 @@ class ParticipantController(object):
 
         self.bgp_instance.delete_all_routes('input', neighbor=down_ip)
 
+        self.logger.info("Withdrawing %d routes of %s", len(route_list), down_ip)
+
         for route in route_list:
-            self.process_bgp_route(route)
+            self.process_bgp_route(route, push=False)
+
+        if len(self.dp_queued) != 0:
+            self.push_dp()
 
             #rules = []
             #for backup_ip in self.tag_dict:
@@ -788,6 +813,10 @@ def main():
 
     logger = util.log.getLogger("P_" + str(args.id))
 
+    # latency histograms are dumped with kill -USR1
+    tracer.configure("P_" + str(args.id), logger)
+    install_dump_handler()
+
     logger.info("Starting controller with config file: "+str(config_file))
     logger.info("and policy file: "+str(policy_file))
 
@@ -0,0 +1,244 @@
+import ctypes
+import ctypes.util
+import errno
+import fcntl
+import os
+import signal
+from threading import Lock, Thread
+import time
+
+
+"""
+Per-update latency tracing across XRS, the participant controllers and the
+reference monitor.
+
+A trace is a flat list [trace_id, stage, timestamp, stage, timestamp, ...]
+that travels with the update (in the update dict, over the wire and in the
+flow mod messages). Timestamps are read from CLOCK_MONOTONIC, which all the
+processes of a host share. Every process aggregates the time spent between
+the previous stamp and each of its own stamps in log2 histograms, and dumps
+them on SIGUSR1.
+"""
+
+# Stages in pipeline order
+XRS_RECEIVE = 0
+XRS_SEND = 1
+PCTRL_RECEIVE = 2
+PCTRL_DECISION = 3
+PCTRL_RULES = 4
+PUSH_DP = 5
+PCTRL_ANNOUNCE = 6
+REFMON_RECEIVE = 7
+BARRIER_REPLY = 8
+
+STAGES = ('xrs_receive', 'xrs_send', 'pctrl_receive', 'pctrl_decision', 'pctrl_rules', 'push_dp',
+          'pctrl_announce', 'refmon_receive', 'barrier_reply')
+
+CLOCK_MONOTONIC = 1
+
+
+class timespec(ctypes.Structure):
+    _fields_ = [('tv_sec', ctypes.c_long), ('tv_nsec', ctypes.c_long)]
+
+
+def _load_clock_gettime():
+    for name in (ctypes.util.find_library('rt'), ctypes.util.find_library('c')):
+        if name is None:
+            continue
+        try:
+            clock_gettime = ctypes.CDLL(name, use_errno=True).clock_gettime
+        except (OSError, AttributeError):
+            continue
+        clock_gettime.argtypes = [ctypes.c_int, ctypes.POINTER(timespec)]
+        return clock_gettime
+    return None
+
+_clock_gettime = _load_clock_gettime()
+
+
+def monotonic():
+    "Seconds since an arbitrary point in time, never going backwards. Falls back to time.time()"
+    if _clock_gettime is None:
+        return time.time()
+    # a timespec per call, the tracer is used from several threads
+    t = timespec()
+    if _clock_gettime(CLOCK_MONOTONIC, ctypes.byref(t)) != 0:
+        return time.time()
+    return t.tv_sec + t.tv_nsec * 1e-9
+
+
+"""
+Histogram of latencies with power of two buckets: bucket i counts the
+latencies between 2^(i-1) and 2^i microseconds.
+"""
+class LatencyHistogram(object):
+    NB_BUCKETS = 40
+
+    def __init__(self):
+        self.buckets = [0] * self.NB_BUCKETS
+        self.count = 0
+        self.total = 0.
+        self.max = 0.
+
+    def add(self, latency):
+        us = int(latency * 1e6)
+        bucket = min(us.bit_length() if us > 0 else 0, self.NB_BUCKETS - 1)
+        self.buckets[bucket] += 1
+        self.count += 1
+        self.total += latency
+        if latency > self.max:
+            self.max = latency
+
+    def percentile(self, p):
+        "Upper bound in seconds of the bucket holding the p-th percentile"
+        if self.count == 0:
+            return 0.
+        rank = p / 100. * self.count
+        seen = 0
+        for i, n in enumerate(self.buckets):
+            seen += n
+            if seen >= rank and n > 0:
+                return min((1 << i) * 1e-6, self.max)
+        return self.max
+
+    def __str__(self):
+        if self.count == 0:
+            return 'n=0'
+        return 'n=%d mean=%.6f p50<=%.6f p90<=%.6f p99<=%.6f max=%.6f' % \
+               (self.count, self.total / self.count, self.percentile(50), self.percentile(90),
+                self.percentile(99), self.max)
+
+
+class Tracer(object):
+    def __init__(self, name='', logger=None, sample_every=0):
+        self.name = name
+        self.logger = logger
+        # one update out of sample_every is traced, 0 disables tracing
+        self.sample_every = sample_every
+        self.counter = 0
+        self.next_id = 0
+
+        self.lock = Lock()
+        # (from stage, to stage) -> LatencyHistogram, totals are under ('total', first stage, last stage)
+        self.histograms = {}
+
+    def configure(self, name=None, logger=None, sample_every=None):
+        if name is not None:
+            self.name = name
+        if logger is not None:
+            self.logger = logger
+        if sample_every is not None:
+            self.sample_every = sample_every
+
+    """
+    Returns a new trace stamped with stage, or None if this update is not sampled.
+    """
+    def start(self, stage):
+        if self.sample_every <= 0:
+            return None
+        with self.lock:
+            self.counter += 1
+            if self.counter < self.sample_every:
+                return None
+            self.counter = 0
+            self.next_id += 1
+            trace_id = (os.getpid() << 32) | self.next_id
+        return [trace_id, stage, monotonic()]
+
+    """
+    Stamp a trace (None is ignored) and record the time since its previous stamp.
+    """
+    def stamp(self, trace, stage, now=None):
+        if trace is None:
+            return None
+        if now is None:
+            now = monotonic()
+        self.record((trace[-2], stage), now - trace[-1])
+        trace.append(stage)
+        trace.append(now)
+        return trace
+
+    """
+    Record the end-to-end latency of a trace that is not going any further.
+    """
+    def finish(self, trace):
+        if trace is None or len(trace) < 5:
+            return
+        self.record(('total', trace[1], trace[-2]), trace[-1] - trace[2])
+
+    def record(self, key, latency):
+        with self.lock:
+            histogram = self.histograms.get(key)
+            if histogram is None:
+                histogram = self.histograms[key] = LatencyHistogram()
+            histogram.add(latency)
+
+    def reset(self):
+        with self.lock:
+            self.histograms = {}
+
+    def dump(self):
+        "Returns the histograms as text, and logs them if there is a logger"
+        with self.lock:
+            items = sorted(self.histograms.items())
+
+        lines = ['Latency histograms of %s (seconds)' % (self.name or os.getpid())]
+        for key, histogram in items:
+            label = ' -> '.join(STAGES[stage] for stage in key[-2:])
+            if len(key) == 3:
+                label = 'total ' + label
+            buckets = histogram.buckets[:]
+            while buckets and buckets[-1] == 0:
+                buckets.pop()
+            lines.append('%-40s %s' % (label, histogram))
+            lines.append('%-40s buckets (log2 us): %s' % ('', ' '.join(str(n) for n in buckets)))
+        text = '\n'.join(lines)
+
+        if self.logger:
+            self.logger.info(text)
+        return text
+
+
+# tracer of this process
+tracer = Tracer()
+
+
+"""
+Dump the histograms of this process on a signal. Must be called from the main
+thread. The handler runs on the main thread, possibly in the middle of
+record() with the lock of the tracer held (the Ryu handlers of RefMon run
+there), so it only writes a byte to a pipe: the dump is done by a thread of
+its own, reading the pipe.
+"""
+def install_dump_handler(signum=signal.SIGUSR1):
+    read_fd, write_fd = os.pipe()
+    # a signal never blocks on a full pipe, a dump is pending anyway then
+    fcntl.fcntl(write_fd, fcntl.F_SETFL, fcntl.fcntl(write_fd, fcntl.F_GETFL) | os.O_NONBLOCK)
+
+    def dumper():
+        while True:
+            try:
+                os.read(read_fd, 4096)
+            except OSError as e:
+                if e.errno == errno.EINTR:
+                    continue
+                raise
+            tracer.dump()
+
+    def handler(signum, frame):
+        try:
+            os.write(write_fd, 'd')
+        except OSError:
+            pass
+
+    # raises ValueError off the main thread, the pipe is closed and no thread started then
+    try:
+        signal.signal(signum, handler)
+    except ValueError:
+        os.close(read_fd)
+        os.close(write_fd)
+        raise
+
+    thread = Thread(target=dumper)
+    thread.daemon = True
+    thread.start()
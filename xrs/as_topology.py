@@ -1,90 +1,313 @@
-import networkx as nx
+from array import array
+from collections import defaultdict
 import math
 
-class ASTopology(nx.DiGraph):
+import numpy as np
+
+from prefix_bitmap import PrefixBitmap, prefix_ids
+
+
+"""
+Topology of the AS paths of a peer, weighted by the number of prefixes
+traversing each AS link.
+
+The ASes are interned into consecutive node ids and the AS links into
+consecutive edge ids, so that all the counters are kept in typed arrays
+rather than in per-node and per-edge attribute dicts:
+    out_prefixes, in_prefixes   node id -> number of prefixes leaving/entering the AS
+    edge_src, edge_dst          edge id -> node ids of the AS link
+    prefix_counter              edge id -> number of prefixes traversing the AS link
+    depth_counters[depth]       edge id -> number of prefixes traversing the AS link at
+                                that depth (the first link of an AS path is at depth 1)
+The arrays are array.array rather than numpy arrays, as updating numpy
+arrays one item at a time is much slower. edge_arrays and depth_array
+return them as numpy arrays for the vectorised computations.
+
+Like before, the AS links are never removed, their counters just go back to
+zero. The topology reads like the networkx.DiGraph it replaces:
+G[from_as][to_as]['prefix_counter'], G[from_as][to_as]['depth'], G[from_as].keys(),
+G.predecessors(to_as), G.has_edge(from_as, to_as), etc.
+"""
+class ASTopology(object):
     def __init__(self, w_threshold, silent=False):
-        super(ASTopology, self).__init__()
         self.silent = silent
         self.nodes_forward = set() # Set of nodes that needs to be taken into account when looking for the best fm score
         self.nodes_backward = set() # Set of nodes that needs to be taken into account when looking for the best fm score
         self.w_threshold = w_threshold
 
-    def add(self, as_path, prefix=None):
-        for i in range(0, len(as_path)-1):
-            # Create the node and initialize their attributes if they do not exist yet
-            if as_path[i] not in self:
-                self.add_node(as_path[i], out_prefixes=0, in_prefixes=0)
-            if as_path[i+1] not in self:
-                self.add_node(as_path[i+1], out_prefixes=0, in_prefixes=0)
-
-            # Update the node attributes
-            self.node[as_path[i]]['out_prefixes'] += 1
-            self.node[as_path[i+1]]['in_prefixes'] += 1
-
-            # Add those nodes in the out_prefixes our in_prefixes sets if necessary
-            if self.node[as_path[i]]['out_prefixes'] == self.w_threshold:
+        # Nodes
+        self.node_ids = {}  # AS number -> node id
+        self.asns = []      # node id -> AS number
+        self.out_prefixes = array('i')
+        self.in_prefixes = array('i')
+
+        # Edges
+        self.edge_index = {}    # (from node id << 32) | to node id -> edge id
+        self.edge_src = array('i')
+        self.edge_dst = array('i')
+        self.prefix_counter = array('d')
+        self.depth_counters = [array('i')]  # depth 0 is never used
+        self.edge_prefixes = {} # edge id -> PrefixBitmap of the prefix ids (if not silent only)
+
+        # Adjacency in CSR form (indptr, edge ids), by source and by destination
+        # node, and the sorted edge keys. Built when needed, and dropped whenever
+        # an edge is created.
+        self.csr_out = None
+        self.csr_in = None
+        self.sorted_keys = None
+
+        # AS numbers whose counters changed, once track_changes is called
+        self.changed = None
+        # depth -> ids of the edges whose counter at that depth changed, for the
+        # last caller of track_depths
+        self.changed_depths = None
+
+    def track_changes(self):
+        "Record the AS numbers of the paths added or removed in changed, for the incremental computations"
+        if self.changed is None:
+            self.changed = set(self.asns)
+
+    def track_depths(self):
+        "Returns the changed_depths recording the edges whose depth counters change from now on, for an index of the encoding"
+        self.changed_depths = defaultdict(set)
+        return self.changed_depths
+
+    def new_node(self, asn):
+        node = len(self.asns)
+        self.node_ids[asn] = node
+        self.asns.append(asn)
+        self.out_prefixes.append(0)
+        self.in_prefixes.append(0)
+        return node
+
+    def new_edge(self, key, src, dst):
+        edge = len(self.edge_src)
+        self.edge_index[key] = edge
+        self.edge_src.append(src)
+        self.edge_dst.append(dst)
+        self.prefix_counter.append(0.)
+        self.csr_out = None
+        self.csr_in = None
+        self.sorted_keys = None
+        return edge
+
+    def depth_counter(self, depth, edge):
+        "Returns the counters of a depth, long enough to hold the edge"
+        while len(self.depth_counters) <= depth:
+            self.depth_counters.append(array('i'))
+        counters = self.depth_counters[depth]
+        if len(counters) <= edge:
+            # Grown ahead, most of the new edges come in bulk
+            counters.extend(array('i', [0]) * max(len(self.edge_src) - len(counters), len(counters), edge + 1 - len(counters)))
+        return counters
+
+    def add(self, as_path, prefix=None, nb=1):
+        "Adds an AS path, nb times (e.g. the AS path of nb prefixes)"
+        node_ids = self.node_ids
+        nodes = [node_ids[asn] if asn in node_ids else self.new_node(asn) for asn in as_path]
+        depth_counters = self.depth_counters
+        changed_depths = self.changed_depths
+        if self.changed is not None:
+            self.changed.update(as_path)
+        prefix_id = prefix_ids.intern(prefix) if not self.silent and prefix is not None else None
+
+        for i in range(0, len(nodes)-1):
+            src = nodes[i]
+            dst = nodes[i+1]
+
+            # Update the node attributes, and add those nodes in the nodes_forward or nodes_backward sets if necessary
+            self.out_prefixes[src] += nb
+            if self.out_prefixes[src]-nb < self.w_threshold <= self.out_prefixes[src]:
                 self.nodes_forward.add(as_path[i])
-            if self.node[as_path[i+1]]['in_prefixes'] == self.w_threshold:
+            self.in_prefixes[dst] += nb
+            if self.in_prefixes[dst]-nb < self.w_threshold <= self.in_prefixes[dst]:
                 self.nodes_backward.add(as_path[i+1])
 
-            # Create the edge
-            self.add_edge(as_path[i], as_path[i+1])
-
-            # Update the prefix counter
-            if 'prefix_counter' not in self[as_path[i]][as_path[i+1]]:
-                self[as_path[i]][as_path[i+1]]['prefix_counter'] = 0.
-            self[as_path[i]][as_path[i+1]]['prefix_counter'] += 1.
-
-            # Update the depth prefix counter
-            if 'depth' not in self[as_path[i]][as_path[i+1]]:
-                self[as_path[i]][as_path[i+1]]['depth'] = {}
-            if i+1 not in self[as_path[i]][as_path[i+1]]['depth']:
-                self[as_path[i]][as_path[i+1]]['depth'][i+1] = 0
-            self[as_path[i]][as_path[i+1]]['depth'][i+1] += 1
+            # Create the edge, and update its prefix counter and depth prefix counter
+            key = (src << 32) | dst
+            edge = self.edge_index.get(key)
+            if edge is None:
+                edge = self.new_edge(key, src, dst)
+            self.prefix_counter[edge] += nb
+            if i+1 < len(depth_counters) and edge < len(depth_counters[i+1]):
+                depth_counters[i+1][edge] += nb
+            else:
+                self.depth_counter(i+1, edge)[edge] += nb
+            if changed_depths is not None:
+                changed_depths[i+1].add(edge)
 
             # Update the prefix set (if not silent only)
-            if not self.silent and prefix is not None:
-                if 'prefixes' not in self[as_path[i]][as_path[i+1]]:
-                    self[as_path[i]][as_path[i+1]]['prefixes'] = set()
-                self[as_path[i]][as_path[i+1]]['prefixes'].add(prefix)
-
-    def remove(self, as_path, prefix=None):
-        for i in range(0, len(as_path)-1):
-            # Update the node attributes
-            self.node[as_path[i]]['out_prefixes'] -= 1
-            self.node[as_path[i+1]]['in_prefixes'] -= 1
-
-            # Add those nodes in the out_prefixes our in_prefixes sets if necessary
-            if self.node[as_path[i]]['out_prefixes'] == self.w_threshold-1:
+            if prefix_id is not None:
+                if edge not in self.edge_prefixes:
+                    self.edge_prefixes[edge] = PrefixBitmap()
+                self.edge_prefixes[edge].add(prefix_id)
+
+    def remove(self, as_path, prefix=None, nb=1):
+        "Removes an AS path, nb times"
+        nodes = [self.node_ids[asn] for asn in as_path]
+        changed_depths = self.changed_depths
+        if self.changed is not None:
+            self.changed.update(as_path)
+        prefix_id = prefix_ids.intern(prefix) if not self.silent and prefix is not None else None
+        for i in range(0, len(nodes)-1):
+            src = nodes[i]
+            dst = nodes[i+1]
+            edge = self.edge_index[(src << 32) | dst]
+
+            # Update the node attributes, and remove those nodes from the nodes_forward or nodes_backward sets if necessary
+            self.out_prefixes[src] -= nb
+            if self.out_prefixes[src] < self.w_threshold <= self.out_prefixes[src]+nb:
                 self.nodes_forward.remove(as_path[i])
-            if self.node[as_path[i+1]]['in_prefixes'] == self.w_threshold-1:
+            self.in_prefixes[dst] -= nb
+            if self.in_prefixes[dst] < self.w_threshold <= self.in_prefixes[dst]+nb:
                 self.nodes_backward.remove(as_path[i+1])
 
-            # Update the weight
-            self[as_path[i]][as_path[i+1]]['prefix_counter'] -= 1.
-
-            # Update the depth prefix counter
-            self[as_path[i]][as_path[i+1]]['depth'][i+1] -= 1
-            if self[as_path[i]][as_path[i+1]]['depth'][i+1] == 0:
-                del self[as_path[i]][as_path[i+1]]['depth'][i+1]
+            # Update the weight and the depth prefix counter
+            self.prefix_counter[edge] -= nb
+            counters = self.depth_counters[i+1] if i+1 < len(self.depth_counters) else ()
+            if edge >= len(counters) or counters[edge] < nb:
+                raise KeyError(i+1)
+            counters[edge] -= nb
+            if changed_depths is not None:
+                changed_depths[i+1].add(edge)
 
             # Update the prefix set (if not silent only)
-            if not self.silent and prefix is not None:
-                self[as_path[i]][as_path[i+1]]['prefixes'].remove(prefix)
+            if prefix_id is not None:
+                self.edge_prefixes[edge].remove(prefix_id)
+
+    def csr(self, nodes):
+        "Returns indptr and the edge ids sorted by node, for the nodes given for each edge"
+        nodes = np.frombuffer(nodes, dtype=np.int32)
+        order = np.argsort(nodes, kind='mergesort')
+        nb_nodes = self.number_of_nodes()
+        indptr = np.zeros(nb_nodes + 1, dtype=np.int64)
+        np.cumsum(np.bincount(nodes, minlength=nb_nodes), out=indptr[1:])
+        return indptr, order
+
+    def out_csr(self):
+        if self.csr_out is None:
+            self.csr_out = self.csr(self.edge_src)
+        return self.csr_out
+
+    def in_csr(self):
+        if self.csr_in is None:
+            self.csr_in = self.csr(self.edge_dst)
+        return self.csr_in
+
+    def out_edge_ids(self, node):
+        indptr, order = self.out_csr()
+        return order[indptr[node]:indptr[node+1]].tolist()
+
+    def in_edge_ids(self, node):
+        indptr, order = self.in_csr()
+        return order[indptr[node]:indptr[node+1]].tolist()
+
+    def edge_keys(self):
+        "Returns the sorted edge keys ((from node id << 32) | to node id) and their edge ids"
+        if self.sorted_keys is None:
+            keys = (np.frombuffer(self.edge_src, dtype=np.int32).astype(np.int64) << 32) | \
+                np.frombuffer(self.edge_dst, dtype=np.int32)
+            order = np.argsort(keys)
+            self.sorted_keys = keys[order], order
+        return self.sorted_keys
+
+    def find_edges(self, from_nodes, to_nodes):
+        "Returns the edge ids of AS links given by numpy arrays of node ids (-1 for none), -1 where there is no such link"
+        keys, edges = self.edge_keys()
+        if len(keys) == 0:
+            return np.full(len(from_nodes), -1, dtype=np.int64)
+        wanted = (from_nodes.astype(np.int64) << 32) | to_nodes
+        pos = np.minimum(np.searchsorted(keys, wanted), len(keys) - 1)
+        found = (keys[pos] == wanted) & (from_nodes >= 0) & (to_nodes >= 0)
+        return np.where(found, edges[pos], -1)
+
+    def snapshot(self):
+        "Read-only copy of the topology for BPA in another thread, see TopologySnapshot"
+        return TopologySnapshot(self)
+
+    """
+    Graph interface
+    """
+    def __contains__(self, asn):
+        return asn in self.node_ids
+
+    def __iter__(self):
+        return iter(self.asns)
+
+    def __len__(self):
+        return len(self.asns)
+
+    def __getitem__(self, asn):
+        return Successors(self, self.node_ids[asn])
+
+    def nodes(self):
+        return list(self.asns)
+
+    def edges(self):
+        asns = self.asns
+        return [(asns[src], asns[dst]) for src, dst in zip(self.edge_src, self.edge_dst)]
+
+    def number_of_nodes(self):
+        return len(self.asns)
+
+    def number_of_edges(self):
+        return len(self.edge_src)
+
+    def has_edge(self, from_node, to_node):
+        return self.find_edge(from_node, to_node) is not None
+
+    def successors(self, asn):
+        return [self.asns[self.edge_dst[edge]] for edge in self.out_edge_ids(self.node_ids[asn])]
 
-            # Clean the graph
-            #if self[as_path[i]][as_path[i+1]]['prefix_counter'] == 0.:
-                #self.remove_edge(as_path[i], as_path[i+1])
-                #if self.out_degree(as_path[i]) == 0 and self.in_degree(as_path[i]) == 0.:
-                    #self.remove_node(as_path[i])
-                #if self.out_degree(as_path[i+1]) == 0 and self.in_degree(as_path[i+1]) == 0.:
-                    #self.remove_node(as_path[i+1])
+    def predecessors(self, asn):
+        return [self.asns[self.edge_src[edge]] for edge in self.in_edge_ids(self.node_ids[asn])]
 
+    def find_edge(self, from_node, to_node):
+        "Returns the edge id of an AS link, None if it does not exist"
+        src = self.node_ids.get(from_node)
+        if src is None:
+            return None
+        dst = self.node_ids.get(to_node)
+        if dst is None:
+            return None
+        return self.edge_index.get((src << 32) | dst)
+
+    def edge_depths(self, edge):
+        "Returns depth -> number of prefixes of an edge, for the depths with prefixes only"
+        depths = {}
+        for depth in range(1, len(self.depth_counters)):
+            counters = self.depth_counters[depth]
+            if edge < len(counters) and counters[edge] != 0:
+                depths[depth] = counters[edge]
+        return depths
+
+    """
+    Numpy arrays (copies) of the edges: source node ids, destination node ids and prefix counters
+    """
+    def edge_arrays(self):
+        return np.frombuffer(self.edge_src, dtype=np.int32).copy(), np.frombuffer(self.edge_dst, dtype=np.int32).copy(), \
+            np.frombuffer(self.prefix_counter, dtype=np.float64).copy()
+
+    def depth_array(self, depth):
+        "Numpy array (copy) of the prefix counters of all the edges at a depth"
+        res = np.zeros(len(self.edge_src), dtype=np.int32)
+        if depth < len(self.depth_counters):
+            counters = np.frombuffer(self.depth_counters[depth], dtype=np.int32)[:len(res)]
+            res[:len(counters)] = counters
+        return res
+
+    def depth_edges(self, depth):
+        "Returns (from AS, to AS, number of prefixes) for the edges with prefixes at a depth"
+        counters = self.depth_array(depth)
+        edges = np.flatnonzero(counters)
+        asns = self.asns
+        return [(asns[self.edge_src[edge]], asns[self.edge_dst[edge]], nb_prefixes)
+                for edge, nb_prefixes in zip(edges.tolist(), counters[edges].tolist())]
 
     def print_nodes(self):
         list_nodes = []
-        for n in self.nodes():
-            list_nodes.append((n, self.node[n]['out_prefixes'], self.node[n]['in_prefixes']))
+        for n, asn in enumerate(self.asns):
+            list_nodes.append((asn, self.out_prefixes[n], self.in_prefixes[n]))
 
         list_nodes = sorted(list_nodes, reverse=True, key=lambda x:x[1])
 
@@ -98,23 +321,26 @@ class ASTopology(nx.DiGraph):
         return res
 
     def get_prefixes_edge(self, edge):
-        try:
-            for p in self[edge[0]][edge[1]]['prefixes']:
-                yield p
-        except KeyError:
-            return
+        for p in self.get_prefix_ids_edge(edge).prefixes():
+            yield p
+
+    def get_prefix_ids_edge(self, edge):
+        "Returns the PrefixBitmap of the ids of the prefixes traversing an AS link (empty if silent)"
+        edge = self.find_edge(edge[0], edge[1])
+        prefixes = self.edge_prefixes.get(edge)
+        return prefixes if prefixes is not None else PrefixBitmap()
 
     def __str__(self):
         res = ''
-        for i in self:
-            for j in self[i]:
-                res += str(i)+'\t'+str(j)+'\t'+str(self[i][j]['prefix_counter'])+'\n'
+        for edge, (i, j) in enumerate(self.edges()):
+            res += str(i)+'\t'+str(j)+'\t'+str(self.prefix_counter[edge])+'\n'
         return res
 
     def get_depth(self, from_node, to_node):
         depth = '-1'
-        if from_node in self and to_node in self[from_node]:
-            depth = min(self[from_node][to_node]['depth'].keys())
+        edge = self.find_edge(from_node, to_node)
+        if edge is not None:
+            depth = min(self.edge_depths(edge).keys())
 
         return depth
 
@@ -124,20 +350,16 @@ class ASTopology(nx.DiGraph):
     """
     def print_subtopo(self, limit=10):
         list_edges = []
-        for i in self:
-            for j in self[i]:
-                list_edges.append((i, j, self[i][j]['prefix_counter']))
+        for edge, (i, j) in enumerate(self.edges()):
+            list_edges.append((i, j, self.prefix_counter[edge], edge))
 
         list_edges_sorted = sorted(list_edges, reverse=True, key=lambda x:x[2])
 
         res = ''
         for i in range(0, min(len(list_edges_sorted),limit)):
-            res += str(list_edges_sorted[i][0])+'\t'+str(list_edges_sorted[i][1])+'\t'+str(list_edges_sorted[i][2])+'\t'+str(self[list_edges_sorted[i][0]][list_edges_sorted[i][1]]['depth'])+'\n'
+            res += str(list_edges_sorted[i][0])+'\t'+str(list_edges_sorted[i][1])+'\t'+str(list_edges_sorted[i][2])+'\t'+str(self.edge_depths(list_edges_sorted[i][3]))+'\n'
         return res
 
-    import math
-
-
     def fowlkes_mallows(self, TP, FP, FN, w_p=1., w_r=1.):
         return math.exp((w_p*math.log(TP/(TP+FP)) + w_r*math.log(TP/(TP+FN))) / (w_p+w_r))
 
@@ -164,3 +386,127 @@ class ASTopology(nx.DiGraph):
         fd = open(outfile, 'w')
         fd.write(res)
         fd.close()
+
+
+"""
+Copy of the counters of a topology, taken in the thread which updates it, on
+which BPA can run in another thread. The counters are copied (a few memcpy),
+the AS numbers, node ids and edge ids are shared: they are only ever
+appended to, and those created after the snapshot are out of its arrays.
+The prefixes of the edges are not kept.
+"""
+class TopologySnapshot(ASTopology):
+    def __init__(self, topo):
+        self.silent = True
+        self.w_threshold = topo.w_threshold
+        self.nodes_forward = set(topo.nodes_forward)
+        self.nodes_backward = set(topo.nodes_backward)
+
+        self.node_ids = topo.node_ids
+        self.asns = topo.asns
+        self.nb_nodes = len(topo.out_prefixes)
+        self.out_prefixes = topo.out_prefixes[:]
+        self.in_prefixes = topo.in_prefixes[:]
+
+        self.edge_index = topo.edge_index
+        self.edge_src = topo.edge_src[:]
+        self.edge_dst = topo.edge_dst[:]
+        self.prefix_counter = topo.prefix_counter[:]
+        self.depth_counters = [counters[:] for counters in topo.depth_counters]
+        self.edge_prefixes = {}
+
+        self.csr_out = None
+        self.csr_in = None
+        self.sorted_keys = None
+        self.changed = None
+        self.changed_depths = None
+
+    def add(self, as_path, prefix=None, nb=1):
+        raise TypeError('a topology snapshot is read-only')
+
+    def remove(self, as_path, prefix=None, nb=1):
+        raise TypeError('a topology snapshot is read-only')
+
+    def __contains__(self, asn):
+        node = self.node_ids.get(asn)
+        return node is not None and node < self.nb_nodes
+
+    def __iter__(self):
+        return iter(self.asns[:self.nb_nodes])
+
+    def __len__(self):
+        return self.nb_nodes
+
+    def nodes(self):
+        return self.asns[:self.nb_nodes]
+
+    def number_of_nodes(self):
+        return self.nb_nodes
+
+    def find_edge(self, from_node, to_node):
+        edge = ASTopology.find_edge(self, from_node, to_node)
+        return edge if edge is not None and edge < len(self.edge_src) else None
+
+
+"""
+G[from_as]: the AS links leaving an AS, by destination AS
+"""
+class Successors(object):
+    def __init__(self, topo, src):
+        self.topo = topo
+        self.src = src
+
+    def __getitem__(self, asn):
+        return EdgeAttributes(self.topo, self.topo.edge_index[(self.src << 32) | self.topo.node_ids[asn]])
+
+    def __contains__(self, asn):
+        dst = self.topo.node_ids.get(asn)
+        return dst is not None and ((self.src << 32) | dst) in self.topo.edge_index
+
+    def __iter__(self):
+        return iter(self.keys())
+
+    def __len__(self):
+        return len(self.topo.out_edge_ids(self.src))
+
+    def keys(self):
+        asns = self.topo.asns
+        edge_dst = self.topo.edge_dst
+        return [asns[edge_dst[edge]] for edge in self.topo.out_edge_ids(self.src)]
+
+    def items(self):
+        asns = self.topo.asns
+        edge_dst = self.topo.edge_dst
+        return [(asns[edge_dst[edge]], EdgeAttributes(self.topo, edge)) for edge in self.topo.out_edge_ids(self.src)]
+
+"""
+G[from_as][to_as]: the attributes of an AS link, 'prefix_counter', 'depth'
+(depth -> number of prefixes, without the depths without prefixes) and
+'prefixes' (the PrefixBitmap of the prefix ids, if not silent, and once a
+prefix traversed the link)
+"""
+class EdgeAttributes(object):
+    def __init__(self, topo, edge):
+        self.topo = topo
+        self.edge = edge
+
+    def __getitem__(self, name):
+        if name == 'prefix_counter':
+            return self.topo.prefix_counter[self.edge]
+        elif name == 'depth':
+            return self.topo.edge_depths(self.edge)
+        elif name == 'prefixes':
+            return self.topo.edge_prefixes[self.edge]
+        raise KeyError(name)
+
+    def __contains__(self, name):
+        return name in ('prefix_counter', 'depth') or (name == 'prefixes' and self.edge in self.topo.edge_prefixes)
+
+    def get(self, name, default=None):
+        try:
+            return self[name]
+        except KeyError:
+            return default
+
+    def keys(self):
+        return [name for name in ('prefix_counter', 'depth', 'prefixes') if name in self]
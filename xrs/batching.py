@@ -0,0 +1,78 @@
+from threading import Condition, Lock, Thread
+import time
+
+
+"""
+Coalesces the updates sent to one participant controller into batches.
+A batch is handed to flush_callback as soon as it holds max_size updates, or
+at the latest max_delay seconds after its first update was queued.
+Batches are always flushed in order.
+"""
+class UpdateBatcher(object):
+    def __init__(self, flush_callback, max_size, max_delay, logger=None):
+        self.flush_callback = flush_callback
+        self.max_size = max_size
+        self.max_delay = max_delay
+        self.logger = logger
+
+        self.cond = Condition()
+        # serializes taking a batch and handing it over, keeps the batches in order
+        self.flush_lock = Lock()
+        self.batch = []
+        self.deadline = None
+        self.run = True
+
+        self.flusher = Thread(target=self.delayed_flush)
+        self.flusher.daemon = True
+        self.flusher.start()
+
+    def add(self, update):
+        with self.cond:
+            self.batch.append(update)
+            if len(self.batch) == 1:
+                self.deadline = time.time() + self.max_delay
+                self.cond.notify()
+            full = len(self.batch) >= self.max_size
+
+        if full:
+            self.flush()
+
+    """
+    Hand the pending updates over to the callback, if there are any.
+    """
+    def flush(self):
+        with self.flush_lock:
+            with self.cond:
+                batch = self.batch
+                self.batch = []
+                self.deadline = None
+
+            if batch:
+                self.flush_callback(batch)
+
+    def delayed_flush(self):
+        while True:
+            with self.cond:
+                while self.run and not self.batch:
+                    self.cond.wait()
+                if not self.run:
+                    break
+                delay = self.deadline - time.time()
+
+            if delay > 0:
+                time.sleep(delay)
+                continue
+
+            try:
+                self.flush()
+            except Exception:
+                if self.logger:
+                    self.logger.exception('UpdateBatcher: flushing batch failed')
+
+    def stop(self):
+        with self.cond:
+            self.run = False
+            self.cond.notify()
+
+    def __len__(self):
+        return len(self.batch)
@@ -0,0 +1,236 @@
+#!/usr/bin/env python
+#  Offline throughput benchmark of the route server
+
+
+import argparse
+import cPickle as pickle
+import json
+import os
+import Queue
+import resource
+import sys
+import tempfile
+from threading import Lock
+import time
+
+np = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
+if np not in sys.path:
+    sys.path.append(np)
+import util.wire
+from util.trace import tracer, monotonic, PCTRL_RECEIVE
+
+
+"""
+Streams a bgpdump trace (bgpdump -m, e.g. Bgpdump/500k.txt) through the
+route server without ExaBGP, Mininet nor participant controllers: the
+updates are handed to the BGPListener as ExaBGP would, go through
+route_2_bgp_updates, the SWIFT workers and Route_server_sender, and are
+delivered to in-process participant controllers which decode and count
+them. The neighbors of the trace all belong to one participant, advertising
+its routes to all the others.
+
+    python benchmark.py [trace] --participants 3 --sample-every 100
+"""
+
+
+def table_dump_2_exabgp(line):
+    "Returns the ExaBGP JSON message and the neighbor of a bgpdump -m line, None if it is not an IPv4 update"
+    fields = line.strip().split('|')
+    if len(fields) < 6 or fields[0] not in ('TABLE_DUMP2', 'BGP4MP'):
+        return None
+
+    msg_type, neighbor, prefix = fields[2], fields[3], fields[5]
+    if ':' in prefix:
+        return None
+
+    if msg_type == 'W':
+        update = {'withdraw': {'ipv4 unicast': {prefix: {}}}}
+    elif len(fields) >= 13:
+        # AS_SETs are dropped
+        as_path = [int(asn) for asn in fields[6].split() if asn.isdigit()]
+        communities = [[int(v) for v in c.split(':')] for c in fields[11].split() if c.count(':') == 1]
+        attribute = {'origin': fields[7].lower(),
+                     'as-path': as_path,
+                     'med': int(fields[10] or 0),
+                     'community': communities,
+                     'atomic-aggregate': fields[12] == 'AG'}
+        update = {'attribute': attribute, 'announce': {'ipv4 unicast': {fields[8]: {prefix: {}}}}}
+    else:
+        return None
+
+    return json.dumps({'time': int(fields[1]), 'neighbor': {'ip': neighbor, 'message': {'update': update}}}), neighbor
+
+
+def peak_rss(pid):
+    "Peak RSS of a running process in MB (VmHWM), None where /proc does not tell"
+    try:
+        with open('/proc/%d/status' % pid) as f:
+            for line in f:
+                if line.startswith('VmHWM:'):
+                    return int(line.split()[1]) / 1024.
+    except (IOError, ValueError):
+        pass
+    return None
+
+
+class FakeServer(object):
+    "Stands in for the ExaBGP bridge of the route server"
+    def __init__(self, receiver_queue_size=0):
+        self.receiver_queue = Queue.Queue(receiver_queue_size)
+        self.sender_queue = Queue.Queue()
+
+    def start(self):
+        pass
+
+
+class FakeConnection(object):
+    """
+    Connection of an in-process participant controller, which decodes and
+    counts the updates it receives like a participant controller would.
+    """
+    def __init__(self, route_factory):
+        self.decoder = util.wire.Decoder(route_factory)
+        self.lock = Lock()
+        self.updates = 0
+        self.frames = 0
+        self.bytes = 0
+        self.last = None
+
+    def send(self, msg):
+        # what multiprocessing.connection does with the legacy format
+        data = pickle.dumps(msg, pickle.HIGHEST_PROTOCOL)
+        self.received(pickle.loads(data), len(data))
+
+    def send_bytes(self, data):
+        self.received(self.decoder.decode(data), len(data))
+
+    def received(self, msg, size):
+        if 'bgp' in msg:
+            updates = [msg['bgp']]
+        else:
+            updates = msg.get('bgp_batch', [])
+
+        now = monotonic()
+        for update in updates:
+            trace = update.get('trace')
+            tracer.stamp(trace, PCTRL_RECEIVE, now)
+            tracer.finish(trace)
+
+        with self.lock:
+            self.frames += 1
+            self.updates += len(updates)
+            self.bytes += size
+            self.last = now
+
+    def close(self):
+        pass
+
+
+def main():
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace', nargs='?', default=os.path.join(np, 'Bgpdump', '500k.txt'),
+                        help='bgpdump -m trace (default: Bgpdump/500k.txt)')
+    parser.add_argument('--example', default='test-ms', help='example directory of the config (default: test-ms)')
+    parser.add_argument('--participants', type=int, default=3, help='number of receiving participants (default: 3)')
+    parser.add_argument('--limit', type=int, default=0, help='only use the first LIMIT updates of the trace')
+    parser.add_argument('--sample-every', type=int, default=100, help='trace one update out of SAMPLE_EVERY (default: 100)')
+    parser.add_argument('--wire-format', choices=util.wire.WIRE_FORMATS, default=util.wire.WIRE_PICKLE,
+                        help='format of the messages to the participants (default: pickle)')
+    parser.add_argument('--idle', type=float, default=2., help='seconds without delivery after which the run is over')
+    parser.add_argument('--worker-processes', type=int, default=None,
+                        help='number of SWIFT worker processes (default: worker_processes of the config)')
+    parser.add_argument('--workdir', help='where the SWIFT workers write their logs (default: a temporary directory)')
+    args = parser.parse_args()
+
+    config_file = os.path.join(np, 'examples', args.example, 'config', 'sdx_global.cfg')
+
+    messages = []
+    neighbors = set()
+    with open(args.trace) as f:
+        for line in f:
+            converted = table_dump_2_exabgp(line)
+            if converted is None:
+                continue
+            messages.append(converted[0])
+            neighbors.add(converted[1])
+            if len(messages) == args.limit:
+                break
+    print 'Loaded %d updates from %d neighbors' % (len(messages), len(neighbors))
+
+    # the SWIFT workers create their log, bursts and encoding directories in the current directory
+    workdir = args.workdir or tempfile.mkdtemp(prefix='xrs-benchmark-')
+    if not os.path.exists(workdir):
+        os.makedirs(workdir)
+    os.chdir(workdir)
+
+    import route_server
+    from bgp_route import BGPRoute
+
+    route_server.config = route_server.parse_config(config_file)._replace(trace_sample_every=args.sample_every)
+    swift_config = dict(route_server.parse_swift_config(config_file), snapshot_interval=0)
+    if args.worker_processes is not None:
+        swift_config['worker_processes'] = args.worker_processes
+    tracer.configure('XRS benchmark', None, args.sample_every)
+
+    server = FakeServer(route_server.config.receiver_queue_size)
+    listener = route_server.BGPListener(swift_config, server=server)
+    route_server.bgpListener = listener
+
+    connections = []
+    def add_participant(id, peers_in, peers_out, ports):
+        conn = FakeConnection(BGPRoute)
+        client = route_server.PctrlClient(util.wire.WireConnection(conn, args.wire_format), 'participant %d' % id)
+        client.process_hello_message(id=id, peers_in=peers_in, peers_out=peers_out, ports=ports)
+        connections.append(conn)
+
+    receivers = range(2, args.participants + 2)
+    add_participant(1, [], receivers, sorted(neighbors))
+    for id in receivers:
+        add_participant(id, [1], [], [])
+
+    listener.start()
+
+    start = monotonic()
+    cpu_start = os.times()
+    for msg in messages:
+        server.receiver_queue.put(msg)
+    fed = monotonic()
+
+    # done once the input is consumed and nothing was delivered for a while
+    while True:
+        time.sleep(0.1)
+        last = max([conn.last for conn in connections if conn.last is not None] or [None])
+        now = monotonic()
+        if server.receiver_queue.empty() and now - max(last or fed, fed) >= args.idle:
+            break
+    end = last or fed
+    cpu_end = os.times()
+
+    duration = end - start
+    delivered = sum(conn.updates for conn in connections)
+    frames = sum(conn.frames for conn in connections)
+    size = sum(conn.bytes for conn in connections)
+    rss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024.
+    # RUSAGE_CHILDREN only covers the children reaped, and the workers are still running
+    workers = [peak_rss(p.pid) for p in listener.swift_pool.processes] if listener.swift_pool else []
+
+    print 'Input consumed in %.3f s' % (fed - start)
+    print 'Delivered %d updates to %d participants in %d frames (%d bytes, %s)' % \
+          (delivered, len(receivers), frames, size, args.wire_format)
+    print 'Duration %.3f s: %.0f updates/s in, %.0f updates/s delivered' % \
+          (duration, len(messages) / duration, delivered / duration)
+    print 'CPU user %.3f s, system %.3f s' % (cpu_end[0] - cpu_start[0], cpu_end[1] - cpu_start[1])
+    print 'Peak RSS %.1f MB, worker processes %s' % \
+          (rss, ' + '.join('%.1f MB' % worker if worker is not None else '?' for worker in workers) or 'none')
+    print tracer.dump()
+    sys.stdout.flush()
+
+    # the SWIFT worker threads never return, and os._exit leaves the worker processes running
+    if listener.swift_pool:
+        for p in listener.swift_pool.processes:
+            p.terminate()
+    os._exit(0)
+
+
+if __name__ == '__main__':
+    main()
@@ -22,6 +22,64 @@ class BGPMessagesQueue(deque):
         while len(self) > 0 and ts - self[0]['time'] > self.time:
             yield self.popleft()
 
+"""
+Withdrawals received in the last `time` seconds, in buckets of one second
+holding the number of withdrawals and, for each withdrawn AS path, how many
+times it was withdrawn. Its size is kept up to date, and the withdrawals
+expire a bucket at a time, so that the graph of withdrawals can be updated
+once per AS path. Withdrawals received out of order go in the newest
+bucket, like they would go at the end of a queue.
+"""
+class WithdrawalWindow(object):
+    def __init__(self, time):
+        self.time = time
+        self.buckets = deque()  # WithdrawalBucket, the oldest first
+        self.nb_withdrawals = 0
+
+    def append(self, ts, as_path):
+        second = int(ts)
+        if len(self.buckets) == 0 or self.buckets[-1].second < second:
+            self.buckets.append(WithdrawalBucket(second))
+        bucket = self.buckets[-1]
+        bucket.nb_withdrawals += 1
+        bucket.as_paths[as_path] = bucket.as_paths.get(as_path, 0) + 1
+        self.nb_withdrawals += 1
+
+    """
+    Remove all the buckets that have expired at ts, and yields them.
+    """
+    def expire(self, ts):
+        while len(self.buckets) > 0 and ts - self.buckets[0].second > self.time:
+            bucket = self.buckets.popleft()
+            self.nb_withdrawals -= bucket.nb_withdrawals
+            yield bucket
+
+    def next_expiry(self):
+        "The second at which the oldest withdrawals expire, None if there are none"
+        if len(self.buckets) == 0:
+            return None
+        return self.buckets[0].second + self.time + 1
+
+    def time_of(self, index):
+        "The second of the withdrawal at that index, the oldest withdrawal being at 0"
+        for bucket in self.buckets:
+            if index < bucket.nb_withdrawals:
+                return bucket.second
+            index -= bucket.nb_withdrawals
+        raise IndexError(index)
+
+    def __len__(self):
+        return self.nb_withdrawals
+
+
+class WithdrawalBucket(object):
+    __slots__ = ('second', 'nb_withdrawals', 'as_paths')
+
+    def __init__(self, second):
+        self.second = second
+        self.nb_withdrawals = 0
+        self.as_paths = {}  # AS path -> number of withdrawals
+
 """
 Remove duplicate ASes in case of AS-path prepending.
 Check for loops in the as-path.
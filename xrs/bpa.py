@@ -1,5 +1,10 @@
+import heapq
+import itertools
 import math
 import time
+
+import numpy as np
+
 from as_topology import ASTopology
 
 """
@@ -14,6 +19,372 @@ fowlkes_mallows (TP, FP, FN, w_p=1, w_r=1):
 def fowlkes_mallows(TP, FP, FN, w_p=1., w_r=1.):
     return math.exp((w_p*math.log(TP/(TP+FP)) + w_r*math.log(TP/(TP+FN))) / (w_p+w_r))
 
+"""
+Vectorised fowlkes_mallows over numpy arrays. The score is 0 where there is no
+true positive.
+"""
+def fowlkes_mallows_array(TP, FP, FN, w_p=1., w_r=1.):
+    with np.errstate(divide='ignore', invalid='ignore'):
+        fm_score = np.exp((w_p*np.log(TP/(TP+FP)) + w_r*np.log(TP/(TP+FN))) / (w_p+w_r))
+    return np.where(TP > 0, fm_score, 0.)
+
+"""
+Returns the edges of G_W leaving (forward) or reaching (backward) the nodes,
+in the order the reference functions visit them, as numpy arrays: the group of
+each edge (the position of its node in nodes), its source and destination node
+ids in G_W, its TP (prefix counter in G_W) and its FP (prefix counter in G).
+"""
+def candidate_edges(G, G_W, nodes, forward):
+    indptr, order = G_W.out_csr() if forward else G_W.in_csr()
+    node_ids = np.array([G_W.node_ids[n] for n in nodes], dtype=np.int64)
+    edges = np.concatenate([order[indptr[n]:indptr[n+1]] for n in node_ids] or [np.zeros(0, dtype=np.int64)])
+    groups = np.repeat(np.arange(len(node_ids)), indptr[node_ids+1] - indptr[node_ids])
+
+    edge_src, edge_dst, prefix_counter = G_W.edge_arrays()
+    src = edge_src[edges]
+    dst = edge_dst[edges]
+    TP = prefix_counter[edges]
+
+    # The same AS links in G, found by AS number
+    endpoints, inverse = np.unique(np.concatenate((src, dst)), return_inverse=True)
+    in_G = np.array([G.node_ids.get(G_W.asns[n], -1) for n in endpoints.tolist()], dtype=np.int64)[inverse]
+    G_edges = G.find_edges(in_G[:len(src)], in_G[len(src):])
+    FP = np.zeros(len(src))
+    found = G_edges >= 0
+    FP[found] = np.frombuffer(G.prefix_counter, dtype=np.float64)[G_edges[found]]
+
+    return groups, src, dst, TP, FP
+
+"""
+Same as find_best_fmscore_single_reference, with the scores of all the
+candidate edges computed at once.
+"""
+def find_best_fmscore_single(G, G_W, W_nb, p_w=1, r_w=1):
+    groups, src, dst, TP, FP = candidate_edges(G, G_W, G_W.nodes_forward, True)
+    FN = W_nb - TP
+    fm_score = fowlkes_mallows_array(TP, FP, FN, p_w, r_w)
+
+    if len(fm_score) == 0 or fm_score.max() <= 0:
+        return set(), 0, 0, 0, 0
+
+    # The first edge with the highest FM score, like the reference
+    best = np.argmax(fm_score)
+    best_edge_set = set([(G_W.asns[src[best]], G_W.asns[dst[best]])])
+    return best_edge_set, float(fm_score[best]), float(TP[best]), float(FP[best]), float(FN[best])
+
+"""
+Same as find_best_fmscore_forward_reference (forward) and
+find_best_fmscore_backward_reference (backward). The edges of all the nodes
+are scored and sorted at once, and the greedy expansion of each node is found
+with cumulative sums over its sorted edges: the edges are taken while the FM
+score of the set keeps increasing. The prefix counters are integers, so the
+sums are exact and the scores are the same as the reference.
+"""
+def find_best_fmscore_grouped(G, G_W, W_nb, p_w, r_w, forward):
+    nodes = list(G_W.nodes_forward if forward else G_W.nodes_backward)
+    groups, src, dst, TP, FP = candidate_edges(G, G_W, nodes, forward)
+    fm_score = fowlkes_mallows_array(TP, FP, W_nb - TP, p_w, r_w)
+
+    if forward:
+        keep = TP > 0
+        groups, src, dst, TP, FP, fm_score = groups[keep], src[keep], dst[keep], TP[keep], FP[keep], fm_score[keep]
+
+    # Sort the edges of each node based on the Fowlkes Mallows metric (stable, like sorted)
+    order = np.lexsort((-fm_score, groups))
+    groups, src, dst, TP, FP = groups[order], src[order], dst[order], TP[order], FP[order]
+
+    # TP and FP of the sets made of the first edges of each node
+    starts = np.flatnonzero(np.concatenate(([True], groups[1:] != groups[:-1]))) if len(groups) else np.zeros(0, dtype=np.int64)
+    ends = np.append(starts[1:], len(groups))
+    first = np.repeat(starts, ends - starts)
+    cum_TP = np.cumsum(TP)
+    cum_FP = np.cumsum(FP)
+    set_TP = cum_TP - np.where(first > 0, cum_TP[first-1], 0.)
+    set_FP = cum_FP - np.where(first > 0, cum_FP[first-1], 0.)
+    set_FN = W_nb - set_TP
+    set_fm_score = fowlkes_mallows_array(set_TP, set_FP, set_FN, p_w, r_w)
+
+    # Greedy algorithm: the sets stop growing at the first edge which does not increase the FM score
+    previous = np.concatenate(([0.], set_fm_score[:-1]))
+    previous[starts] = 0.
+    stop = np.where(set_fm_score > previous, len(groups), np.arange(len(groups)))
+    taken = dict(zip(groups[starts].tolist(), zip(starts.tolist(), np.minimum(np.minimum.reduceat(stop, starts), ends).tolist()))) \
+        if len(starts) else {}
+
+    best_fm_score = 0
+    best_edge_set = set()
+    best_TP = 0
+    best_FP = 0
+    best_FN = 0
+
+    for group in range(len(nodes)):
+        start, end = taken.get(group, (0, 0))
+        current_set = set()
+        current_fmscore = float(set_fm_score[end-1]) if end > start else 0
+        if best_fm_score <= current_fmscore:
+            current_set = set((G_W.asns[src[i]], G_W.asns[dst[i]]) for i in range(start, end))
+
+        # Update the best FM score if the current FM score is better
+        if best_fm_score < current_fmscore:
+            best_edge_set = current_set
+            best_fm_score = current_fmscore
+            best_TP = float(set_TP[end-1])
+            best_FP = float(set_FP[end-1])
+            best_FN = float(set_FN[end-1])
+        elif best_fm_score == current_fmscore:
+            best_edge_set = best_edge_set.union(current_set)
+            best_TP = -1
+            best_FP = -1
+            best_FN = -1
+
+    return best_edge_set, best_fm_score, best_TP, best_FP, best_FN
+
+def find_best_fmscore_forward(G, G_W, W_nb, p_w=1, r_w=1):
+    return find_best_fmscore_grouped(G, G_W, W_nb, p_w, r_w, True)
+
+def find_best_fmscore_backward(G, G_W, W_nb, p_w, r_w):
+    return find_best_fmscore_grouped(G, G_W, W_nb, p_w, r_w, False)
+
+"""
+Keys closer than this are the same FM score computed from different counters
+(e.g. TP=1, FP=0 and TP=2, FP=2 for p_w = r_w = 1), which may differ in the
+last bits.
+"""
+KEY_TOLERANCE = 1e-9
+
+"""
+BPA kept up to date as the topologies change, so that a prediction costs
+little more than the updates received since the previous one.
+
+For a set of edges, FN = W_nb - TP, so that
+    log(fowlkes_mallows) = (w_p*log(TP/(TP+FP)) + w_r*log(TP) - w_r*log(W_nb)) / (w_p+w_r)
+The last term is the same for all the edges and sets of edges: the ranking
+of the edges, the greedy sets of the nodes and the best node do not depend
+on W_nb, only on the counters of the edges (key below). The best edge and
+the greedy set of each node of G_W are thus computed again only when the
+counters of its edges change (G and G_W record the AS numbers of the paths
+added or removed), and kept in a heap of nodes by key, with lazy deletion.
+
+Ties are broken like the reference: the edges of a node with the same key in
+the order of G_W, and the nodes whose keys are within KEY_TOLERANCE of the
+best one by their FM scores, computed like the reference, then in the order
+of nodes_forward for single.
+
+single, forward and backward return the same as find_best_fmscore_single,
+_forward and _backward, but for the backward edges without any withdrawal,
+which are ignored.
+"""
+class IncrementalBPA(object):
+    SINGLE = 0
+    FORWARD = 1
+    BACKWARD = 2
+
+    def __init__(self, G, G_W, p_w=1, r_w=1):
+        self.G = G
+        self.G_W = G_W
+        self.p_w = p_w
+        self.r_w = r_w
+
+        G.track_changes()
+        G_W.track_changes()
+
+        # Best edge (single), greedy set of the outgoing edges (forward) and of the
+        # incoming edges (backward) of the nodes: AS number -> (key, edges, TP, FP, ties),
+        # with ties the (edge, TP, FP) of all the edges with the best key for single, and of
+        # all the edges for the greedy sets which depend on W_nb (None for the others)
+        self.candidates = ({}, {}, {})
+        # (-key, sequence number, AS number, candidate), the candidates replaced since are skipped
+        self.heaps = ([], [], [])
+        self.sequence = itertools.count()
+        # AS numbers of the greedy sets which depend on W_nb, left out of the heaps
+        self.ambiguous = (set(), set(), set())
+
+    def key(self, TP, FP):
+        return self.p_w*math.log(TP/(TP+FP)) + self.r_w*math.log(TP)
+
+    def update(self):
+        "Compute again the candidates of the nodes whose edges changed"
+        changed = self.G.changed | self.G_W.changed
+        self.G.changed.clear()
+        self.G_W.changed.clear()
+
+        for asn in changed:
+            single, forward = self.node_candidates(asn, True)
+            backward = self.node_candidates(asn, False)[1]
+            self.set_candidate(self.SINGLE, asn, single)
+            self.set_candidate(self.FORWARD, asn, forward)
+            self.set_candidate(self.BACKWARD, asn, backward)
+
+    """
+    Returns the best edges and the greedy set of edges (see find_best_fmscore_forward_reference)
+    of the outgoing (forward) or incoming edges of a node, None if the node is not considered.
+
+    The greedy set depends on W_nb when it reaches edges with the same key but different
+    counters, or an edge which leaves the key the same: the reference orders them, and
+    stops, on FM scores which differ in the last bits. Its ties are all the edges then.
+    """
+    def node_candidates(self, asn, forward):
+        G = self.G
+        G_W = self.G_W
+        if asn not in (G_W.nodes_forward if forward else G_W.nodes_backward):
+            return None, None
+
+        node = G_W.node_ids[asn]
+        scored = []
+        for edge in (G_W.out_edge_ids(node) if forward else G_W.in_edge_ids(node)):
+            TP = G_W.prefix_counter[edge]
+            if TP <= 0:
+                continue
+            if forward:
+                from_node, to_node = asn, G_W.asns[G_W.edge_dst[edge]]
+            else:
+                from_node, to_node = G_W.asns[G_W.edge_src[edge]], asn
+            G_edge = G.find_edge(from_node, to_node)
+            FP = G.prefix_counter[G_edge] if G_edge is not None else 0.
+            scored.append((self.key(TP, FP), (from_node, to_node), TP, FP, len(scored)))
+
+        if not scored:
+            return None, None
+        edges = [(edge, TP, FP) for key, edge, TP, FP, position in scored]
+
+        # Sort the list based on the Fowlkes Mallows metric, the edges with the same key in the order of G_W
+        scored.sort(key=lambda x: x[0], reverse=True)
+        best_key = scored[0][0]
+        tie_starts = []     # the first edges of the same keys with different counters
+        start = 0
+        for i in range(1, len(scored)+1):
+            if i == len(scored) or scored[i][0] < scored[start][0] - KEY_TOLERANCE:
+                if i - start > 1:
+                    scored[start:i] = sorted(scored[start:i], key=lambda x: x[4])
+                    if len(set((TP, FP) for key, edge, TP, FP, position in scored[start:i])) > 1:
+                        tie_starts.append(start)
+                if start == 0:
+                    ties = [(edge, TP, FP) for key, edge, TP, FP, position in scored[:i]]
+                start = i
+        single = (best_key, [scored[0][1]], scored[0][2], scored[0][3], ties)
+
+        # Greedy algorithm
+        current_key = None
+        current_set = []
+        current_TP = 0.
+        current_FP = 0.
+        ambiguous = False
+        for key, edge, TP, FP, position in scored:
+            new_key = self.key(current_TP + TP, current_FP + FP)
+            if current_key is not None and abs(new_key - current_key) <= KEY_TOLERANCE:
+                ambiguous = True
+            if current_key is not None and new_key <= current_key + KEY_TOLERANCE:
+                break
+            current_key = new_key
+            current_set.append(edge)
+            current_TP += TP
+            current_FP += FP
+        if tie_starts and tie_starts[0] <= len(current_set):
+            ambiguous = True
+
+        return single, (current_key, current_set, current_TP, current_FP, edges if ambiguous else None)
+
+    def greedy_reference(self, edges, W_nb):
+        "The greedy set of edges, TP, FP and FM score of a node, with the FM scores of find_best_fmscore_forward_reference"
+        p_w = self.p_w
+        r_w = self.r_w
+        scored = sorted([(edge, TP, FP, fowlkes_mallows(TP, FP, W_nb - TP, p_w, r_w)) for edge, TP, FP in edges],
+                        key=lambda x: x[3], reverse=True)
+        current_set = []
+        current_TP = 0
+        current_FP = 0
+        current_fmscore = 0
+        for edge, TP, FP, fm_score in scored:
+            new_fmscore = fowlkes_mallows(current_TP + TP, current_FP + FP, W_nb - current_TP - TP, p_w, r_w)
+            if new_fmscore <= current_fmscore:
+                break
+            current_set.append(edge)
+            current_TP += TP
+            current_FP += FP
+            current_fmscore = new_fmscore
+        return current_set, current_TP, current_FP, current_fmscore
+
+    def set_candidate(self, mode, asn, candidate):
+        candidates = self.candidates[mode]
+        heap = self.heaps[mode]
+        ambiguous = self.ambiguous[mode]
+        if candidate is None:
+            candidates.pop(asn, None)
+            ambiguous.discard(asn)
+        else:
+            candidates[asn] = candidate
+            if mode != self.SINGLE and candidate[4] is not None:
+                ambiguous.add(asn)
+            else:
+                ambiguous.discard(asn)
+                heapq.heappush(heap, (-candidate[0], next(self.sequence), asn, candidate))
+
+        # Drop the replaced candidates once they make most of the heap
+        if len(heap) > 2 * len(candidates) + 64:
+            heap[:] = [entry for entry in heap if candidates.get(entry[2]) is entry[3]]
+            heapq.heapify(heap)
+
+    def best(self, mode, W_nb, union=True):
+        """
+        Returns the candidates with the highest FM score, all of them if union, the first one
+        in the order of nodes_forward otherwise (the first of its best edges)
+        """
+        self.update()
+
+        candidates = self.candidates[mode]
+        heap = self.heaps[mode]
+        best = []
+        while heap:
+            entry = heap[0]
+            if candidates.get(entry[2]) is not entry[3]:
+                heapq.heappop(heap)
+            elif not best or entry[0] <= best[0][0] + KEY_TOLERANCE:
+                best.append(heapq.heappop(heap))
+            else:
+                break
+        for entry in best:
+            heapq.heappush(heap, entry)
+
+        # The FM scores of the candidates with the best keys and of the greedy sets which depend on W_nb,
+        # computed like the reference: (AS number, edges, TP, FP, FM score)
+        scored = []
+        for _, _, asn, candidate in best:
+            for edges, TP, FP in ([([edge], TP, FP) for edge, TP, FP in candidate[4]] if not union else
+                                  [candidate[1:4]]):
+                scored.append((asn, edges, TP, FP, fowlkes_mallows(TP, FP, W_nb - TP, self.p_w, self.r_w)))
+        for asn in self.ambiguous[mode]:
+            scored.append((asn,) + tuple(self.greedy_reference(candidates[asn][4], W_nb)))
+
+        if not scored:
+            return set(), 0, 0, 0, 0
+        best_fm_score = max(x[4] for x in scored)
+        scored = [x for x in scored if x[4] == best_fm_score]
+
+        if not union:
+            asns = set(x[0] for x in scored)
+            if len(asns) > 1:
+                first = next(asn for asn in self.G_W.nodes_forward if asn in asns)
+                scored = [x for x in scored if x[0] == first]
+            asn, edges, TP, FP, fm_score = scored[0]
+            return set(edges), best_fm_score, TP, FP, W_nb - TP
+
+        asn, edges, TP, FP, fm_score = scored[0]
+        best_edge_set = set(edges)
+        if len(scored) > 1:
+            for x in scored[1:]:
+                best_edge_set.update(x[1])
+            return best_edge_set, best_fm_score, -1, -1, -1
+        return best_edge_set, best_fm_score, TP, FP, W_nb - TP
+
+    def single(self, W_nb):
+        return self.best(self.SINGLE, W_nb, union=False)
+
+    def forward(self, W_nb):
+        return self.best(self.FORWARD, W_nb)
+
+    def backward(self, W_nb):
+        return self.best(self.BACKWARD, W_nb)
+
 def find_best_fmscore_naive(G, G_W, W_nb, from_node, p_w, r_w):
     # Compute a list of outgoing edges with their TP, FP and FN values
     ngh_fm = []
@@ -47,7 +418,11 @@ def find_best_fmscore_naive(G, G_W, W_nb, from_node, p_w, r_w):
 
     return current_set, current_fmscore, current_TP, current_FP, current_FN
 
-def find_best_fmscore_single(G, G_W, W_nb, p_w=1, r_w=1):
+"""
+The reference BPA functions below score the edges one at a time. They give the
+same results as the vectorised ones, which are used by the SWIFT workers.
+"""
+def find_best_fmscore_single_reference(G, G_W, W_nb, p_w=1, r_w=1):
 
     best_fm_score = 0
     best_edge_set = set()
@@ -90,7 +465,7 @@ There is a similar function which computes this in a backward fashion, i.e. retu
 set of links with the highest FM score, and which have the same
 destination node.
 """
-def find_best_fmscore_forward(G, G_W, W_nb, p_w=1, r_w=1):
+def find_best_fmscore_forward_reference(G, G_W, W_nb, p_w=1, r_w=1):
 
     best_fm_score = 0
     best_edge_set = set()
@@ -161,7 +536,7 @@ Each set of edges considered here have a common destination node (backward).
 The links need to have an AS in common (where the failure occured).
 For the moment, we only focus on withdraws.
 """
-def find_best_fmscore_backward(G, G_W, W_nb, p_w, r_w):
+def find_best_fmscore_backward_reference(G, G_W, W_nb, p_w, r_w):
 
     best_fm_score = 0
     best_edge_set = set()
@@ -225,183 +600,101 @@ def find_best_fmscore_backward(G, G_W, W_nb, p_w, r_w):
     return best_edge_set, best_fm_score, best_TP, best_FP, best_FN
 
 
-if __name__ == '__main__':
-    import networkx as nx
-    from random import randint
-    import pickle
-
-    """G = pickle.load(open('G.pickled', 'r'))
-    G_W = pickle.load(open('G.pickled', 'r'))
-
-    print 'Loaded!'
+"""
+Random topology for the comparisons below: nb_paths AS paths of up to 6 ASes
+out of nb_ases, each of 1 to 3 prefixes, of which withdrawn (ratio) move from
+G to G_W like in the SWIFT peers. The fewer ASes, the more ties. Returns the
+topologies, the number of withdrawals and the lists of the (AS path, number
+of prefixes) in G and in G_W.
+"""
+def random_topology(rng, nb_ases, nb_paths, withdrawn=0.3):
+    G = ASTopology(1, silent=True)
+    G_W = ASTopology(1, silent=True)
+    paths = ([], [])
+    for _ in range(nb_paths):
+        random_change(rng, G, G_W, paths, nb_ases, 'withdraw' if rng.random() < withdrawn else 'announce')
+    return G, G_W, sum(nb for as_path, nb in paths[1]), paths[0], paths[1]
 
-    W_queue = range(0, 40000)
+"""
+Announces a new random AS path (announce), withdraws one of G (withdraw), or
+drops one of G_W like the end of the withdrawal window (expire). Returns the
+change of the number of withdrawals.
+"""
+def random_change(rng, G, G_W, paths, nb_ases, change):
+    announced, withdrawn = paths
+    if change == 'expire' and withdrawn:
+        as_path, nb = withdrawn.pop(rng.randrange(len(withdrawn)))
+        G_W.remove(as_path, nb=nb)
+        return -nb
+    if change == 'withdraw' and announced and rng.random() < 0.5:
+        as_path, nb = announced.pop(rng.randrange(len(announced)))
+        G.remove(as_path, nb=nb)
+    else:
+        as_path = rng.sample(range(1, nb_ases+1), rng.randint(2, min(6, nb_ases)))
+        nb = rng.randint(1, 3)
+    if change == 'announce':
+        G.add(as_path, nb=nb)
+        announced.append((as_path, nb))
+        return 0
+    G_W.add(as_path, nb=nb)
+    withdrawn.append((as_path, nb))
+    return nb
 
-    best_edge_set, best_fm_score = find_best_fmscore_forward(G, None, G_W, None, W_queue)
-    print best_edge_set
-    print best_fm_score"""
 
-
-    TP = 2252. # hit
-    FP = 0 # predicted
-    FN = 17072.-2252. # missed
-
-    precision = TP/(TP+FP)
-    recall = TP/(TP+FN)
-
-    print precision
-    print recall
-    print fowlkes_mallows(TP, FP, FN, 1, 3)
-
-    print '---'
-
-
-    TP = 3747. # hit
-    FP = 258547.-3747. # predicted
-    FN = 17072.-3747. # missed
-
-    precision = TP/(TP+FP)
-    recall = TP/(TP+FN)
-
-    print precision
-    print recall
-    print fowlkes_mallows(TP, FP, FN, 1, 3)
-
-    print '---'
-
-    TP = 3747+2252. # hit
-    FP = 258547.-3747. # predicted
-    FN = 17072.-3747.-2252. # missed
-
-    precision = TP/(TP+FP)
-    recall = TP/(TP+FN)
-
-    print precision
-    print recall
-    print fowlkes_mallows(TP, FP, FN, 1, 3)
-
-    print '---'
-
-    TP = 1070. # hit
-    FP = 1813.-1070. # predicted
-    FN = 17072.-1070. # missed
-
-    precision = TP/(TP+FP)
-    recall = TP/(TP+FN)
-
-    print precision
-    print recall
-    print fowlkes_mallows(TP, FP, FN, 1, 3)
-    """G = nx.DiGraph()
-    G_W = nx.DiGraph()
-
-    edges_list = [(1,2),(1,3),(2,5),(2,6),(3,4),(5,7),(5,8),(5,9),(5,10),(7,11),(7,12),(8,13),(8,14),(10,15)]
-    G.add_edges_from(edges_list)
-    edges_list = [(1,2),(1,3),(2,5),(2,6),(3,4),(5,7),(5,8),(5,9),(5,10),(7,11),(8,13),(8,14),(10,15)]
-    G_W.add_edges_from(edges_list)
-
-    G[1][2]['prefix_counter'] = 400.
-    G[2][5]['prefix_counter'] = 301.
-    G[1][3]['prefix_counter'] = 495.
-    G[2][6]['prefix_counter'] = 99.
-    G[3][4]['prefix_counter'] = 296.
-    G[5][7]['prefix_counter'] = 85.
-    G[5][8]['prefix_counter'] = 88.
-    G[5][9]['prefix_counter'] = 87.
-    G[5][10]['prefix_counter'] = 99.
-    G[7][11]['prefix_counter'] = 83.
-    G[7][12]['prefix_counter'] = 10.
-    G[8][13]['prefix_counter'] = 40.
-    G[8][14]['prefix_counter'] = 49.
-    G[10][15]['prefix_counter'] = 99.
-
-    G_W[1][2]['prefix_counter'] = 100.
-    G_W[2][5]['prefix_counter'] = 99.
-    G_W[1][3]['prefix_counter'] = 5.
-    G_W[2][6]['prefix_counter'] = 1.
-    G_W[3][4]['prefix_counter'] = 4.
-    G_W[5][7]['prefix_counter'] = 50.
-    G_W[5][8]['prefix_counter'] = 22.
-    G_W[5][9]['prefix_counter'] = 26.
-    G_W[5][10]['prefix_counter'] = 1.
-    G_W[7][11]['prefix_counter'] = 50.
-    G_W[8][13]['prefix_counter'] = 20.
-    G_W[8][14]['prefix_counter'] = 2.
-    G_W[10][15]['prefix_counter'] = 1.
-
-    tmp_list = range(0, 105)
-
-    best_edge_set, best_fm_score = find_best_fmscore_forward(G, None, G_W, None, tmp_list)
-    print best_edge_set
-    print best_fm_score
-
-    best_edge_set, best_fm_score = find_best_fmscore_backward(G, None, G_W, None, tmp_list)
-    print best_edge_set
-    print best_fm_score"""
-
-    """edges_list = [(1,2),(1,3),(1,4),(2,5),(2,6),(3,5),(3,6),(4,5),(4,6),(5,7),(6,7)]
-    G.add_edges_from(edges_list)
-    edges_list = [(1,2),(1,3),(1,4),(2,5),(2,6),(3,6),(4,6),(6,7)]
-    G_W.add_edges_from(edges_list)
-
-    G[1][2]['prefix_counter'] = 85.
-    G[1][3]['prefix_counter'] = 87.
-    G[1][4]['prefix_counter'] = 99.
-    G[2][5]['prefix_counter'] = 49.
-    G[2][6]['prefix_counter'] = 36.
-    G[3][5]['prefix_counter'] = 50.
-    G[3][6]['prefix_counter'] = 37.
-    G[4][5]['prefix_counter'] = 50.
-    G[4][6]['prefix_counter'] = 49.
-    G[5][7]['prefix_counter'] = 150.
-    G[6][7]['prefix_counter'] = 93.
-
-    G_W[1][2]['prefix_counter'] = 15.
-    G_W[1][3]['prefix_counter'] = 13.
-    G_W[1][4]['prefix_counter'] = 1.
-    G_W[2][5]['prefix_counter'] = 1.
-    G_W[2][6]['prefix_counter'] = 14.
-    G_W[3][6]['prefix_counter'] = 13.
-    G_W[4][6]['prefix_counter'] = 1.
-    G_W[6][7]['prefix_counter'] = 7.
-
-    tmp_list = range(0, 29)
-
-    best_edge_set, best_fm_score = find_best_fmscore_forward(G, None, G_W, None, tmp_list)
-    print best_edge_set
-    print best_fm_score
-
-    best_edge_set, best_fm_score = find_best_fmscore_backward(G, None, G_W, None, tmp_list)
-    print best_edge_set
-    print best_fm_score"""
-
-    """#Dtmp=nx.gn_graph(1000, kernel=lambda x:x**3)    # the GN graph
-    Gtmp=G=nx.scale_free_graph(5000)
-    print len(Gtmp.edges())
-
-    G = nx.DiGraph()
-    G.add_edges_from(Gtmp.edges())
-    DG = G.copy()
-    #print G.nodes()
-
-    for e in G.edges():
-        G[e[0]][e[1]]['prefix_counter'] = float(randint(0, 1000))
-    print G
-
-    G_W = G.copy()
-    for e in G_W.edges():
-        G_W[e[0]][e[1]]['prefix_counter'] = float(randint(0, G[e[0]][e[1]]['prefix_counter']))
-
-    tmp_list = range(0, 1500)
-
-    for i in G:
-        for j in G[i]:
-            print str(i)+' '+str(j)+' '+str(G[i][j]['prefix_counter'])+'\t'+str(i)+' '+str(j)+' '+str(G_W[i][j]['prefix_counter'])
-
-    best_edge_set, best_fm_score = find_best_fmscore_forward(G, None, G_W, None, tmp_list)
-    print best_edge_set
-    print best_fm_score
-
-    best_edge_set, best_fm_score = find_best_fmscore_backward(G, None, G_W, None, tmp_list)
-    print best_edge_set
-    print best_fm_score"""
+if __name__ == '__main__':
+    import argparse
+    import random
+
+    # Compares the vectorised BPA functions with the reference ones, and IncrementalBPA with the
+    # vectorised ones, which they must match exactly
+    parser = argparse.ArgumentParser(description='Compare the vectorised and incremental BPA with the reference on random topologies')
+    parser.add_argument('--topologies', type=int, default=300, help='number of random topologies')
+    parser.add_argument('--ases', type=int, default=20, help='number of ASes of a topology')
+    parser.add_argument('--paths', type=int, default=100, help='number of AS paths of a topology')
+    parser.add_argument('--rounds', type=int, default=5, help='rounds of changes of the incremental BPA')
+    parser.add_argument('--changes', type=int, default=10, help='changes of the topologies per round')
+    parser.add_argument('--p_w', type=float, default=1., help='precision weight')
+    parser.add_argument('--r_w', type=float, default=1., help='recall weight')
+    parser.add_argument('--seed', type=int, default=0)
+    args = parser.parse_args()
+
+    rng = random.Random(args.seed)
+    functions = [('single', find_best_fmscore_single, find_best_fmscore_single_reference),
+                 ('forward', find_best_fmscore_forward, find_best_fmscore_forward_reference),
+                 ('backward', find_best_fmscore_backward, find_best_fmscore_backward_reference)]
+    mismatches = dict((name, 0) for name, _, _ in functions)
+    elapsed = dict((name, [0., 0.]) for name, _, _ in functions)
+
+    for i in range(args.topologies):
+        G, G_W, W_nb, _, _ = random_topology(rng, args.ases, args.paths)
+        for name, vectorised, reference in functions:
+            start = time.time()
+            res = vectorised(G, G_W, W_nb, args.p_w, args.r_w)
+            elapsed[name][0] += time.time() - start
+            start = time.time()
+            expected = reference(G, G_W, W_nb, args.p_w, args.r_w)
+            elapsed[name][1] += time.time() - start
+            if res != expected:
+                mismatches[name] += 1
+                print 'Topology %d, %s: %s instead of %s' % (i, name, res, expected)
+
+    # IncrementalBPA, kept up to date over rounds of changes, against the vectorised functions: the
+    # reference ones fail on the backward edges without withdrawals left, once some expired
+    incremental_mismatches = dict((name, 0) for name, _, _ in functions)
+    for i in range(args.topologies):
+        G, G_W, W_nb, announced, withdrawn = random_topology(rng, args.ases, args.paths)
+        incremental = IncrementalBPA(G, G_W, args.p_w, args.r_w)
+        for round in range(args.rounds):
+            for _ in range(args.changes):
+                W_nb += random_change(rng, G, G_W, (announced, withdrawn), args.ases, rng.choice(('announce', 'withdraw', 'expire')))
+            for name, vectorised, _ in functions:
+                res = getattr(incremental, name)(W_nb)
+                expected = vectorised(G, G_W, W_nb, args.p_w, args.r_w)
+                if res != expected:
+                    incremental_mismatches[name] += 1
+                    print 'Topology %d, round %d, incremental %s: %s instead of %s' % (i, round, name, res, expected)
+
+    for name, _, _ in functions:
+        print '%-8s %d mismatches out of %d, %.2f ms vectorised, %.2f ms reference, incremental: %d mismatches out of %d' % \
+            (name, mismatches[name], args.topologies, 1000*elapsed[name][0]/args.topologies, 1000*elapsed[name][1]/args.topologies,
+             incremental_mismatches[name], args.topologies*args.rounds)
@@ -0,0 +1,132 @@
+import cPickle as pickle
+from multiprocessing.connection import Client
+import json
+import Queue
+import socket
+import struct
+from threading import Lock
+import time
+
+
+"""
+Frames exchanged between the ExaBGP side process (client.py) and the route
+server (server.py). A frame carries all the lines read at once, each one
+prefixed with its length:
+    FRAME_LINES     type, then (length, line)*
+    FRAME_OBJECTS   type, then the pickled list of the ExaBGP messages,
+                    already parsed from JSON by the bridge
+Frames written by the previous bridge, one pickled line each, are still
+understood.
+"""
+FRAME_LINES = 1
+FRAME_OBJECTS = 2
+
+FRAME_TYPE = struct.Struct('!B')
+LENGTH = struct.Struct('!I')
+
+# lines put in one frame at most
+MAX_FRAME_LINES = 1000
+
+
+def encode_lines(lines):
+    parts = [FRAME_TYPE.pack(FRAME_LINES)]
+    for line in lines:
+        parts.append(LENGTH.pack(len(line)))
+        parts.append(line)
+    return ''.join(parts)
+
+
+def encode_objects(lines):
+    "Parse the JSON lines of ExaBGP, so that the route server does not have to"
+    return FRAME_TYPE.pack(FRAME_OBJECTS) + pickle.dumps([json.loads(line) for line in lines], pickle.HIGHEST_PROTOCOL)
+
+
+def decode_frame(data):
+    "Returns the lines (or parsed messages) of a frame"
+    frame_type = ord(data[0]) if data else None
+    if frame_type == FRAME_LINES:
+        items = []
+        offset = FRAME_TYPE.size
+        while offset < len(data):
+            length, = LENGTH.unpack_from(data, offset)
+            offset += LENGTH.size
+            items.append(data[offset:offset + length])
+            offset += length
+        return items
+    elif frame_type == FRAME_OBJECTS:
+        return pickle.loads(data[FRAME_TYPE.size:])
+    # previous bridge
+    return [pickle.loads(data)]
+
+
+def drain(queue, first, max_items=MAX_FRAME_LINES):
+    "Returns first and the items already waiting in the queue, without blocking"
+    items = [first]
+    while len(items) < max_items:
+        try:
+            items.append(queue.get_nowait())
+        except Queue.Empty:
+            break
+    return items
+
+
+"""
+Client side of the bridge. The connection to the route server is opened on
+first use, and opened again with an exponential backoff whenever it is
+lost, so that a restart of the route server does not kill ExaBGP's process.
+"""
+class ReconnectingClient(object):
+    def __init__(self, address, authkey, logger=None, min_backoff=0.1, max_backoff=10.):
+        self.address = address
+        self.authkey = authkey
+        self.logger = logger
+        self.min_backoff = min_backoff
+        self.max_backoff = max_backoff
+
+        self.lock = Lock()
+        self.conn = None
+
+    def get(self):
+        "Returns the current connection, connects first if there is none"
+        with self.lock:
+            backoff = self.min_backoff
+            while self.conn is None:
+                try:
+                    self.conn = Client(self.address, authkey=self.authkey)
+                    if self.logger:
+                        self.logger.info('Connected to the route server at %s', self.address)
+                except (socket.error, EOFError, IOError) as e:
+                    if self.logger:
+                        self.logger.debug('Cannot connect to the route server (%s), retrying in %.1fs', e, backoff)
+                    time.sleep(backoff)
+                    backoff = min(2 * backoff, self.max_backoff)
+            return self.conn
+
+    def drop(self, conn):
+        with self.lock:
+            if self.conn is conn:
+                self.conn = None
+                if self.logger:
+                    self.logger.info('Lost the connection to the route server')
+        try:
+            conn.close()
+        except (IOError, OSError):
+            pass
+
+    def send_bytes(self, data):
+        "Sends a frame, on a new connection if the current one is lost"
+        while True:
+            conn = self.get()
+            try:
+                conn.send_bytes(data)
+                return
+            except (EOFError, IOError, socket.error):
+                self.drop(conn)
+
+    def recv_bytes(self):
+        while True:
+            conn = self.get()
+            try:
+                return conn.recv_bytes()
+            except (EOFError, IOError, socket.error):
+                self.drop(conn)
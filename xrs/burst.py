@@ -1,3 +1,17 @@
+from burst_log import log_writer
+from prefix_bitmap import PrefixBitmap, prefix_ids
+
+
+# Lines of the burst files, formatted by the log writer
+def real_line(prefix, time, mtype, tag, as_path):
+    return prefix+'|'+str(int(time))+'|'+mtype+'|'+tag+'|'+' '.join(map(str, as_path))+'\n'
+
+def predicted_prefix_line(prefix, time, burst_size, encoded, depth):
+    return 'PREFIX|'+prefix+'|'+str(int(time))+'|'+str(burst_size)+'|'+('Y' if encoded else 'N')+'|'+str(depth)+'\n'
+
+def predicted_edge_line(edge, time, burst_size, depth):
+    return 'EDGE|'+str(edge[0])+','+str(edge[1])+'|'+str(int(time))+'|'+str(burst_size)+'|'+str(depth)+'\n'
+
 
 class Burst:
 
@@ -10,13 +24,15 @@ class Burst:
         self.encoding = encoding
         self.last_ts = start_time
 
-        # Variable to keep the number of withdrawals removed from the queue during the burst
+        # Variable to keep the withdrawals removed from the queue during the burst (buckets
+        # of the WithdrawalWindow), and their number
         self.deleted_from_W_queue = []
+        self.nb_deleted_from_W_queue = 0
 
-        # Set with the predicted prefixes
-        self.predicted_prefixes = set()
-        # Set with the real prefixes
-        self.real_prefixes = set()
+        # Set with the ids of the predicted prefixes
+        self.predicted_prefixes = PrefixBitmap()
+        # Set with the ids of the real prefixes
+        self.real_prefixes = PrefixBitmap()
 
         # Set with the failed AS-edges
         self.as_edges = set()
@@ -27,14 +43,15 @@ class Burst:
         # Info file
         self.info_file = outdir+'/bursts_info'
 
-        # Open the file for the real prefixes of this burst
-        self.fd_real = open(outdir+'/'+str(self.peer_id)+'_'+str(self.start_time)+'_real', 'w', 1)
-        self.fd_predicted = open(outdir+'/'+str(self.peer_id)+'_'+str(self.start_time)+'_predicted', 'w', 1)
+        # Open the files for the real and the predicted prefixes of this burst, written in the background
+        self.fd_real = log_writer.open(outdir+'/'+str(self.peer_id)+'_'+str(self.start_time)+'_real')
+        self.fd_predicted = log_writer.open(outdir+'/'+str(self.peer_id)+'_'+str(self.start_time)+'_predicted')
         self.fd_predicted.write('# Started burst!\n#100thTS\t'+str(ts_100th_w)+'\n')
         self.fd_real.write('# Started burst!\n#100thTS\t'+str(ts_100th_w)+'\n')
 
     """
-    Stop the burst when it expires. This essentially means close the file descriptors.
+    Stop the burst when it expires. This essentially means close the file descriptors
+    (once the log writer wrote their lines).
     """
     def stop(self, stop_time):
         self.fd_real.close()
@@ -53,34 +70,33 @@ class Burst:
     Add a real prefix to this burst
     """
     def add_real_prefix(self, time, prefix, mtype, old_as_path):
+        prefix_id = prefix_ids.intern(prefix)
         if not self.silent:
             tag = 'B' # Used to indicate if this prefixe arrived before or after the prediction
             if self.prediction_done:
                 tag = 'A'
 
             if mtype == 'W':
-                if prefix not in self.real_prefixes:
-                    self.fd_real.write(prefix+'|'+str(int(time))+'|W|'+str(tag)+'|'+str(' '.join(map(lambda x:str(x), old_as_path)))+'\n')
+                if prefix_id not in self.real_prefixes:
+                    self.fd_real.write_record(real_line, prefix, time, 'W', tag, old_as_path)
 
             elif mtype == 'A':
-                self.fd_real.write(prefix+'|'+str(int(time))+'|A|'+str(tag)+'|'+str(' '.join(map(lambda x:str(x), old_as_path)))+'\n')
+                self.fd_real.write_record(real_line, prefix, time, 'A', tag, old_as_path)
 
         # Add the prefix in real set of withdrawn prefixes
         if mtype == 'W':
-            self.real_prefixes.add(prefix)
+            self.real_prefixes.add(prefix_id)
 
     """
     Add a predicted prefix in the predicted set of prefix of this burst.
     """
     def add_predicted_prefix(self, time, prefix, encoded, depth):
         if not self.silent:
-            if prefix not in self.predicted_prefixes:
+            prefix_id = prefix_ids.intern(prefix)
+            if prefix_id not in self.predicted_prefixes:
                 if encoded:
-                    self.predicted_prefixes.add(prefix)
-                    self.fd_predicted.write('PREFIX|'+prefix+'|'+str(int(time))+'|'+str(len(self))+'|'+'Y|'+str(depth)+'\n')
-
-                else:
-                    self.fd_predicted.write('PREFIX|'+prefix+'|'+str(int(time))+'|'+str(len(self))+'|'+'N|'+str(depth)+'\n')
+                    self.predicted_prefixes.add(prefix_id)
+                self.fd_predicted.write_record(predicted_prefix_line, prefix, time, len(self), encoded, depth)
 
 
     """
@@ -96,7 +112,7 @@ class Burst:
 
                 self.as_edges.add(edge)
                 if not self.silent:
-                    self.fd_predicted.write('EDGE|'+str(edge[0])+','+str(edge[1])+'|'+str(int(time))+'|'+str(len(self))+'|'+str(depth)+'\n')
+                    self.fd_predicted.write_record(predicted_edge_line, edge, time, len(self), depth)
                 yield edge
 
     """
@@ -0,0 +1,105 @@
+import atexit
+from collections import deque
+from threading import Lock, Thread
+import time
+import traceback
+
+
+# Record closing a file
+CLOSE = object()
+
+
+"""
+Writes the log files of the SWIFT peers (the real and predicted prefixes of
+the bursts, the status of the encodings) in a thread of its own, so that the
+peers do not wait on file I/O in the middle of a burst.
+
+The peers only append records to a deque: a record is a line, or a function
+formatting the line and its arguments, so that the formatting is done by the
+writer too. The writer formats and writes the records every interval
+seconds, through buffers of buffer_size bytes, and flushes the files then.
+The files are opened by the peers, so that an error still shows up where it
+used to, and closed by the writer once their records are written.
+
+The writer is shared by the peers of the process (log_writer), and writes
+the records left on exit.
+"""
+class LogWriter(object):
+    def __init__(self, buffer_size=1 << 20, interval=1., logger=None):
+        self.buffer_size = buffer_size
+        self.interval = interval
+        self.logger = logger
+
+        self.records = deque()  # (LogFile, format function or None, arguments or line)
+        # Taken while writing the records, by the writer and the flush on exit only: the peers never wait on it
+        self.lock = Lock()
+        self.files = set()      # the files opened, to flush them once written
+        self.files_lock = Lock()
+        self.thread = None
+        self.nb_records = 0
+
+    def open(self, path):
+        "Opens a file written in the background"
+        if self.thread is None:
+            with self.files_lock:
+                if self.thread is None:
+                    self.thread = Thread(target=self.run)
+                    self.thread.daemon = True
+                    self.thread.start()
+                    atexit.register(self.flush)
+        return LogFile(self, path)
+
+    def run(self):
+        while True:
+            time.sleep(self.interval)
+            try:
+                self.flush()
+            except Exception:
+                if self.logger:
+                    self.logger.error('Log writer failed: ' + traceback.format_exc())
+                else:
+                    traceback.print_exc()
+
+    def flush(self):
+        "Writes the records appended so far (not the ones appended meanwhile), and flushes the files"
+        with self.lock:
+            records = self.records
+            for _ in xrange(len(records)):
+                log_file, format, args = records.popleft()
+                if format is None:
+                    log_file.fd.write(args)
+                elif format is CLOSE:
+                    log_file.fd.close()
+                    with self.files_lock:
+                        self.files.discard(log_file)
+                else:
+                    log_file.fd.write(format(*args))
+                self.nb_records += 1
+
+            with self.files_lock:
+                files = list(self.files)
+            for log_file in files:
+                log_file.fd.flush()
+
+
+class LogFile(object):
+    __slots__ = ('writer', 'fd')
+
+    def __init__(self, writer, path):
+        self.writer = writer
+        self.fd = open(path, 'w', writer.buffer_size)
+        with writer.files_lock:
+            writer.files.add(self)
+
+    def write(self, line):
+        self.writer.records.append((self, None, line))
+
+    def write_record(self, format, *args):
+        "Writes format(*args), formatted in the background"
+        self.writer.records.append((self, format, args))
+
+    def close(self):
+        self.writer.records.append((self, CLOSE, None))
+
+
+log_writer = LogWriter()
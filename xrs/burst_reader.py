@@ -0,0 +1,132 @@
+import argparse
+import os
+import re
+
+
+"""
+Reader of the burst files written by the SWIFT peers (burst_outdir), for the
+offline analysis of the predictions. The files of a burst are named after
+the peer and the time the burst started:
+
+<peer>_<start>_real         the updates received during the burst
+    prefix|time|W or A|B or A (before or after the first prediction)|AS path (the old one for a withdrawal)
+<peer>_<start>_predicted    the AS links and prefixes predicted, and the predictions
+    EDGE|from AS,to AS|time|burst size|depth
+    PREFIX|prefix|time|burst size|Y or N (encoded or not)|depth
+    PREDICTION|algorithm|burst size|fm score|TP|FP|FN, followed by
+    PREDICTION_EDGE|from AS-to AS,...|depth
+    PREDICTION_END and PREDICTION_END_EDGE, for the prediction at the end of the burst
+
+Both start with the header '# Started burst!' and '#100thTS<tab>time of the
+100th withdrawal of the burst'.
+"""
+
+BURST_FILE = re.compile(r'^(.+)_([0-9]+)_(real|predicted)$')
+
+
+def read_header(line, header):
+    if line.startswith('#100thTS'):
+        value = line.split('\t')[1]
+        header['ts_100th_w'] = float(value) if '.' in value else int(value)
+
+
+def read_real(path):
+    "Returns the header and the updates of a _real file, as (prefix, time, type, tag, AS path)"
+    header = {}
+    updates = []
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith('#'):
+                read_header(line, header)
+                continue
+            prefix, time, mtype, tag, as_path = line.split('|')
+            updates.append((prefix, int(time), mtype, tag, tuple(int(asn) for asn in as_path.split())))
+    return header, updates
+
+
+def read_edges(edges):
+    "AS links of a PREDICTION_EDGE line"
+    return [tuple(int(asn) for asn in edge.split('-')) for edge in edges.split(',') if edge]
+
+
+def read_predicted(path):
+    """
+    Returns the header and the content of a _predicted file: 'edges', as
+    (AS link, time, burst size, depth), 'prefixes', as (prefix, time, burst
+    size, encoded, depth), and 'predictions', as dicts, in the order of the file
+    """
+    header = {}
+    res = {'edges': [], 'prefixes': [], 'predictions': []}
+    with open(path) as f:
+        for line in f:
+            line = line.rstrip('\n')
+            if line.startswith('#'):
+                read_header(line, header)
+                continue
+            fields = line.split('|')
+            if fields[0] == 'EDGE':
+                res['edges'].append((tuple(int(asn) for asn in fields[1].split(',')), int(fields[2]), int(fields[3]), int(fields[4])))
+            elif fields[0] == 'PREFIX':
+                res['prefixes'].append((fields[1], int(fields[2]), int(fields[3]), fields[4] == 'Y', int(fields[5])))
+            elif fields[0] in ('PREDICTION', 'PREDICTION_END'):
+                res['predictions'].append({'end': fields[0] == 'PREDICTION_END', 'algorithm': fields[1],
+                                           'burst_size': int(fields[2]), 'fm_score': fields[3],
+                                           'TP': int(fields[4]), 'FP': int(fields[5]), 'FN': int(fields[6])})
+            elif fields[0] in ('PREDICTION_EDGE', 'PREDICTION_END_EDGE'):
+                res['predictions'][-1]['edges'] = read_edges(fields[1])
+                res['predictions'][-1]['depth'] = int(fields[2])
+    return header, res
+
+
+def bursts(outdir, peer_id=None):
+    "Returns the sorted (peer, start time) of the bursts of a directory"
+    res = set()
+    for name in os.listdir(outdir):
+        match = BURST_FILE.match(name)
+        if match and (peer_id is None or match.group(1) == peer_id):
+            res.add((match.group(1), int(match.group(2))))
+    return sorted(res)
+
+
+def burst_summary(outdir, peer_id, start_time):
+    "Returns the numbers of updates and predicted prefixes of a burst, and how many of those were withdrawn"
+    prefix = os.path.join(outdir, str(peer_id)+'_'+str(start_time))
+    _, updates = read_real(prefix+'_real') if os.path.exists(prefix+'_real') else ({}, [])
+    _, predicted = read_predicted(prefix+'_predicted') if os.path.exists(prefix+'_predicted') else ({}, {'edges': [], 'prefixes': [], 'predictions': []})
+
+    withdrawn = {}  # prefix -> time of its first withdrawal
+    for p, time, mtype, tag, as_path in updates:
+        if mtype == 'W' and p not in withdrawn:
+            withdrawn[p] = time
+
+    encoded = dict((p, time) for p, time, burst_size, is_encoded, depth in predicted['prefixes'] if is_encoded)
+    true_positives = [p for p in encoded if p in withdrawn]
+
+    return {'peer_id': peer_id,
+            'start_time': start_time,
+            'withdrawals': len(withdrawn),
+            'announcements': sum(1 for update in updates if update[2] == 'A'),
+            'withdrawals_after_prediction': sum(1 for update in updates if update[2] == 'W' and update[3] == 'A'),
+            'edges': len(predicted['edges']),
+            'predicted': len(encoded),
+            'predicted_not_encoded': len(set(p for p, time, burst_size, is_encoded, depth in predicted['prefixes'] if not is_encoded)),
+            'true_positives': len(true_positives),
+            # predicted before (or in the same second as) their withdrawal
+            'predicted_in_time': sum(1 for p in true_positives if encoded[p] <= withdrawn[p]),
+            'predictions': len(predicted['predictions'])}
+
+
+if __name__ == '__main__':
+    # summary of the bursts of a burst_outdir, one burst per line
+    parser = argparse.ArgumentParser(description='Summary of the bursts written by the SWIFT peers')
+    parser.add_argument('outdir', help='directory of the burst files (burst_outdir)')
+    parser.add_argument('--peer', default=None, help='only the bursts of this peer')
+    args = parser.parse_args()
+
+    columns = ('peer_id', 'start_time', 'withdrawals', 'announcements', 'withdrawals_after_prediction', 'edges',
+               'predicted', 'predicted_not_encoded', 'true_positives', 'predicted_in_time', 'predictions')
+    print '\t'.join(columns)
+    for peer_id, start_time in bursts(args.outdir, args.peer):
+        summary = burst_summary(args.outdir, peer_id, start_time)
+        print '\t'.join(str(summary[column]) for column in columns)
@@ -3,7 +3,7 @@
 #  Muhammad Shahbaz (muhammad.shahbaz@gatech.edu)
 #  Arpit Gupta
 
-from multiprocessing.connection import Client
+import argparse
 import os
 import sys
 from threading import Thread
@@ -13,67 +13,74 @@ if np not in sys.path:
     sys.path.append(np)
 import util.log
 
+from bridge import ReconnectingClient, encode_lines, encode_objects, decode_frame, MAX_FRAME_LINES
+
 
 sendLogger = util.log.getLogger('XRS-send')
 recvLogger = util.log.getLogger('XRS-recv')
 
+# bytes read from ExaBGP at once
+READ_SIZE = 65536
+
 '''Write output to stdout'''
-def _write(stdout,data):
-    stdout.write(data + '\n')
+def _write(stdout,lines):
+    stdout.write(''.join(line + '\n' for line in lines))
     stdout.flush()
 
 ''' Sender function '''
-def _sender(conn,stdin):
-    # Warning: when the parent dies we are seeing continual
-    # newlines, so we only access so many before stopping
-    counter = 0
+def _sender(conn,stdin,parse):
+    # all the lines read at once go in the same frames. The read returns
+    # nothing once ExaBGP, our parent, is gone.
+    fd = stdin.fileno()
+    pending = ''
 
     while True:
-        try:
-            line = stdin.readline().strip()
+        data = os.read(fd, READ_SIZE)
+        if not data:
+            break
 
-            if line == "":
-                counter += 1
-                if counter > 100:
-                    break
-                continue
-            counter = 0
+        lines = (pending + data).split('\n')
+        pending = lines.pop()
+        lines = [line.strip() for line in lines if line.strip()]
 
-            conn.send(line)
+        for i in range(0, len(lines), MAX_FRAME_LINES):
+            batch = lines[i:i + MAX_FRAME_LINES]
+            try:
+                frame = encode_objects(batch) if parse else encode_lines(batch)
+            except ValueError:
+                # not JSON, the route server deals with it
+                frame = encode_lines(batch)
+            conn.send_bytes(frame)
 
-            sendLogger.debug(line)
-
-        except:
-            pass
+        sendLogger.debug('Sent %d lines', len(lines))
 
 ''' Receiver function '''
 def _receiver(conn,stdout):
 
     while True:
-        try:
-            line = conn.recv()
-
-            if line == "":
-                continue
+        lines = decode_frame(conn.recv_bytes())
+        ''' example: announce route 1.2.3.4 next-hop 5.6.7.8 as-path [ 100 200 ] '''
+        _write(stdout, [line for line in lines if line != ""])
 
-            _write(stdout, line)
-            ''' example: announce route 1.2.3.4 next-hop 5.6.7.8 as-path [ 100 200 ] '''
-
-            #recvLogger.debug(line)
-
-        except:
-            pass
+        #recvLogger.debug(lines)
 
 ''' main '''
 if __name__ == '__main__':
 
-    conn = Client(('localhost', 6000), authkey='xrs')
+    parser = argparse.ArgumentParser()
+    # with a sharded route server, each ExaBGP instance runs the client of its shard
+    parser.add_argument('port', nargs='?', type=int, default=6000, help='port of the route server (default: 6000)')
+    parser.add_argument('--parse', action='store_true', help='parse the JSON messages of ExaBGP in this process')
+    args = parser.parse_args()
+
+    conn = ReconnectingClient(('localhost', args.port), 'xrs', sendLogger)
 
-    sender = Thread(target=_sender, args=(conn,sys.stdin))
+    sender = Thread(target=_sender, args=(conn,sys.stdin,args.parse))
     sender.start()
 
     receiver = Thread(target=_receiver, args=(conn,sys.stdout))
+    receiver.daemon = True
     receiver.start()
 
+    # ExaBGP is gone once its output is closed
     sender.join()
-    receiver.join()
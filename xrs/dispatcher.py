@@ -0,0 +1,248 @@
+from collections import deque
+from threading import Condition, Event, Lock
+import Queue
+
+# Lanes in order of priority
+FR_LANE = 0
+DOWN_LANE = 1
+UPDATE_LANE = 2
+
+
+def message_lane(msg):
+    if 'FR' in msg:
+        return FR_LANE
+    elif 'down' in msg:
+        return DOWN_LANE
+    return UPDATE_LANE
+
+
+def message_neighbor(msg):
+    if 'announce' in msg:
+        return msg['announce'].neighbor
+    elif 'withdraw' in msg:
+        return msg['withdraw'].neighbor
+    return None
+
+
+def without_epoch(msg):
+    "The message without its epoch, copied if it has one: the message itself may be shared"
+    if 'epoch' in msg:
+        msg = dict(msg)
+        del msg['epoch']
+    return msg
+
+
+"""
+Blocking multi-lane queue between the SWIFT workers and the route server sender.
+It exposes the put/get interface of Queue.Queue, but get() always returns the
+oldest message of the highest priority lane: fast-reroute messages first, then
+session down messages and finally the regular BGP updates. Consumers block
+until a message arrives instead of polling.
+
+If high_watermark is set, producers of updates are blocked once that many
+updates are queued, until the sender brings the lane back to low_watermark.
+FR and down messages are never blocked.
+"""
+class PriorityDispatcher(object):
+    def __init__(self, high_watermark=0, low_watermark=0):
+        self.lock = Lock()
+        self.cond = Condition(self.lock)
+        self.not_full = Condition(self.lock)
+        self.lanes = (deque(), deque(), deque())
+        self.closed = False
+
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.paused = False
+
+    def put(self, msg, block=True, timeout=None):
+        lane = message_lane(msg)
+        with self.cond:
+            # the updates still queued for a neighbor that went down are obsolete
+            if lane == DOWN_LANE:
+                self.purge(msg['down'], msg.get('epoch'))
+            elif lane == UPDATE_LANE and self.high_watermark > 0:
+                self.wait_not_full(block, timeout)
+            self.lanes[lane].append(msg)
+            self.cond.notify()
+
+    """
+    Must be called with the condition held.
+    """
+    def wait_not_full(self, block, timeout):
+        if len(self.lanes[UPDATE_LANE]) >= self.high_watermark:
+            self.paused = True
+        if not self.paused or self.closed:
+            return
+        if not block:
+            raise Queue.Full
+        if timeout is None:
+            while self.paused and not self.closed:
+                self.not_full.wait()
+        else:
+            self.not_full.wait(timeout)
+            if self.paused and not self.closed:
+                raise Queue.Full
+
+    def put_nowait(self, msg):
+        self.put(msg, False)
+
+    """
+    Returns the next message by priority. Raises Queue.Empty if nothing arrives
+    within timeout, and returns None once the dispatcher has been closed.
+    """
+    def get(self, block=True, timeout=None):
+        with self.cond:
+            while True:
+                for lane in self.lanes:
+                    if lane:
+                        msg = lane.popleft()
+                        if self.paused and len(self.lanes[UPDATE_LANE]) <= self.low_watermark:
+                            self.paused = False
+                            self.not_full.notify_all()
+                        return msg
+                if self.closed:
+                    return None
+                if not block:
+                    raise Queue.Empty
+                if timeout is None:
+                    self.cond.wait()
+                else:
+                    self.cond.wait(timeout)
+                    if not any(self.lanes) and not self.closed:
+                        raise Queue.Empty
+
+    def get_nowait(self):
+        return self.get(False)
+
+    """
+    Drop the queued updates received from a neighbor, only the ones of the
+    sessions before epoch if given: the updates of the next session may already
+    be there when the down comes from another process.
+    Must be called with the condition held.
+    """
+    def purge(self, neighbor, epoch=None):
+        updates = self.lanes[UPDATE_LANE]
+        if updates:
+            kept = [msg for msg in updates if message_neighbor(msg) != neighbor or
+                    (epoch is not None and msg.get('epoch', 0) >= epoch)]
+            if len(kept) != len(updates):
+                updates.clear()
+                updates.extend(kept)
+                if self.paused and len(updates) <= self.low_watermark:
+                    self.paused = False
+                    self.not_full.notify_all()
+
+    """
+    Wake up all the blocked consumers, they get None once the lanes are drained.
+    """
+    def close(self):
+        with self.cond:
+            self.closed = True
+            self.cond.notify_all()
+            self.not_full.notify_all()
+
+    def qsize(self):
+        with self.cond:
+            return sum(len(lane) for lane in self.lanes)
+
+    def empty(self):
+        return self.qsize() == 0
+
+
+"""
+Bounded queue feeding one SWIFT worker. Every message taken out of it sets
+the shared space_available event, which the listener waits on while it has
+messages it could not hand over.
+"""
+class PeerQueue(Queue.Queue):
+    def __init__(self, maxsize, space_available):
+        Queue.Queue.__init__(self, maxsize)
+        self.space_available = space_available
+
+    def _get(self):
+        self.space_available.set()
+        return Queue.Queue._get(self)
+
+
+"""
+Messages of the advertising peers whose SWIFT worker queue is full. The
+listener keeps reading as long as the total backlog stays under
+high_watermark. Beyond that it stops reading from ExaBGP, which pushes back
+on the BGP sessions, and hands the backlogs over round robin, one message
+per peer at a time, until the backlog is back to low_watermark. A noisy peer
+thus only delays its own updates.
+"""
+class PeerBacklog(object):
+    def __init__(self, high_watermark, low_watermark):
+        self.high_watermark = high_watermark
+        self.low_watermark = min(low_watermark, high_watermark)
+        self.backlogs = {}
+        self.size = 0
+        self.space_available = Event()
+
+    def put(self, peer_id, msg):
+        backlog = self.backlogs.get(peer_id)
+        if backlog is None:
+            backlog = self.backlogs[peer_id] = deque()
+        backlog.append(msg)
+        self.size += 1
+
+    def has_backlog(self, peer_id):
+        return peer_id in self.backlogs
+
+    """
+    Drop the messages of a neighbor whose session went down. Returns the
+    number of messages dropped.
+    """
+    def purge(self, peer_id, neighbor):
+        backlog = self.backlogs.get(peer_id)
+        if backlog is None:
+            return 0
+        kept = deque(msg for msg in backlog if message_neighbor(msg) != neighbor)
+        dropped = len(backlog) - len(kept)
+        self.size -= dropped
+        if kept:
+            self.backlogs[peer_id] = kept
+        else:
+            del self.backlogs[peer_id]
+        return dropped
+
+    def is_overloaded(self):
+        return self.high_watermark > 0 and self.size >= self.high_watermark
+
+    """
+    Hand the backlogs over round robin. try_put(peer_id, msg) returns False
+    when the queue of the peer is full. Returns the number of messages moved.
+    """
+    def drain(self, try_put):
+        moved = 0
+        progress = True
+        while progress and self.backlogs:
+            progress = False
+            for peer_id, backlog in self.backlogs.items():
+                if try_put(peer_id, backlog[0]):
+                    backlog.popleft()
+                    self.size -= 1
+                    moved += 1
+                    progress = True
+                    if not backlog:
+                        del self.backlogs[peer_id]
+        return moved
+
+    """
+    Block until the backlog is back to low_watermark. Returns False if
+    should_run() turned False meanwhile.
+    """
+    def drain_until_low(self, try_put, should_run, interval=0.05):
+        while self.size > self.low_watermark:
+            if not should_run():
+                return False
+            # cleared first, so that a message taken meanwhile is not missed
+            self.space_available.clear()
+            if self.drain(try_put) == 0:
+                self.space_available.wait(interval)
+        return True
+
+    def __len__(self):
+        return self.size
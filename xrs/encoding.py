@@ -1,24 +1,86 @@
-import os, shutil
+import os, shutil, sys
+from array import array
+import heapq
 from blist import sortedlist
-from blist import sortedset
 import timeit
 import numpy as np
 
-class Mapping:
+from burst_log import log_writer
+
+
+"""
+The free values of a mapping, with a flag per value in a bytearray. The
+lowest free value is always the one allocated, so that the values do not
+depend on the order of the releases: it is found with a memchr from the
+lowest value released since the last allocation. The value 0 is never free.
+"""
+class FreeValues(object):
+    __slots__ = ('flags', 'nb_free', 'lowest')
+
+    def __init__(self, nb_values=1, free=()):
+        self.flags = bytearray(nb_values)
+        self.nb_free = 0
+        self.lowest = nb_values     # No free value below
+        for value in free:
+            self.release(value)
+
+    def grow(self, nb_values):
+        "All the values added, up to nb_values, are free"
+        if nb_values > len(self.flags):
+            self.lowest = min(self.lowest, len(self.flags))
+            self.nb_free += nb_values - len(self.flags)
+            self.flags.extend('\x01' * (nb_values - len(self.flags)))
+
+    def allocate(self):
+        value = self.flags.find('\x01', self.lowest)
+        self.flags[value] = 0
+        self.nb_free -= 1
+        self.lowest = value + 1
+        return value
+
+    def release(self, value):
+        self.flags[value] = 1
+        self.nb_free += 1
+        if value < self.lowest:
+            self.lowest = value
+
+    def __len__(self):
+        return self.nb_free
+
+    def __iter__(self):
+        value = self.flags.find('\x01', self.lowest)
+        while value >= 0:
+            yield value
+            value = self.flags.find('\x01', value + 1)
+
+
+class Mapping(object):
+    __slots__ = ('nb_bytes', 'free', 'mapping', 'from_counters', 'to_counters', 'blocked', 'max_free', 'listener')
 
     def __init__(self):
         self.nb_bytes = 0
 
         # Initialize the set of free values (Initaly all the values are free)
-        self.free = sortedset()
+        self.free = FreeValues()
 
-        # A dictionnary used to store the mapping AS to integer. An other value
-        # is also used to indicate how many times each AS appear on this mapping.
+        # A dictionnary used to store the mapping AS to integer. Two other
+        # counters, indexed by value, indicate how many times each AS appear on
+        # this mapping, as the first and as the second AS of the AS links.
         self.mapping = {}
+        self.from_counters = array('i', [0])
+        self.to_counters = array('i', [0])
 
         self.blocked = False
         self.max_free = 500
 
+        # Called with an AS number when its value changes, with None when all
+        # the values change (their number of bits)
+        self.listener = None
+
+    def changed(self, asn):
+        if self.listener is not None:
+            self.listener(asn)
+
     ###
     # @brief    This function adds an AS number in the mapping. In case there is
     #           mapping available, this function adds new value in the free set.
@@ -48,12 +110,11 @@ class Mapping:
                         self.add_byte()
                         res += 1
 
-            if from_as:
-                self.mapping[asn] = [self.free[0], 1, 0]
-            else:
-                self.mapping[asn] = [self.free[0], 0, 1]
-
-            self.free.pop(0)
+            value = self.free.allocate()
+            self.mapping[asn] = value
+            self.from_counters[value] = 1 if from_as else 0
+            self.to_counters[value] = 0 if from_as else 1
+            self.changed(asn)
 
             return res, True
 
@@ -61,9 +122,9 @@ class Mapping:
 
         else:
             if from_as:
-                self.mapping[asn][1] += 1
+                self.from_counters[self.mapping[asn]] += 1
             else:
-                self.mapping[asn][2] += 1
+                self.to_counters[self.mapping[asn]] += 1
 
         return 0, False
 
@@ -102,11 +163,15 @@ class Mapping:
         if self.nb_bytes == 0:
             #self.free.add(0)
             # Set the mapping for 0, which is used to match an AS link that is not encoded
-            self.mapping[-1] = [0, -1, -1]
+            self.mapping[-1] = 0
+            self.from_counters[0] = -1
+            self.to_counters[0] = -1
 
         self.nb_bytes += 1
-        for i in range(pow(2, self.nb_bytes-1), pow(2, self.nb_bytes)):
-            self.free.add(i)
+        self.free.grow(pow(2, self.nb_bytes))
+        self.from_counters.extend(array('i', [0]) * (pow(2, self.nb_bytes) - len(self.from_counters)))
+        self.to_counters.extend(array('i', [0]) * (pow(2, self.nb_bytes) - len(self.to_counters)))
+        self.changed(None)
 
     ###
     # @brief    This function   removes the AS number from the mapping.
@@ -115,25 +180,45 @@ class Mapping:
     ###
     def remove(self, asn, from_as=True):
         if asn in self.mapping:
+            value = self.mapping[asn]
             if from_as:
-                self.mapping[asn][1] -= 1
+                self.from_counters[value] -= 1
             else:
-                self.mapping[asn][2] -= 1
+                self.to_counters[value] -= 1
 
-            if self.mapping[asn][1] < 0 or self.mapping[asn][2] < 0:
+            if self.from_counters[value] < 0 or self.to_counters[value] < 0:
                 sys.exit(0)
 
-            if self.mapping[asn][1] == 0 and self.mapping[asn][2] == 0:
-                tmp = self.mapping[asn]
+            if self.from_counters[value] == 0 and self.to_counters[value] == 0:
                 del self.mapping[asn]
-                self.free.add(tmp[0])
+                self.free.release(value)
+                self.changed(asn)
 
                 return True
         return False
 
+    def get_state(self):
+        "Plain values describing this mapping, to snapshot it"
+        return (self.nb_bytes, list(self.free),
+                dict((asn, [value, self.from_counters[value], self.to_counters[value]]) for asn, value in self.mapping.iteritems()),
+                self.blocked, self.max_free)
+
+    def set_state(self, state):
+        nb_bytes, free, mapping, self.blocked, self.max_free = state
+        self.nb_bytes = nb_bytes
+        self.free = FreeValues(pow(2, nb_bytes), free)
+        self.mapping = {}
+        self.from_counters = array('i', [0]) * pow(2, nb_bytes)
+        self.to_counters = array('i', [0]) * pow(2, nb_bytes)
+        for asn, (value, from_counter, to_counter) in mapping.iteritems():
+            self.mapping[asn] = value
+            self.from_counters[value] = from_counter
+            self.to_counters[value] = to_counter
+        self.changed(None)
+
     def get_mapping_string(self, asn):
         if asn in self.mapping:
-            res = bin(self.mapping[asn][0])[2:]
+            res = bin(self.mapping[asn])[2:]
             return res.zfill(self.nb_bytes)
         else:
             return '0' * self.nb_bytes
@@ -145,14 +230,111 @@ class Mapping:
         tmp += ' '
         tmp += 'Mapping '
         for k, v in self.mapping.items():
-            tmp += str(k)+'>'+str(v)+','
+            tmp += str(k)+'>'+str([v, self.from_counters[v], self.to_counters[v]])+','
 
         return tmp
 
 
+"""
+The AS links of a topology at each depth, as (number of prefixes, from AS,
+to AS) in sorted lists like the ones of Encoding.compute_sortedlist. The
+lists are kept from one computation of the encoding to the next: the
+topology records the AS links whose depth counters changed, and only those
+are moved in the lists. The lists must not be modified by their users.
+The topology records the changes for one index only: when another index
+takes over, the lists are all sorted again.
+"""
+class AsLinkIndex:
+
+    def __init__(self, topo):
+        self.g = topo
+        self.changed = self.g.track_depths()
+        self.aslinks = {}   # depth -> sorted list of the AS links with prefixes
+        self.counters = {}  # depth -> edge id -> number of prefixes in the sorted list
+
+    ###
+    # @brief    Returns the sorted list of the AS links for each of the depths,
+    #           up to date with the topology. Depths without AS links are left out.
+    ###
+    def sorted_aslinks(self, depths):
+        res = {}
+        for depth in depths:
+            self.update(depth)
+            if len(self.aslinks[depth]) > 0:
+                res[depth] = self.aslinks[depth]
+        return res
+
+    def update(self, depth):
+        if self.g.changed_depths is not self.changed:
+            self.changed = self.g.track_depths()
+            self.aslinks = {}
+            self.counters = {}
+        changed = self.changed.pop(depth, ())
+
+        # Sorting all the AS links again is faster when most of them changed
+        if depth not in self.aslinks or len(changed)*4 > len(self.aslinks[depth]):
+            self.build(depth)
+            return
+
+        aslinks = self.aslinks[depth]
+        indexed = self.counters[depth]
+        if len(indexed) < len(self.g.edge_src):
+            indexed.extend(array('i', [0]) * (len(self.g.edge_src) - len(indexed)))
+        counters = self.g.depth_counters[depth] if depth < len(self.g.depth_counters) else ()
+        asns = self.g.asns
+
+        for edge in changed:
+            old = indexed[edge]
+            new = counters[edge] if edge < len(counters) else 0
+            if old != new:
+                from_as = asns[self.g.edge_src[edge]]
+                to_as = asns[self.g.edge_dst[edge]]
+                if old > 0:
+                    aslinks.remove((old, from_as, to_as))
+                if new > 0:
+                    aslinks.add((new, from_as, to_as))
+                indexed[edge] = new
+
+    def build(self, depth):
+        counters = self.g.depth_array(depth)
+        edges = np.flatnonzero(counters)
+        asns = self.g.asns
+        self.aslinks[depth] = sortedlist((nb_prefixes, asns[self.g.edge_src[edge]], asns[self.g.edge_dst[edge]])
+                                         for edge, nb_prefixes in zip(edges.tolist(), counters[edges].tolist()))
+        self.counters[depth] = array('i', counters.tostring())
+
+
+"""
+k-way merge of the sorted lists of AS links of several depths. Yields
+(depth, AS link) by increasing metric(depth, AS link), or decreasing with
+reverse. The metric must grow with the position of the AS links in their
+list. Between depths, ties go to the lowest depth; within a depth, the AS
+links come in the order of their list.
+"""
+def merge_aslinks(aslink_sortedlist_depth, metric, reverse=False):
+    sign = -1 if reverse else 1
+
+    heap = []
+    for depth, aslinks in aslink_sortedlist_depth.items():
+        it = reversed(aslinks) if reverse else iter(aslinks)
+        for aslink in it:
+            heap.append((sign*metric(depth, aslink), depth, aslink, it))
+            break
+    heapq.heapify(heap)
+
+    while len(heap) > 0:
+        key, depth, aslink, it = heap[0]
+        yield depth, aslink
+        for aslink in it:
+            heapq.heapreplace(heap, (sign*metric(depth, aslink), depth, aslink, it))
+            break
+        else:
+            heapq.heappop(heap)
+
+
 class Encoding():
 
-    def __init__(self, peer_id, topo, outdir, max_bytes, min_percentile, max_depth, traffic_w=0.6, output=True):
+    def __init__(self, peer_id, topo, outdir, max_bytes, min_percentile, max_depth, traffic_w=0.6, output=True, vmac_cache_size=200000):
         self.peer_id = peer_id
         self.mapping = {}   # One mapping for each depth
         self.outdir = outdir
@@ -177,24 +359,105 @@ class Encoding():
         if not os.path.exists('encoding'):
             os.makedirs('encoding')
         if output:
-            self.fd_peer = open(self.outdir+'/'+str(peer_id), 'w', 10)
+            self.fd_peer = log_writer.open(self.outdir+'/'+str(peer_id))
 
         self.max_depth = max_depth
 
+        # Encoding of the AS paths already encoded, AS path -> (bitfield, VMAC)
+        # and, for invalidating them, (depth, AS number) -> AS paths encoded
+        # with this AS at this depth
+        self.vmac_cache = {}
+        self.vmac_paths = {}
+        self.vmac_cache_size = vmac_cache_size
+
+        # Sorted AS links of the topology, built on the first computation of the encoding
+        self.aslink_index = None
+
+    def new_mapping(self, depth):
+        mapping = Mapping()
+        mapping.listener = lambda asn: self.mapping_changed(depth, asn)
+        return mapping
+
+    """
+    Drops the encodings cached that a change of the mapping of a depth
+    affects: the AS paths with this AS at this depth, or all of them when the
+    number of bits of the depth changes.
+    """
+    def mapping_changed(self, depth, asn):
+        if asn is None:
+            self.clear_vmac_cache()
+        else:
+            for as_path in self.vmac_paths.pop((depth, asn), ()):
+                self.vmac_cache.pop(as_path, None)
+
+    def clear_vmac_cache(self):
+        self.vmac_cache = {}
+        self.vmac_paths = {}
+
+    """
+    Returns the encoding of an AS path, as a bitfield and as the string of
+    bits of the VMAC: the value of the AS at each depth with a mapping (0 if
+    the AS is not in it), padded with 0s up to max_bytes bits.
+    """
+    def encode_as_path(self, as_path):
+        cached = self.vmac_cache.get(as_path)
+        if cached is None:
+            if len(self.vmac_cache) >= self.vmac_cache_size:
+                self.clear_vmac_cache()
+
+            bits = 0
+            nb_bits = 0
+            for depth, asn in enumerate(as_path, 1):
+                mapping = self.mapping.get(depth)
+                if mapping is not None:
+                    bits = (bits << mapping.nb_bytes) | mapping.mapping.get(asn, 0)
+                    nb_bits += mapping.nb_bytes
+
+                    paths = self.vmac_paths.get((depth, asn))
+                    if paths is None:
+                        paths = self.vmac_paths[(depth, asn)] = set()
+                    paths.add(as_path)
+
+            if nb_bits < self.max_bytes:
+                bits <<= self.max_bytes - nb_bits
+                nb_bits = self.max_bytes
+
+            cached = (bits, format(bits, '0%db' % nb_bits) if nb_bits > 0 else '')
+            self.vmac_cache[as_path] = cached
+        return cached
+
+    def vmac_bits(self, as_path):
+        return self.encode_as_path(as_path)[0]
+
+    def vmac(self, as_path):
+        return self.encode_as_path(as_path)[1]
+
+    """
+    Sets the VMAC of routes, e.g. of all the routes received before the
+    encoding was computed. The routes sharing an AS path are encoded once.
+    """
+    def encode_routes(self, routes):
+        for route in routes:
+            route.as_path_vmac = self.encode_as_path(route.as_path)[1]
+
+    def sorted_aslinks(self, depths):
+        if self.aslink_index is None:
+            self.aslink_index = AsLinkIndex(self.g)
+        return self.aslink_index.sorted_aslinks(depths)
+
     def compute_sortedlist(self, depth_wanted=None):
 
         sortedlist_depth = {}
 
-        for from_node in self.g:
-            for to_node in self.g[from_node].keys():
-                for depth, nb_prefixes in self.g[from_node][to_node]['depth'].items():
+        for depth in range(2, self.max_depth+1):
+            if depth_wanted is not None and depth not in depth_wanted:
+                continue
 
-                    if (depth_wanted is None and depth > 1 and depth <= self.max_depth) or \
-                    (depth_wanted is not None and depth in depth_wanted and depth > 1 and depth <= self.max_depth):
-                        if depth not in sortedlist_depth:
-                            sortedlist_depth[depth] = sortedlist()
+            for from_node, to_node, nb_prefixes in self.g.depth_edges(depth):
+                if depth not in sortedlist_depth:
+                    sortedlist_depth[depth] = sortedlist()
 
-                        sortedlist_depth[depth].add([nb_prefixes, from_node, to_node])
+                sortedlist_depth[depth].add([nb_prefixes, from_node, to_node])
 
         return sortedlist_depth
 
@@ -206,9 +469,8 @@ class Encoding():
 
         start = timeit.default_timer()
 
-        # Create a dictionnary with a pointer on the highest as link (the one on
-        # the right side of the list) for each depth.
-        aslink_sortedlist_depth = self.compute_sortedlist()
+        # The AS links of each depth, sorted by number of prefixes
+        aslink_sortedlist_depth = self.sorted_aslinks(range(2, self.max_depth+1))
 
         minimum_tmp = {}
         self.encoded_aslinks = {}
@@ -217,73 +479,51 @@ class Encoding():
             minimum_tmp[depth] = []
 
         self.mapping = {}
+        self.clear_vmac_cache()
         total_bytes = 0
 
-        while True:
-            next = None
-            depth = 0
+        # Go through the AS links of all the depths, the highest metric first
+        for depth, (nb_prefixes, from_as, to_as) in merge_aslinks(aslink_sortedlist_depth, lambda d, aslink: aslink[0], reverse=True):
 
-            # Find which as link has the highest metric
-            for d, aslink in aslink_sortedlist_depth.items():
-                if len(aslink) == 0:
-                    continue
-                elif next is None:
-                    next = aslink
-                    depth = d
-                elif aslink[-1][0] > next[-1][0]:
-                    # If more prefixes traverse this edge and if a failure can make a burst
-                    next = aslink
-                    depth = d
+            # Update the mapping accordingly
+            if depth not in self.mapping:
+                self.mapping[depth] = self.new_mapping(depth)
+            if depth+1 not in self.mapping:
+                self.mapping[depth+1] = self.new_mapping(depth+1)
 
-            # In case all the aslink are in the mapping (should never happen with a full Internet routing table)
-            if next is None:
-                while total_bytes < self.max_bytes-2:
-                    to_increase = None
-                    for d, dmap in self.mapping.items():
-                        if to_increase is None or len(to_increase.free) > len(dmap.free):
-                           to_increase = dmap
+            bytes_to_add = self.mapping[depth].is_available(from_as, overprovisioning=True, offset=0)
+            bytes_to_add += self.mapping[depth+1].is_available(to_as, overprovisioning=True, offset=0) #### CHECK THE OFFSET HERE
 
-                    if to_increase is None:
-                        break
-                    else:
-                        to_increase.add_byte()
-                        total_bytes += 1
-                break
-
-            else:
-
-                # Update the mapping accordingly
-                if depth not in self.mapping:
-                    self.mapping[depth] = Mapping()
-                if depth+1 not in self.mapping:
-                    self.mapping[depth+1] = Mapping()
-
-                bytes_to_add = self.mapping[depth].is_available(next[-1][1], overprovisioning=True, offset=0)
-                bytes_to_add += self.mapping[depth+1].is_available(next[-1][2], overprovisioning=True, offset=0) #### CHECK THE OFFSET HERE
+            # If we cannot add this AS link in the encodage, we go to the next one
+            if total_bytes + bytes_to_add <= self.max_bytes-2:
+                tmp1 = self.mapping[depth].add(from_as, True)[0]
+                if tmp1 >= 1:
+                    total_bytes += tmp1
+                tmp2 = self.mapping[depth+1].add(to_as, False)[0]
+                if tmp2 >= 1:
+                    total_bytes += tmp2
 
-                # If we cannot add this AS link in the encodage, we go to the next iteration
-                if total_bytes + bytes_to_add <= self.max_bytes-2:
-                    min_pref = next[-1][0]
+                self.encoded_aslinks[depth].add((from_as, to_as))
 
-                    tmp1 = self.mapping[depth].add(next[-1][1], True)[0]
-                    if tmp1 >= 1:
-                        total_bytes += tmp1
-                    tmp2 = self.mapping[depth+1].add(next[-1][2], False)[0]
-                    if tmp2 >= 1:
-                        total_bytes += tmp2
+                if total_bytes >= self.max_bytes-2:
+                    self.mapping[depth].blocked = True
+                    self.mapping[depth+1].blocked = True
 
-                    self.encoded_aslinks[depth].add((next[-1][1], next[-1][2]))
+                # Refresh the minimum weight*traffic for this peer and this depth
+                minimum_tmp[depth].append(nb_prefixes)
 
-                    if total_bytes >= self.max_bytes-2:
-                        self.mapping[depth].blocked = True
-                        self.mapping[depth+1].blocked = True
+        # In case all the aslink are in the mapping (should never happen with a full Internet routing table)
+        while total_bytes < self.max_bytes-2:
+            to_increase = None
+            for d, dmap in self.mapping.items():
+                if to_increase is None or len(to_increase.free) > len(dmap.free):
+                   to_increase = dmap
 
-                    # Refresh the minimum weight*traffic for this peer and this depth
-                    minimum_tmp[depth].append(next[-1][0])
-
-                # Refresh the dictionnary with the pointers towards the highest as links
-                # for each depth
-                next.pop()
+            if to_increase is None:
+                break
+            else:
+                to_increase.add_byte()
+                total_bytes += 1
 
         # Add one more bit in the second depth (the more critical one)
         if 2 in self.mapping:
@@ -404,6 +644,51 @@ class Encoding():
 
         self.print_status(prefix='BR')
 
+        # To refresh the mapping at depth X, we can remove edges at depth X-1 or X.
+        aslink_sortedlist_depth = self.sorted_aslinks([d for d in (depth_targeted-1, depth_targeted) if 2 <= d <= self.max_depth])
+
+        # Re initialize the minimum treshold
+        minimum_tmp = {}
+        for depth, slist in aslink_sortedlist_depth.items():
+            minimum_tmp[depth] = []
+
+        if self.opti_bits:
+            # The number of bits of the mappings do not change during the refresh
+            weight = {}
+            for d in aslink_sortedlist_depth:
+                nb_bytes_from = 0 if d not in self.mapping else self.mapping[d].nb_bytes
+                nb_bytes_to = 0 if d+1 not in self.mapping else self.mapping[d+1].nb_bytes
+                weight[d] = pow(2, nb_bytes_from) + pow(2, nb_bytes_to)
+            metric = lambda d, aslink: aslink[0]*weight[d]
+        else:
+            metric = lambda d, aslink: aslink[0]
+
+        # Go through the AS links of both depths, the lowest metric first
+        for depth, (nb_prefixes, from_as, to_as) in merge_aslinks(aslink_sortedlist_depth, metric):
+            # If more than hald of the space os used at that depth, we try to remove this edge
+            if len(self.mapping[depth_targeted].mapping) > pow(2, self.mapping[depth_targeted].nb_bytes-1):
+                control_plane_overhead += self.remove(depth, from_as, to_as)
+            # Otherwise, refresh the array used to compute the minimum threshold
+            else:
+                # Only if the edge is encoded though
+                if depth in self.encoded_aslinks and (from_as, to_as) in self.encoded_aslinks[depth]:
+                    minimum_tmp[depth].append(nb_prefixes)
+
+        for depth, vec in minimum_tmp.items():
+            if len(vec) > 0:
+                self.minimum[depth] = np.percentile(vec, self.min_percentile)
+
+        self.print_status(prefix='AR', suffix=str(control_plane_overhead))
+
+    """
+    Same as refresh, on sorted lists built from the whole topology. Kept as a
+    reference for the benchmark.
+    """
+    def refresh_reference(self, depth_targeted):
+        control_plane_overhead = 0
+
+        self.print_status(prefix='BR')
+
         # To refresh the mapping at depth X, we can remove edges at depth X-1 or X.
         aslink_sortedlist_depth = self.compute_sortedlist(set([depth_targeted-1, depth_targeted]))
 
@@ -458,6 +743,112 @@ class Encoding():
 
         self.print_status(prefix='AR', suffix=str(control_plane_overhead))
 
+    """
+    Same as compute_encoding, on sorted lists built from the whole topology.
+    Kept as a reference for the benchmark.
+    """
+    def compute_encoding_reference(self):
+
+        start = timeit.default_timer()
+
+        # Create a dictionnary with a pointer on the highest as link (the one on
+        # the right side of the list) for each depth.
+        aslink_sortedlist_depth = self.compute_sortedlist()
+
+        minimum_tmp = {}
+        self.encoded_aslinks = {}
+        for depth in aslink_sortedlist_depth.keys():
+            self.encoded_aslinks[depth] = set()
+            minimum_tmp[depth] = []
+
+        self.mapping = {}
+        self.clear_vmac_cache()
+        total_bytes = 0
+
+        while True:
+            next = None
+            depth = 0
+
+            # Find which as link has the highest metric
+            for d, aslink in aslink_sortedlist_depth.items():
+                if len(aslink) == 0:
+                    continue
+                elif next is None:
+                    next = aslink
+                    depth = d
+                elif aslink[-1][0] > next[-1][0]:
+                    # If more prefixes traverse this edge and if a failure can make a burst
+                    next = aslink
+                    depth = d
+
+            # In case all the aslink are in the mapping (should never happen with a full Internet routing table)
+            if next is None:
+                while total_bytes < self.max_bytes-2:
+                    to_increase = None
+                    for d, dmap in self.mapping.items():
+                        if to_increase is None or len(to_increase.free) > len(dmap.free):
+                           to_increase = dmap
+
+                    if to_increase is None:
+                        break
+                    else:
+                        to_increase.add_byte()
+                        total_bytes += 1
+                break
+
+            else:
+
+                # Update the mapping accordingly
+                if depth not in self.mapping:
+                    self.mapping[depth] = self.new_mapping(depth)
+                if depth+1 not in self.mapping:
+                    self.mapping[depth+1] = self.new_mapping(depth+1)
+
+                bytes_to_add = self.mapping[depth].is_available(next[-1][1], overprovisioning=True, offset=0)
+                bytes_to_add += self.mapping[depth+1].is_available(next[-1][2], overprovisioning=True, offset=0) #### CHECK THE OFFSET HERE
+
+                # If we cannot add this AS link in the encodage, we go to the next iteration
+                if total_bytes + bytes_to_add <= self.max_bytes-2:
+                    min_pref = next[-1][0]
+
+                    tmp1 = self.mapping[depth].add(next[-1][1], True)[0]
+                    if tmp1 >= 1:
+                        total_bytes += tmp1
+                    tmp2 = self.mapping[depth+1].add(next[-1][2], False)[0]
+                    if tmp2 >= 1:
+                        total_bytes += tmp2
+
+                    self.encoded_aslinks[depth].add((next[-1][1], next[-1][2]))
+
+                    if total_bytes >= self.max_bytes-2:
+                        self.mapping[depth].blocked = True
+                        self.mapping[depth+1].blocked = True
+
+                    # Refresh the minimum weight*traffic for this peer and this depth
+                    minimum_tmp[depth].append(next[-1][0])
+
+                # Refresh the dictionnary with the pointers towards the highest as links
+                # for each depth
+                next.pop()
+
+        # Add one more bit in the second depth (the more critical one)
+        if 2 in self.mapping:
+            #self.mapping[2].add_byte()
+            self.mapping[2].add_byte()
+        if 3 in self.mapping:
+            self.mapping[3].add_byte()
+
+        # Compute the minimum weight*traffic required for a link to be added in
+        # the encoding in the future
+        self.minimum = {}
+        for depth, vec in minimum_tmp.items():
+            if len(vec) > 0:
+                self.minimum[depth] = np.percentile(vec, self.min_percentile)
+
+        stop = timeit.default_timer()
+        self.print_debug('C|'+str(stop - start)+'\n')
+        self.print_status(prefix='C')
+
     """
     Returns a boolean indicating if an edge, at a specific depth, is encoded.
     """
@@ -488,6 +879,29 @@ class Encoding():
         print 'Error: encoding.py prefix_is_encoded'
         return False, -1
 
+    """
+    Returns the state of the encoding as plain values, to snapshot it. The
+    topology is not part of it.
+    """
+    def get_state(self):
+        return {'mapping': dict((depth, m.get_state()) for depth, m in self.mapping.iteritems()),
+                'minimum': dict((depth, float(v)) for depth, v in self.minimum.iteritems()),
+                'encoded_aslinks': dict((depth, list(links)) for depth, links in self.encoded_aslinks.iteritems())}
+
+    """
+    Restore the state of a snapshot instead of computing the encoding. The
+    topology must already hold the routes the encoding was computed on.
+    """
+    def set_state(self, state):
+        self.mapping = {}
+        self.clear_vmac_cache()
+        for depth, mapping_state in state['mapping'].iteritems():
+            self.mapping[depth] = self.new_mapping(depth)
+            self.mapping[depth].set_state(mapping_state)
+        self.minimum = dict(state['minimum'])
+        self.encoded_aslinks = dict((depth, set(links)) for depth, links in state['encoded_aslinks'].iteritems())
+        self.print_status(prefix='S')
+
     def print_debug(self, string):
         if self.output:
             self.fd_peer.write(string)
@@ -508,22 +922,103 @@ class Encoding():
 
 
 if __name__ == '__main__':
-    m = Mapping ()
-    m.add(1, True)
-    print m
-    m.add(2, True)
-    print m
-    print m.is_available(3)
-    m.add(3, True)
-    print m
-    print m.is_available(4, offset=0)
-    m.add(4, True)
-    print m
-    print m.is_available(5, )
-    m.add(5, True)
-    print m
-    print m.is_available(6, offset=2)
-    m.add(6, True)
-    m.add(7, True)
-    m.add(8, True)
-    print m
+    # compares the encoding with its reference implementation on the routes of
+    # the first neighbor of a bgpdump trace (bgpdump -m), e.g. a full table, or
+    # on a synthetic table (--synthetic): the computation of the encoding, and
+    # its refresh after some updates
+    import argparse
+    import copy
+    import random
+    from as_topology import ASTopology
+
+    parser = argparse.ArgumentParser()
+    parser.add_argument('trace', nargs='?', default=os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Bgpdump', '500k.txt'))
+    parser.add_argument('--bits', type=int, default=48, help='number of bits of the AS-path encoding (default: 48)')
+    parser.add_argument('--max-depth', type=int, default=5, help='maximum depth of the AS links encoded (default: 5)')
+    parser.add_argument('--updates', type=int, default=10000, help='routes moved to another AS path between the refreshes (default: 10000)')
+    parser.add_argument('--synthetic', type=int, default=0, metavar='ROUTES',
+                        help='use a synthetic table of this many routes instead of the trace, e.g. 300000 for a full table')
+    parser.add_argument('--seed', type=int, default=1, help='seed of the synthetic table (default: 1)')
+    args = parser.parse_args()
+
+    def synthetic_rib(nb_routes, seed):
+        """
+        Routes of a peer (AS 65000) on a tiered AS hierarchy: 15 tier-1 ASes, then
+        1000, 10000 and 50000 ASes, each with a provider in the tier above (or two
+        tiers above, one time out of ten). A route originates from an AS of the
+        tiers below the first, mostly the last one, and goes up its providers to
+        a tier-1 AS, which gives about 60k AS links for 300k routes.
+        """
+        rng = random.Random(seed)
+        tiers = [range(1, 16), range(100, 1100), range(2000, 12000), range(20000, 70000)]
+        provider = {}
+        for tier in range(1, len(tiers)):
+            for asn in tiers[tier]:
+                provider[asn] = rng.choice(tiers[tier-1] if rng.random() < 0.9 else tiers[max(tier-2, 0)])
+        res = {}
+        for i in range(nb_routes):
+            as_path = [rng.choice(tiers[rng.choice((1, 2, 3, 3, 3))])]
+            while as_path[-1] in provider:
+                as_path.append(provider[as_path[-1]])
+            as_path.append(rng.choice(tiers[0]))
+            res['%d.%d.%d.0/24' % (i >> 16, (i >> 8) & 255, i & 255)] = (65000,) + tuple(reversed(as_path))
+        return res
+
+    rib = {}
+    neighbor = None
+    if args.synthetic:
+        rib = synthetic_rib(args.synthetic, args.seed)
+    else:
+        with open(args.trace) as f:
+            for line in f:
+                fields = line.strip().split('|')
+                if len(fields) < 7 or fields[2] not in ('A', 'B') or ':' in fields[5]:
+                    continue
+                if neighbor is None:
+                    neighbor = fields[3]
+                if fields[3] == neighbor:
+                    # AS_SETs are dropped
+                    rib[fields[5]] = tuple(int(asn) for asn in fields[6].split() if asn.isdigit())
+
+    G = ASTopology(1, silent=True)
+    for prefix, as_path in rib.iteritems():
+        G.add(as_path, prefix)
+    print '%d routes, %d AS links' % (len(rib), G.number_of_edges())
+
+    def state(encoding):
+        res = encoding.get_state()
+        res['encoded_aslinks'] = dict((depth, set(links)) for depth, links in res['encoded_aslinks'].iteritems())
+        return res
+
+    def timed(function, *args):
+        start = timeit.default_timer()
+        function(*args)
+        return timeit.default_timer() - start
+
+    encoding = Encoding(0, G, 'encoding', args.bits, 5, args.max_depth, output=False)
+    reference = Encoding(0, G, 'encoding', args.bits, 5, args.max_depth, output=False)
+
+    t_reference = timed(reference.compute_encoding_reference)
+    t_first = timed(encoding.compute_encoding)
+    t_next = timed(encoding.compute_encoding)
+    assert state(encoding) == state(reference)
+    print '%-30s reference %.3f s, indexed %.3f s (%.3f s with the index built)' % ('compute_encoding', t_reference, t_next, t_first)
+
+    # the routes move to the AS paths of other routes
+    prefixes = rib.keys()
+    as_paths = list(set(rib.itervalues()))
+    random.seed(0)
+    for prefix in random.sample(prefixes, min(args.updates, len(prefixes))):
+        as_path = random.choice(as_paths)
+        G.remove(rib[prefix], prefix)
+        G.add(as_path, prefix)
+        rib[prefix] = as_path
+
+    initial = encoding.get_state()
+    for depth in range(2, args.max_depth+2):
+        reference.set_state(copy.deepcopy(initial))
+        encoding.set_state(copy.deepcopy(initial))
+        t_reference = timed(reference.refresh_reference, depth)
+        t_indexed = timed(encoding.refresh, depth)
+        assert state(encoding) == state(reference)
+        print '%-30s reference %.3f s, indexed %.3f s' % ('refresh(%d)' % depth, t_reference, t_indexed)
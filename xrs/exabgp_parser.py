@@ -0,0 +1,241 @@
+import json
+import re
+
+from bgp_route import BGPRoute, path_attributes
+
+
+"""
+Parser of the messages of ExaBGP, specialised for its update schema:
+
+{"time": 1250812799, "neighbor": {"ip": "172.0.0.1", "message": {"update": {
+    "attribute": {"origin": "igp", "as-path": [100, 200], "med": 0, "community": [[100, 1]]},
+    "announce": {"ipv4 unicast": {"172.0.0.1": {"1.0.0.0/24": {}, "1.0.1.0/24": {}}}},
+    "withdraw": {"ipv4 unicast": {"2.0.0.0/24": {}}}}}}}
+
+UPDATE messages are not decoded as a whole: the neighbor, the time and the
+keys of the announce and withdraw sections are picked out with regular
+expressions, and only the attribute section is decoded. Its raw text is
+the key of a cache of interned attributes, so that the attributes of a
+full-table burst, mostly shared by many UPDATEs, are decoded once. The
+other messages (e.g. neighbor state changes), and the ones already decoded
+by the bridge of ExaBGP, go through updates_from_object.
+"""
+
+NEIGHBOR_IP = re.compile(r'"ip"\s*:\s*"([^"]*)"')
+TIME = re.compile(r'"time"\s*:\s*(-?[0-9.eE+]+)')
+# keys of the objects in the announce and withdraw sections: families, next hops and prefixes
+OBJECT_KEY = re.compile(r'"([^"]*)"\s*:\s*\{')
+
+IPV4_UNICAST = 'ipv4 unicast'
+
+
+def attribute_values(attribute):
+    "Returns origin, as_path, as_path_vmac, communities, med and atomic_aggregate of an attribute section"
+    origin = attribute['origin'] if 'origin' in attribute else ''
+
+    as_path = attribute['as-path'] if 'as-path' in attribute else []
+
+    as_path_vmac = attribute['as_path_vmac'] if 'as_path_vmac' in attribute else None
+
+    med = attribute['med'] if 'med' in attribute else ''
+
+    community = attribute['community'] if 'community' in attribute else ''
+    communities = ''
+    for c in community:
+        communities += ':'.join(map(str,c)) + " "
+
+    atomic_aggregate = attribute['atomic-aggregate'] if 'atomic-aggregate' in attribute else ''
+
+    return origin, as_path, as_path_vmac, communities, med, atomic_aggregate
+
+
+"""
+Returns the route updates of a decoded ExaBGP message: a {'down': ip} message
+if the session went down, announce and withdraw messages otherwise.
+"""
+def updates_from_object(route):
+    origin = None
+    as_path = None
+    as_path_vmac = None
+    med = None
+    atomic_aggregate = None
+    communities = None
+
+    route_list = []
+
+    if 'state' in route['neighbor'] and route['neighbor']['state'] == 'down':
+        print "state down update received from:", route['neighbor']['ip']
+        down_ip = route['neighbor']['ip']
+        route_list.append({'down': down_ip})
+        return route_list
+
+    # Extract out neighbor information in the given BGP update
+    neighbor = route["neighbor"]["ip"]
+    if 'message' in route['neighbor']:
+        if 'update' in route['neighbor']['message']:
+            update = route['neighbor']['message']['update']
+            time = route['time']
+            if 'attribute' in update:
+                origin, as_path, as_path_vmac, communities, med, atomic_aggregate = attribute_values(update['attribute'])
+
+            if 'announce' in update:
+                announce = update['announce']
+                if IPV4_UNICAST in announce:
+                    for next_hop, prefixes in announce[IPV4_UNICAST].iteritems():
+                        for prefix in prefixes:
+                            announced_route = BGPRoute(prefix,
+                                                       neighbor,
+                                                       next_hop,
+                                                       origin,
+                                                       as_path,
+                                                       as_path_vmac,
+                                                       communities,
+                                                       med,
+                                                       atomic_aggregate
+                                                       )
+
+                            route_list.append({'announce': announced_route ,'time': time})
+
+            # an UPDATE can withdraw routes and announce others
+            if 'withdraw' in update:
+                withdraw = update['withdraw']
+                if IPV4_UNICAST in withdraw:
+                    next_hop = None
+                    for prefix in withdraw[IPV4_UNICAST]:
+                        withdrawn_route = BGPRoute(prefix,
+                                                   neighbor,
+                                                   next_hop,
+                                                   origin,
+                                                   as_path,
+                                                   as_path_vmac,
+                                                   communities,
+                                                   med,
+                                                   atomic_aggregate,
+                                                   )
+                        route_list.append({'withdraw': withdrawn_route, 'time': time})
+
+    return route_list
+
+
+def object_end(message, start):
+    "Index right after the JSON object starting at start. The strings of the object must not hold braces"
+    depth = 0
+    i = start
+    while True:
+        closing = message.find('}', i)
+        if closing < 0:
+            return -1
+        opening = message.find('{', i, closing)
+        if opening >= 0:
+            depth += 1
+            i = opening + 1
+        else:
+            depth -= 1
+            i = closing + 1
+            if depth == 0:
+                return i
+
+
+class UpdateParser(object):
+    def __init__(self, cache_size=100000):
+        # raw text of an attribute section -> (interned attributes, as_path_vmac)
+        self.attributes_cache = {}
+        self.cache_size = cache_size
+        # the attributes of the UPDATEs without attribute section
+        self.no_attributes = path_attributes.intern(None, None, None, None, None)
+
+    """
+    Returns the neighbor of a message from ExaBGP, as a JSON string or
+    already decoded, and its route updates. Raises ValueError or KeyError if
+    the message is not valid.
+    """
+    def parse(self, message):
+        if not isinstance(message, basestring):
+            return message['neighbor']['ip'], updates_from_object(message)
+
+        update = message.find('"update"')
+        neighbor = NEIGHBOR_IP.search(message)
+        time = TIME.search(message)
+        if update < 0 or neighbor is None or time is None:
+            route = json.loads(message)
+            return route['neighbor']['ip'], updates_from_object(route)
+
+        neighbor = neighbor.group(1)
+        time = time.group(1)
+        time = int(time) if time.isdigit() else float(time)
+
+        sections = {}
+        for name in ('attribute', 'announce', 'withdraw'):
+            start = message.find('"%s"' % name, update)
+            if start >= 0:
+                sections[name] = start
+        bounds = sorted(sections.values()) + [len(message)]
+
+        if 'attribute' in sections:
+            attributes, as_path_vmac = self.attributes(message, sections['attribute'])
+        else:
+            attributes, as_path_vmac = self.no_attributes, None
+
+        route_list = []
+        for name in ('announce', 'withdraw'):
+            start = sections.get(name)
+            if start is None:
+                continue
+            end = bounds[bounds.index(start) + 1]
+
+            # families and next hops are the keys of the objects holding the prefixes
+            family = None
+            next_hop = None
+            for key in OBJECT_KEY.findall(message, start, end):
+                if '/' in key:
+                    if family == IPV4_UNICAST:
+                        route = BGPRoute.from_attributes(key, neighbor, next_hop if name == 'announce' else None,
+                                                         as_path_vmac, attributes)
+                        route_list.append({name: route, 'time': time})
+                elif ' ' in key:
+                    family = key
+                    next_hop = None
+                else:
+                    next_hop = key
+
+        return neighbor, route_list
+
+    def attributes(self, message, start):
+        start = message.find('{', start)
+        end = object_end(message, start)
+        if start < 0 or end < 0:
+            raise ValueError('invalid attribute section: %s' % message)
+        raw = message[start:end]
+
+        cached = self.attributes_cache.get(raw)
+        if cached is None:
+            origin, as_path, as_path_vmac, communities, med, atomic_aggregate = attribute_values(json.loads(raw))
+            cached = (path_attributes.intern(origin, as_path, communities, med, atomic_aggregate), as_path_vmac)
+            if len(self.attributes_cache) >= self.cache_size:
+                # the cache holds a reference on the attributes
+                for attributes, _ in self.attributes_cache.itervalues():
+                    path_attributes.release(attributes)
+                self.attributes_cache.clear()
+            self.attributes_cache[raw] = cached
+        return cached
+
+
+if __name__ == '__main__':
+    # compares the parser with decoding the whole messages, on a bgpdump trace
+    import os
+    import sys
+    import timeit
+    from benchmark import table_dump_2_exabgp
+
+    trace = sys.argv[1] if len(sys.argv) > 1 else os.path.join(os.path.dirname(os.path.realpath(__file__)), '..', 'Bgpdump', '500k.txt')
+    with open(trace) as f:
+        messages = [m[0] for m in (table_dump_2_exabgp(line) for line in f) if m is not None]
+
+    parser = UpdateParser()
+    assert [str(u['announce']) for m in messages[:1000] for u in parser.parse(m)[1]] == \
+           [str(u['announce']) for m in messages[:1000] for u in updates_from_object(json.loads(m))]
+
+    for name, parse in (('json.loads + updates_from_object', lambda m: updates_from_object(json.loads(m))),
+                        ('UpdateParser', parser.parse)):
+        duration = min(timeit.repeat(lambda: [parse(m) for m in messages], number=1, repeat=3))
+        print '%-35s %.3f s, %.0f messages/s' % (name, duration, len(messages) / duration)
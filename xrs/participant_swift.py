@@ -8,16 +8,19 @@ import atexit
 from copy import deepcopy
 import logging.handlers
 import multiprocessing
-import string
 import Queue
 
 
-from bgp_messages import BGPMessagesQueue
-from rib import RIBPeer
+from bgp_messages import BGPMessagesQueue, WithdrawalWindow
+from bgp_route import BGPRoute
+from rib import RIBPeer, NeighborPrefixes
 from as_topology import ASTopology
-from bpa import find_best_fmscore_forward, find_best_fmscore_backward, find_best_fmscore_naive, find_best_fmscore_single
+from bpa import find_best_fmscore_forward, find_best_fmscore_backward, find_best_fmscore_naive, find_best_fmscore_single, IncrementalBPA
 from burst import Burst
+from prediction import PredictionWorker
 from encoding import Encoding
+from prefix_bitmap import prefix_ids
+from snapshot import SnapshotFile, Reconciliation
 
 if not os.path.exists('log'):
     os.makedirs('log')
@@ -47,17 +50,29 @@ G_W             The graph of AS paths that have been withdrawn, weighted based o
 W_queue         The queue of withdrawals.
 p_w, r_w        The precision and recall weights
 bpa_algo        The type of algoruthm to use (bpa-single, bpa-multiple, naive)
+incremental     The IncrementalBPA of G and G_W to use for BPA, if any
 """
 
-def burst_prediction(current_burst, G, G_W, W_queue, p_w, r_w, bpa_algo, peer_as_set):
+def burst_prediction(current_burst, G, G_W, W_queue, p_w, r_w, bpa_algo, peer_as_set, incremental=None):
     current_burst.prediction_done = True
+    return bpa_prediction(G, G_W, len(W_queue)+current_burst.nb_deleted_from_W_queue, p_w, r_w, bpa_algo, peer_as_set, incremental)
 
+"""
+The BPA part of burst_prediction, with W_nb the number of withdrawals of the
+burst. It only reads G and G_W, and runs in the background on snapshots of them
+(see PredictionWorker).
+"""
+def bpa_prediction(G, G_W, W_nb, p_w, r_w, bpa_algo, peer_as_set, incremental=None):
     try:
         if bpa_algo == 'bpa-multiple':
-            best_edge_set_forward, best_fm_score_forward, best_TP_forward, best_FP_forward, best_FN_forward = \
-            find_best_fmscore_forward(G, G_W, len(W_queue)+len(current_burst.deleted_from_W_queue), p_w, r_w)
-            best_edge_set_backward, best_fm_score_backward, best_TP_backward, best_FP_backward, best_FN_backward = \
-            find_best_fmscore_backward(G, G_W, len(W_queue)+len(current_burst.deleted_from_W_queue), p_w, r_w)
+            if incremental is not None:
+                best_edge_set_forward, best_fm_score_forward, best_TP_forward, best_FP_forward, best_FN_forward = incremental.forward(W_nb)
+                best_edge_set_backward, best_fm_score_backward, best_TP_backward, best_FP_backward, best_FN_backward = incremental.backward(W_nb)
+            else:
+                best_edge_set_forward, best_fm_score_forward, best_TP_forward, best_FP_forward, best_FN_forward = \
+                find_best_fmscore_forward(G, G_W, W_nb, p_w, r_w)
+                best_edge_set_backward, best_fm_score_backward, best_TP_backward, best_FP_backward, best_FN_backward = \
+                find_best_fmscore_backward(G, G_W, W_nb, p_w, r_w)
 
             if best_fm_score_forward > best_fm_score_backward:
                 best_edge_set = best_edge_set_forward
@@ -79,14 +94,17 @@ def burst_prediction(current_burst, G, G_W, W_queue, p_w, r_w, bpa_algo, peer_as
                 best_fm_score = best_fm_score_forward
 
         elif bpa_algo == 'bpa-single':
-            best_edge_set, best_fm_score, best_TP, best_FP, best_FN = find_best_fmscore_single(G, G_W, len(W_queue)+len(current_burst.deleted_from_W_queue), p_w, r_w)
+            if incremental is not None:
+                best_edge_set, best_fm_score, best_TP, best_FP, best_FN = incremental.single(W_nb)
+            else:
+                best_edge_set, best_fm_score, best_TP, best_FP, best_FN = find_best_fmscore_single(G, G_W, W_nb, p_w, r_w)
         else:
             best_edge_set = set()
             best_TP = 0
             best_FP = 0
             best_FN = 0
             for peer_as in peer_as_set:
-                best_edge_set_tmp, best_fm_score, best_TP_tmp, best_FP_tmp, best_FN_tmp = find_best_fmscore_naive(G, G_W, len(W_queue)+len(current_burst.deleted_from_W_queue), peer_as, p_w, r_w)
+                best_edge_set_tmp, best_fm_score, best_TP_tmp, best_FP_tmp, best_FN_tmp = find_best_fmscore_naive(G, G_W, W_nb, peer_as, p_w, r_w)
                 best_edge_set = best_edge_set.union(best_edge_set_tmp)
                 best_TP += best_TP_tmp
                 best_FP += best_FP_tmp
@@ -99,9 +117,20 @@ def burst_prediction(current_burst, G, G_W, W_queue, p_w, r_w, bpa_algo, peer_as
     return best_edge_set, best_fm_score, int(best_TP), int(best_FP), int(best_FN)
 
 
+"""
+Remove the withdrawals of buckets of the WithdrawalWindow from the graph of
+withdrawals, once per AS path.
+"""
+def remove_withdrawals(G_W, buckets):
+    for bucket in buckets:
+        for as_path, nb in bucket.as_paths.iteritems():
+            G_W.remove(as_path, nb=nb)
+
 def burst_add_edge(current_burst, rib, encoding, last_msg_time, best_edge_set, G, G_W, silent):
     for new_edge in current_burst.add_edges_iter(last_msg_time, best_edge_set, G_W):
-        for p in G.get_prefixes_edge(new_edge):
+        # The prefixes already predicted (and encoded) are skipped on the bitmaps
+        for prefix_id in G.get_prefix_ids_edge(new_edge) - current_burst.predicted_prefixes:
+            p = prefix_ids.prefix(prefix_id)
             aspath = rib.rib[p]
             is_encoded, depth = encoding.prefix_is_encoded(p, aspath, new_edge[0], new_edge[1])
             current_burst.add_predicted_prefix(last_msg_time, p, is_encoded, depth)
@@ -109,23 +138,46 @@ def burst_add_edge(current_burst, rib, encoding, last_msg_time, best_edge_set, G
 def add_as_path_encoding_to_route(bgp_msg , rib, encoding):
     # if it is an advertisement
     if rib is not None:
-        # Make the second part of the v_mac (the part where the as-path is encoded)
-        v_mac = ''
-        deep = 1
-        as_path = bgp_msg.as_path
-        for asn in as_path:
-            if deep in encoding.mapping:
-                depth_value = encoding.mapping[deep].get_mapping_string(asn)
-                v_mac += ''+depth_value
-            deep += 1
+        # The second part of the v_mac (the part where the as-path is encoded),
+        # cached by the encoding for the routes sharing the as-path
+        bgp_msg.as_path_vmac = encoding.vmac(bgp_msg.as_path)
+
+    return bgp_msg
 
-        v_mac = string.ljust(v_mac, encoding.max_bytes, '0')
 
-        bgp_msg.as_path_vmac = v_mac
+def snapshot_state(peer_id, rib, encoding):
+    "State of a peer saved in its snapshots. The topology is rebuilt from the RIB on restore"
+    return {'peer_id': peer_id,
+            'rib': rib.rib,
+            'encoding': encoding.get_state() if encoding is not None else None}
 
-    return bgp_msg
+
+"""
+Load the state of a snapshot in an empty RIB and topology, and returns the
+restored encoding (None if the encoding was not computed yet).
+"""
+def restore_snapshot(state, rib, G, peer_id, nb_bits_aspath, max_depth):
+    for prefix, as_path in state['rib'].iteritems():
+        rib.update(prefix, as_path)
+        G.add(as_path, prefix)
+
+    encoding = None
+    if state['encoding'] is not None:
+        encoding = Encoding(peer_id, G, 'encoding', nb_bits_aspath, 5, max_depth, output=True)
+        encoding.set_state(state['encoding'])
+    return encoding
 
 
+"""
+Remove the restored routes that the fresh session dump did not confirm. They
+are not real withdrawals, so they do not go in the graph of withdraws.
+"""
+def reconcile(reconciliation, rib, G, encoding):
+    for prefix in reconciliation.stale:
+        as_path = rib.withdraw(prefix)
+        G.remove(as_path, prefix)
+        if encoding is not None:
+            encoding.withdraw(as_path)
 
 
 """
@@ -139,11 +191,19 @@ burst_outdir    where to store information about the bursts (silent needs to Fal
 nb_withdraws_per_cycle After how many new withdrawals BPA needs to run_peer
 silent          print output in files to get information. To speed-up the algo, set to True.
 naive           Use the naive approach if True
+snapshot_interval   Seconds between two snapshots of the state of the peer, 0 disables the snapshots
+snapshot_dir    Where to store the snapshots
+reconcile_timeout   Seconds after the restart after which the restored routes not announced again are removed
+incremental_bpa Keep BPA up to date as the topologies change, and read its results during the bursts
+async_bpa       Only used with incremental_bpa set to False: run the predictions during the bursts in
+                the background on snapshots of the topologies, instead of not reading the updates while
+                BPA runs. The incremental BPA does not need it, its results are read right away
 """
 def run_peer(logger, queue_server_peer, queue_peer_server, FR_queue, win_size, peer_id, nb_withdrawals_burst_start, \
 nb_withdrawals_burst_end, min_bpa_burst_size, burst_outdir, max_depth, \
 nb_withdraws_per_cycle=100, p_w=1, r_w=1, bpa_algo='bpa-multiple', nb_bits_aspath=12, \
-run_encoding_threshold=1000000, silent=False):
+run_encoding_threshold=1000000, silent=False, snapshot_interval=0, snapshot_dir='snapshots', \
+reconcile_timeout=60, incremental_bpa=True, async_bpa=False):
 
     import socket
 
@@ -156,6 +216,12 @@ run_encoding_threshold=1000000, silent=False):
     # Create the topologies for this peer
     G = ASTopology(1, silent) # Main topology
     G_W = ASTopology(nb_withdrawals_burst_start, silent) # Subset of the topology with the withdraws in the queue
+    # BPA kept up to date with the topologies
+    incremental = IncrementalBPA(G, G_W, p_w, r_w) if incremental_bpa else None
+
+    # Runs the predictions during the bursts in the background (the one at the end excepted). Not
+    # needed with the incremental BPA, whose results are read right away at little cost
+    predictor = PredictionWorker(peer_logger) if async_bpa and incremental is None else None
 
     # Current burst (if any)
     current_burst = None
@@ -183,6 +249,11 @@ run_encoding_threshold=1000000, silent=False):
     peer_as = None
     peer_as_set = None
 
+    # Neighbors of this peer whose routes are in its state, and the prefixes of each one.
+    # The prefixes restored from a snapshot belong to none until announced again.
+    neighbors = set()
+    neighbor_prefixes = NeighborPrefixes()
+
     # Create the RIB for this peer
     rib = RIBPeer()
 
@@ -195,8 +266,21 @@ run_encoding_threshold=1000000, silent=False):
 
         return encoding
 
+    # Warm restart from the last snapshot of this peer, if any
+    snapshot = None
+    reconciliation = None
+    last_snapshot = time.time()
+    if snapshot_interval > 0:
+        snapshot = SnapshotFile(os.path.join(snapshot_dir, 'peer_' + str(peer_id)))
+        state = snapshot.load()
+        if state is not None:
+            encoding = restore_snapshot(state, rib, G, peer_id, nb_bits_aspath, max_depth)
+            reconciliation = Reconciliation(rib.rib.keys(), reconcile_timeout)
+            peer_logger.info('Peer_' + str(peer_id) + ' restored ' + str(len(rib)) + ' routes from its snapshot, encoding ' + \
+                             ('restored' if encoding is not None else 'not computed yet'))
+
     #A_queue = BGPMessagesQueue(win_size) # Queue of Updates
-    W_queue = BGPMessagesQueue(win_size) # Queue of Withdraws
+    W_queue = WithdrawalWindow(win_size) # Queue of Withdraws
 
     last_ts = 0
 
@@ -210,17 +294,125 @@ run_encoding_threshold=1000000, silent=False):
 
     peer_logger.info('Peer_' + str(peer_id) + '_(AS' + str(str(peer_as)) + ')_started.')
 
+    # Load a prediction in the burst, and inform the global RIB about the set of failed links
+    def report_prediction(prediction, last_msg_time):
+        best_edge_set, best_fm_score, best_TP, best_FP, best_FN = prediction
+
+        # Load that set in the burst
+        if not silent: burst_add_edge(current_burst, rib, encoding, last_msg_time, best_edge_set, G, G_W, silent)
+
+        logger.info("prediction finished")
+
+        # Inform the global RIB about the set of failed links
+        for e in best_edge_set:
+            depth_set = set()
+            if G_W.has_edge(e[0], e[1]):
+                depth_set = depth_set.union(G_W[e[0]][e[1]]['depth'].keys())
+            if G.has_edge(e[0], e[1]):
+                depth_set = depth_set.union(G[e[0]][e[1]]['depth'].keys())
+
+            for d in depth_set:
+                if encoding.is_encoded(d, e[0], e[1]):
+
+
+                        vmac_partial = ''
+                        bitmask_partial = ''
+
+                        for i in range(2, encoding.max_depth+2):
+                            if i == d:
+                                vmac_partial += encoding.mapping[i].get_mapping_string(e[0])
+                                bitmask_partial += '1' * encoding.mapping[i].nb_bytes
+                            elif i == d+1:
+                                vmac_partial += encoding.mapping[i].get_mapping_string(e[1])
+                                bitmask_partial += '1' * encoding.mapping[i].nb_bytes
+                            else:
+                                if i in encoding.mapping:
+                                    vmac_partial += '0' * encoding.mapping[i].nb_bytes
+                                    bitmask_partial += '0' * encoding.mapping[i].nb_bytes
+
+                        FR_message = {'FR': {'peer_id': peer_id, 'as_path_vmac': vmac_partial, 'as_path_bitmask': bitmask_partial, 'depth': d}}
+                        FR_queue.put(FR_message)
+
+                        print "FR_message:", FR_message, "best_edge", e
+
+        # Print information about the perdiction in the predicted file
+        current_burst.fd_predicted.write('PREDICTION|'+bpa_algo+'|'+str(len(current_burst))+'|'+str(best_fm_score)+'|'+str(best_TP)+'|'+str(best_FP)+'|'+str(best_FN)+'\n')
+        current_burst.fd_predicted.write('PREDICTION_EDGE|')
+        res = ''
+        depth = 9999999999
+        for e in best_edge_set:
+            depth = min(G_W.get_depth(e[0], e[1]), depth)
+            res += str(e[0])+'-'+str(e[1])+','
+        current_burst.fd_predicted.write(res[:len(res)-1]+'|'+str(depth)+'\n')
+
     while True:
 
         while True:
-            bgp_msg = queue_server_peer.get()
+            # Do not wait for the next update while a prediction is to be reported
+            if predictor is not None and predictor.busy():
+                try:
+                    bgp_msg = queue_server_peer.get(timeout=0.1)
+                except Queue.Empty:
+                    bgp_msg = None
+            else:
+                bgp_msg = queue_server_peer.get()
+
+            # Report the predictions done in the background, unless their burst is over
+            if predictor is not None:
+                for burst, prediction in predictor.results():
+                    if burst is current_burst:
+                        report_prediction(prediction, last_ts)
 
             if bgp_msg is not None:
 
+                # The session of a neighbor went down. The route server already dropped its
+                # updates, we drop the state of the peer at once rather than route by route.
+                if 'down' in bgp_msg:
+                    neighbors.discard(bgp_msg['down'])
+                    if neighbors:
+                        # only the routes of that neighbor go, they are not withdrawals
+                        # from the topology point of view and do not go in G_W
+                        prefixes = neighbor_prefixes.pop(bgp_msg['down'])
+                        for prefix in prefixes:
+                            as_path = rib.withdraw(prefix)
+                            G.remove(as_path, prefix)
+                            if encoding is not None:
+                                encoding.withdraw(as_path)
+                            if reconciliation is not None:
+                                reconciliation.confirm(prefix)
+                        routes_without_as_path_encoding = [m for m in routes_without_as_path_encoding \
+                                                           if m['announce'].neighbor != bgp_msg['down']]
+                        peer_logger.info('Peer_' + str(peer_id) + ' neighbor ' + str(bgp_msg['down']) + ' down, dropping ' + \
+                                         str(len(prefixes)) + ' routes, state kept for ' + str(neighbors))
+                        continue
+
+                    if current_burst is not None:
+                        current_burst.stop(last_ts)
+                        current_burst = None
+                    if predictor is not None:
+                        predictor.cancel()
+                    peer_logger.info('Peer_' + str(peer_id) + ' neighbor ' + str(bgp_msg['down']) + ' down, dropping ' + str(len(rib)) + ' routes')
+
+                    rib = RIBPeer()
+                    neighbor_prefixes = NeighborPrefixes()
+                    G = ASTopology(1, silent)
+                    G_W = ASTopology(nb_withdrawals_burst_start, silent)
+                    incremental = IncrementalBPA(G, G_W, p_w, r_w) if incremental_bpa else None
+                    W_queue = WithdrawalWindow(win_size)
+                    encoding = None
+                    routes_without_as_path_encoding = []
+                    reconciliation = None
+                    continue
+
                 if 'announce' in bgp_msg:
 
                     prefix = bgp_msg['announce'].prefix
+                    neighbors.add(bgp_msg['announce'].neighbor)
+                    neighbor_prefixes.announce(bgp_msg['announce'].neighbor, prefix)
                     as_path = bgp_msg['announce'].as_path
+
+                    if reconciliation is not None:
+                        reconciliation.confirm(prefix)
                     #as_path = [65000] + as_path
 
                     # Update the set set of peer_as (useful when doing the naive solution)
@@ -243,13 +435,25 @@ run_encoding_threshold=1000000, silent=False):
                         encoding = init_encoding()
                         bgp_msg['announce'] = add_as_path_encoding_to_route(bgp_msg['announce'], rib, encoding)
                     else:
-                        routes_without_as_path_encoding.append(bgp_msg)
+                        # Sent again once encoded: as a copy, the message put below belongs to the route server
+                        # from now on, and its trace is not stamped twice
+                        unsent_route = bgp_msg['announce']
+                        unsent_bgp_msg = dict(bgp_msg, announce=BGPRoute.from_attributes(unsent_route.prefix, unsent_route.neighbor,
+                                                                                          unsent_route.next_hop, unsent_route.as_path_vmac,
+                                                                                          unsent_route.attributes))
+                        unsent_bgp_msg.pop('trace', None)
+                        routes_without_as_path_encoding.append(unsent_bgp_msg)
 
                     queue_peer_server.put(bgp_msg)
 
                 if 'withdraw' in bgp_msg:
 
                     prefix = bgp_msg['withdraw'].prefix
+                    neighbors.add(bgp_msg['withdraw'].neighbor)
+                    neighbor_prefixes.withdraw(prefix)
+
+                    if reconciliation is not None:
+                        reconciliation.confirm(prefix)
 
                     #Withdraws get sent directly to the route server
                     queue_peer_server.put(bgp_msg)
@@ -268,9 +472,9 @@ run_encoding_threshold=1000000, silent=False):
                     G_W.add(as_path)
 
                     # Update the queue of withdraws
-                    if as_path != []:
+                    if len(as_path) > 0:
                         bgp_msg['withdraw'].as_path = as_path
-                        W_queue.append(bgp_msg)
+                        W_queue.append(bgp_msg['time'], as_path)
 
                     # Update the encoding
                     encoding.withdraw(as_path)
@@ -281,7 +485,7 @@ run_encoding_threshold=1000000, silent=False):
 
                     # CLOSE this peer. Clear all the topologies, ribs, queues, bursts, etc
                     #if current_burst is not None:
-                       # best_edge_set, best_fm_score, best_TP, best_FP, best_FN = burst_prediction(current_burst, G, G_W, W_queue, p_w, r_w, bpa_algo, peer_as_set)
+                       # best_edge_set, best_fm_score, best_TP, best_FP, best_FN = burst_prediction(current_burst, G, G_W, W_queue, p_w, r_w, bpa_algo, peer_as_set, incremental)
                         #current_burst.fd_predicted.write('PREDICTION_END_CLOSE|'+bpa_algo+'|'+str(len(current_burst))+'|'+str(best_fm_score)+'|'+str(best_TP)+'|'+str(best_FN)+'|'+str(best_FP)+'\n')
                         #current_burst.fd_predicted.write('PREDICTION_END_EDGE|')
                         #res = ''
@@ -309,30 +513,36 @@ run_encoding_threshold=1000000, silent=False):
                 #Ceck for routes without encoding, check for encdoding, send modified routes to route_server
                 if len(routes_without_as_path_encoding)> 0:
                     if encoding is not None:
+                        # The routes withdrawn by this message are not sent again
+                        if 'withdraw' in bgp_msg:
+                            routes_without_as_path_encoding = [unsent_bgp_msg for unsent_bgp_msg in routes_without_as_path_encoding
+                                                               if unsent_bgp_msg['announce'].prefix != bgp_msg['withdraw'].prefix]
+
+                        encoding.encode_routes([unsent_bgp_msg['announce'] for unsent_bgp_msg in routes_without_as_path_encoding])
                         for unsent_bgp_msg in routes_without_as_path_encoding:
-                            if 'withdraw' in bgp_msg:
-                                if unsent_bgp_msg['announce'].prefix == bgp_msg['withdraw'].prefix:
-                                    routes_without_as_path_encoding.pop(unsent_bgp_msg)
-                                    continue
-                            unsent_bgp_msg['announce'] = add_as_path_encoding_to_route(unsent_bgp_msg['announce'], rib, encoding)
                             queue_peer_server.put(unsent_bgp_msg)
 
                         routes_without_as_path_encoding = []
 
-                # Make sure to compute start en end time of burst with a second granularity (only if ther is a burst)
-                if current_burst is not None:
-                    while (last_ts != bgp_msg['time']):
-                        last_ts += 1
+                # Make sure to compute start en end time of burst with a second granularity (only if ther is a burst).
+                # The size of the queue only changes on the seconds when withdrawals expire, the others are skipped
+                if current_burst is not None and bgp_msg['time'] > last_ts:
+                    next_ts = last_ts + 1
+                    while True:
+                        last_ts = min(next_ts, bgp_msg['time'])
 
                         # Update the graph of withdraws
-                        for w in W_queue.refresh_iter(last_ts):
-                            current_burst.deleted_from_W_queue.append(w)
+                        for bucket in W_queue.expire(last_ts):
+                            current_burst.deleted_from_W_queue.append(bucket)
+                            current_burst.nb_deleted_from_W_queue += bucket.nb_withdrawals
 
                         # Remove the current burst (if any) if it the size of the withdraws is lower than w_threshold (meaning it has finished)
                         if len(W_queue) < nb_withdrawals_burst_end: #current_burst.is_expired(bgp_msg.time):
                             # Execute BPA at the end of the burst if the burst is large enough
                             print "burst is over"
-                            best_edge_set, best_fm_score, best_TP, best_FN, best_FP = burst_prediction(current_burst, G, G_W, W_queue, p_w, r_w, bpa_algo, peer_as_set)
+                            if predictor is not None:
+                                predictor.cancel()
+                            best_edge_set, best_fm_score, best_TP, best_FN, best_FP = burst_prediction(current_burst, G, G_W, W_queue, p_w, r_w, bpa_algo, peer_as_set, incremental)
                             current_burst.fd_predicted.write('PREDICTION_END|'+bpa_algo+'|'+str(len(current_burst))+'|'+str(best_fm_score)+'|'+str(best_TP)+'|'+str(best_FN)+'|'+str(best_FP)+'\n')
                             current_burst.fd_predicted.write('PREDICTION_END_EDGE|')
 
@@ -347,8 +557,7 @@ run_encoding_threshold=1000000, silent=False):
                             #G_W.draw_graph(peer_as, G, current_burst, outfile='as_graph_'+str(current_burst.start_time)+'.dot', threshold=500)
 
                             # Update the graph of withdrawals
-                            for w in current_burst.deleted_from_W_queue:
-                                G_W.remove(w['withdraw'].as_path)
+                            remove_withdrawals(G_W, current_burst.deleted_from_W_queue)
 
                             current_burst.stop(bgp_msg['time'])
                             current_burst = None
@@ -356,10 +565,15 @@ run_encoding_threshold=1000000, silent=False):
                         else:
                             current_burst.last_ts = last_ts
 
+                        if last_ts >= bgp_msg['time']:
+                            break
+                        next_ts = W_queue.next_expiry()
+                        if next_ts is None or next_ts > bgp_msg['time']:
+                            next_ts = bgp_msg['time']
+
                 # Update the graph of withdraws.)
                 if current_burst is None:
-                    for w in W_queue.refresh_iter(bgp_msg['time']):
-                        G_W.remove(w['withdraw'].as_path)
+                    remove_withdrawals(G_W, W_queue.expire(bgp_msg['time']))
 
                 # Update the last timestamp seen
                 last_ts = bgp_msg['time']
@@ -374,7 +588,7 @@ run_encoding_threshold=1000000, silent=False):
                 # If we are not in the burst yet, we create the burst
                 if current_burst is None and len(W_queue) >= nb_withdrawals_burst_start:
                     print "SWIFT STARTING BURST!!!"
-                    burst_start_time = W_queue[100]['time'] if len(W_queue) > 100 else W_queue[0]['time']
+                    burst_start_time = W_queue.time_of(100) if len(W_queue) > 100 else W_queue.time_of(0)
                     current_burst = Burst(peer_id, bgp_msg['time'], win_size, burst_outdir, encoding, burst_start_time, silent)
                     next_bpa_execution = min_bpa_burst_size
 
@@ -383,17 +597,38 @@ run_encoding_threshold=1000000, silent=False):
                     peer_logger.info(str(int(bgp_msg['time']))+'\t'+str(len(rib))+'\t'+str(len(W_queue)))
                     last_log_write = bgp_msg['time']
 
+                # Remove the restored routes that the peer did not announce again
+                if reconciliation is not None and reconciliation.expired(bgp_msg['time']):
+                    peer_logger.info('Peer_' + str(peer_id) + ' removing ' + str(len(reconciliation)) + ' stale restored routes')
+                    reconcile(reconciliation, rib, G, encoding)
+                    reconciliation = None
+
+                # Snapshot the state of the peer, preferably when it is idle
+                if snapshot is not None:
+                    elapsed = time.time() - last_snapshot
+                    if elapsed >= snapshot_interval and (queue_server_peer.empty() or elapsed >= 4 * snapshot_interval):
+                        snapshot.save(snapshot_state(peer_id, rib, encoding))
+                        last_snapshot = time.time()
+
                 # Execute BPA if there is a burst and
                 # i) the current burst is greater than the minimum required
                 # ii) we have wait the number of withdrawals required per cycle or the queue is empty
+                # The incremental BPA costs little enough to keep running it until the end of large bursts
                 if current_burst is not None:
                     total_current_burst_size = len(current_burst)+nb_withdrawals_burst_start
                     if total_current_burst_size >= min_bpa_burst_size and total_current_burst_size > next_bpa_execution:
-                        if nb_withdraws_per_cycle > 0 and total_current_burst_size < 12505:
+                        if nb_withdraws_per_cycle > 0 and (incremental is not None or total_current_burst_size < 12505):
                             next_bpa_execution += nb_withdraws_per_cycle
                         else:
                             next_bpa_execution = 999999999999
-                        break
+
+                        if predictor is None:
+                            break
+
+                        # The updates keep flowing while BPA runs on a snapshot of the topologies
+                        current_burst.prediction_done = True
+                        predictor.submit(current_burst, bpa_prediction, G.snapshot(), G_W.snapshot(),
+                                         len(W_queue)+current_burst.nb_deleted_from_W_queue, p_w, r_w, bpa_algo, peer_as_set)
 
         #print ('Queue size: '+str(len(rib))+'\t'+str(len(W_queue))+'\t'+str(len(current_burst)+nb_withdrawals_burst_start))
 
@@ -402,50 +637,4 @@ run_encoding_threshold=1000000, silent=False):
             logger.info("Burst detected starting preditcion")
 
             # Compute the set of edges with the highest FM score
-            best_edge_set, best_fm_score, best_TP, best_FP, best_FN = burst_prediction(current_burst, G, G_W, W_queue, p_w, r_w, bpa_algo, peer_as_set)
-            # Load that set in the burst
-            if not silent: burst_add_edge(current_burst, rib, encoding, bgp_msg['time'], best_edge_set, G, G_W, silent)
-
-            logger.info("prediction finished")
-
-            # Inform the global RIB about the set of failed links
-            for e in best_edge_set:
-                depth_set = set()
-                if G_W.has_edge(e[0], e[1]):
-                    depth_set = depth_set.union(G_W[e[0]][e[1]]['depth'].keys())
-                if G.has_edge(e[0], e[1]):
-                    depth_set = depth_set.union(G[e[0]][e[1]]['depth'].keys())
-
-                for d in depth_set:
-                    if encoding.is_encoded(d, e[0], e[1]):
-
-
-                            vmac_partial = ''
-                            bitmask_partial = ''
-
-                            for i in range(2, encoding.max_depth+2):
-                                if i == d:
-                                    vmac_partial += encoding.mapping[i].get_mapping_string(e[0])
-                                    bitmask_partial += '1' * encoding.mapping[i].nb_bytes
-                                elif i == d+1:
-                                    vmac_partial += encoding.mapping[i].get_mapping_string(e[1])
-                                    bitmask_partial += '1' * encoding.mapping[i].nb_bytes
-                                else:
-                                    if i in encoding.mapping:
-                                        vmac_partial += '0' * encoding.mapping[i].nb_bytes
-                                        bitmask_partial += '0' * encoding.mapping[i].nb_bytes
-
-                            FR_message = {'FR': {'peer_id': peer_id, 'as_path_vmac': vmac_partial, 'as_path_bitmask': bitmask_partial, 'depth': d}}
-                            FR_queue.put(FR_message)
-
-                            print "FR_message:", FR_message, "best_edge", e
-
-            # Print information about the perdiction in the predicted file
-            current_burst.fd_predicted.write('PREDICTION|'+bpa_algo+'|'+str(len(current_burst))+'|'+str(best_fm_score)+'|'+str(best_TP)+'|'+str(best_FP)+'|'+str(best_FN)+'\n')
-            current_burst.fd_predicted.write('PREDICTION_EDGE|')
-            res = ''
-            depth = 9999999999
-            for e in best_edge_set:
-                depth = min(G_W.get_depth(e[0], e[1]), depth)
-                res += str(e[0])+'-'+str(e[1])+','
-            current_burst.fd_predicted.write(res[:len(res)-1]+'|'+str(depth)+'\n')
+            report_prediction(burst_prediction(current_burst, G, G_W, W_queue, p_w, r_w, bpa_algo, peer_as_set, incremental), bgp_msg['time'])
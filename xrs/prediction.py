@@ -0,0 +1,80 @@
+from collections import deque
+from threading import Condition, Thread
+import traceback
+
+
+"""
+Runs the BPA predictions of a SWIFT worker in a thread of their own, on
+snapshots of its topologies, so that the worker keeps processing the updates
+of its peer meanwhile.
+
+Only the latest prediction submitted is run: a prediction still waiting when
+a newer one is submitted is cancelled, as the newer one is computed on more
+recent data. Each prediction is tagged (with the burst it is made for) and
+its result is collected with results(). cancel(), e.g. at the end of the
+burst, drops the waiting prediction and the result of the running one.
+"""
+class PredictionWorker(object):
+    def __init__(self, logger=None):
+        self.logger = logger
+
+        self.cond = Condition()
+        self.generation = 0     # number of predictions submitted
+        self.cancelled = 0      # the results of the predictions up to this one are dropped
+        self.pending = None     # (generation, tag, function, args) of the prediction waiting
+        self.running = False
+        self.done = deque()     # (tag, result) of the predictions done
+        self.nb_cancelled = 0
+
+        self.thread = Thread(target=self.run)
+        self.thread.daemon = True
+        self.thread.start()
+
+    def submit(self, tag, function, *args):
+        "Run function(*args) in the background, instead of the prediction waiting if any"
+        with self.cond:
+            self.generation += 1
+            if self.pending is not None:
+                self.nb_cancelled += 1
+            self.pending = (self.generation, tag, function, args)
+            self.cond.notify()
+
+    def cancel(self):
+        with self.cond:
+            if self.pending is not None:
+                self.nb_cancelled += 1
+            self.pending = None
+            self.cancelled = self.generation
+
+    def busy(self):
+        "True while a prediction waits or runs, or its result is not collected yet"
+        with self.cond:
+            return self.pending is not None or self.running or len(self.done) > 0
+
+    def results(self):
+        "Returns the (tag, result) of the predictions done since the last call"
+        res = []
+        while self.done:
+            res.append(self.done.popleft())
+        return res
+
+    def run(self):
+        while True:
+            with self.cond:
+                while self.pending is None:
+                    self.cond.wait()
+                generation, tag, function, args = self.pending
+                self.pending = None
+                self.running = True
+
+            try:
+                result = function(*args)
+            except Exception:
+                result = None
+                if self.logger:
+                    self.logger.error('Prediction failed: ' + traceback.format_exc())
+
+            with self.cond:
+                self.running = False
+                if result is not None and generation > self.cancelled:
+                    self.done.append((tag, result))
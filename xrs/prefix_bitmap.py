@@ -0,0 +1,325 @@
+from array import array
+from bisect import bisect_left
+from threading import Lock
+
+import numpy as np
+
+
+"""
+Interning of the prefixes into consecutive ids. Like the path attributes,
+the table is shared by all the peers of the process, which mostly receive
+the same prefixes. The ids are never released: there are not that many
+prefixes in the Internet.
+"""
+class PrefixTable(object):
+    def __init__(self):
+        # only taken on a miss, so that two threads never intern the same prefix
+        self.lock = Lock()
+        self.ids = {}       # prefix -> id
+        self.prefixes = []  # id -> prefix
+
+    def intern(self, prefix):
+        id = self.ids.get(prefix)
+        if id is None:
+            with self.lock:
+                id = self.ids.get(prefix)
+                if id is None:
+                    id = len(self.prefixes)
+                    self.prefixes.append(prefix)
+                    self.ids[prefix] = id
+        return id
+
+    def get(self, prefix):
+        "The id of a prefix, None if it was never interned"
+        return self.ids.get(prefix)
+
+    def prefix(self, id):
+        return self.prefixes[id]
+
+    def __len__(self):
+        return len(self.prefixes)
+
+
+prefix_ids = PrefixTable()
+
+
+# A container holding more values than this is a bitmap
+ARRAY_MAX = 4096
+
+
+class BitmapContainer(object):
+    "The 16 low bits of the ids of a container, as a bitmap of 65536 bits (the first bit of a byte is its highest one)"
+    __slots__ = ('bits', 'count')
+
+    def __init__(self, bits, count):
+        self.bits = bits    # bytearray of 8192 bytes
+        self.count = count
+
+    def __contains__(self, low):
+        return self.bits[low >> 3] & (0x80 >> (low & 7)) != 0
+
+    def __len__(self):
+        return self.count
+
+
+# Number of bits set in each byte
+POPCOUNT = np.array([bin(i).count('1') for i in range(256)], dtype=np.uint16)
+
+
+def container_values(container):
+    "Sorted numpy array of the 16 low bits held in a container"
+    if type(container) is array:
+        return np.frombuffer(container, dtype=np.uint16)
+    return np.flatnonzero(np.unpackbits(np.frombuffer(container.bits, dtype=np.uint8))).astype(np.uint16)
+
+
+def container_bits(container):
+    "numpy bitmap (8192 bytes) of a container, read-only for a BitmapContainer"
+    if type(container) is array:
+        mask = np.zeros(65536, dtype=bool)
+        mask[container_values(container)] = True
+        return np.packbits(mask)
+    return np.frombuffer(container.bits, dtype=np.uint8)
+
+
+def container_copy(container):
+    if type(container) is array:
+        return array('H', container)
+    return BitmapContainer(bytearray(container.bits), container.count)
+
+
+def container_from_values(values):
+    "Container of sorted unique 16 low bits, None if there are none"
+    if len(values) == 0:
+        return None
+    if len(values) <= ARRAY_MAX:
+        container = array('H')
+        container.fromstring(values.astype(np.uint16).tostring())
+        return container
+    mask = np.zeros(65536, dtype=bool)
+    mask[values] = True
+    return BitmapContainer(bytearray(np.packbits(mask).tostring()), len(values))
+
+
+def container_from_bits(bits):
+    "Container of a numpy bitmap, None if it is empty"
+    count = int(POPCOUNT[bits].sum())
+    if count <= ARRAY_MAX:
+        return container_from_values(np.flatnonzero(np.unpackbits(bits)))
+    return BitmapContainer(bytearray(bits.tostring()), count)
+
+
+def combine(a, b, operation):
+    "New container of the union ('or'), intersection ('and') or difference ('sub') of two containers"
+    if type(a) is array and type(b) is array:
+        values_a = container_values(a)
+        values_b = container_values(b)
+        if operation == 'or':
+            return container_from_values(np.union1d(values_a, values_b))
+        elif operation == 'and':
+            return container_from_values(np.intersect1d(values_a, values_b, assume_unique=True))
+        return container_from_values(np.setdiff1d(values_a, values_b, assume_unique=True))
+
+    if type(a) is array and operation != 'or':
+        # the values of the array are looked up in the bitmap
+        values_a = container_values(a)
+        in_b = container_bits(b)[values_a >> 3] & (0x80 >> (values_a & 7)).astype(np.uint8) != 0
+        return container_from_values(values_a[in_b if operation == 'and' else ~in_b])
+
+    bits_a = container_bits(a)
+    bits_b = container_bits(b)
+    if operation == 'or':
+        return container_from_bits(bits_a | bits_b)
+    elif operation == 'and':
+        return container_from_bits(bits_a & bits_b)
+    return container_from_bits(bits_a & ~bits_b)
+
+
+"""
+Compressed set of prefix ids, in the manner of roaring bitmaps: the ids are
+split by their 16 high bits (the sorted keys) into containers of their 16 low
+bits, a sorted array('H') up to ARRAY_MAX values and a bitmap of 8 KB above.
+A set of prefixes thus takes 2 bytes per prefix at most, instead of a hash
+table slot per prefix string, and the unions and differences of sets are
+computed container by container.
+"""
+class PrefixBitmap(object):
+    __slots__ = ('keys', 'containers', 'size')
+
+    def __init__(self, ids=()):
+        self.keys = array('H')  # sorted 16 high bits of the containers
+        self.containers = []
+        self.size = 0
+        for id in ids:
+            self.add(id)
+
+    def container(self, high):
+        "Index of the container of the 16 high bits, or -1"
+        keys = self.keys
+        i = bisect_left(keys, high)
+        return i if i < len(keys) and keys[i] == high else -1
+
+    def add(self, id):
+        high = id >> 16
+        low = id & 0xFFFF
+        keys = self.keys
+        # the ids are interned in increasing order, most are added in the last container
+        if keys and keys[-1] == high:
+            i = len(keys) - 1
+        else:
+            i = bisect_left(keys, high)
+            if i == len(keys) or keys[i] != high:
+                keys.insert(i, high)
+                self.containers.insert(i, array('H', [low]))
+                self.size += 1
+                return
+        container = self.containers[i]
+        if type(container) is array:
+            j = bisect_left(container, low)
+            if j < len(container) and container[j] == low:
+                return
+            if len(container) < ARRAY_MAX:
+                container.insert(j, low)
+            else:
+                self.containers[i] = container_from_values(np.insert(container_values(container), j, low))
+        else:
+            if low in container:
+                return
+            container.bits[low >> 3] |= 0x80 >> (low & 7)
+            container.count += 1
+        self.size += 1
+
+    def discard(self, id):
+        low = id & 0xFFFF
+        i = self.container(id >> 16)
+        if i < 0:
+            return
+        container = self.containers[i]
+        if type(container) is array:
+            j = bisect_left(container, low)
+            if j == len(container) or container[j] != low:
+                return
+            if len(container) == 1:
+                del self.keys[i]
+                del self.containers[i]
+            else:
+                container.pop(j)
+        else:
+            if low not in container:
+                return
+            container.bits[low >> 3] &= ~(0x80 >> (low & 7)) & 0xFF
+            container.count -= 1
+            if container.count <= ARRAY_MAX // 2:
+                # Back to an array, not right at ARRAY_MAX so that an id added and removed does not convert it each time
+                self.containers[i] = container_from_values(container_values(container))
+        self.size -= 1
+
+    def remove(self, id):
+        if id not in self:
+            raise KeyError(id)
+        self.discard(id)
+
+    def __contains__(self, id):
+        i = self.container(id >> 16)
+        if i < 0:
+            return False
+        container = self.containers[i]
+        low = id & 0xFFFF
+        if type(container) is array:
+            j = bisect_left(container, low)
+            return j < len(container) and container[j] == low
+        return low in container
+
+    def __len__(self):
+        return self.size
+
+    def __iter__(self):
+        "The ids, in increasing order"
+        for high, container in zip(self.keys, self.containers):
+            base = high << 16
+            for low in container_values(container).tolist():
+                yield base | low
+
+    def prefixes(self):
+        "The prefixes of the ids, in the order of the ids"
+        table = prefix_ids.prefixes
+        for id in self:
+            yield table[id]
+
+    def append(self, high, container):
+        "Appends a container, of 16 high bits above those of the bitmap"
+        if container is not None:
+            self.keys.append(high)
+            self.containers.append(container)
+            self.size += len(container)
+
+    def copy(self):
+        res = PrefixBitmap()
+        res.keys = array('H', self.keys)
+        res.containers = [container_copy(container) for container in self.containers]
+        res.size = self.size
+        return res
+
+    def combine(self, other, operation):
+        "New bitmap of the union ('or'), intersection ('and') or difference ('sub') of two bitmaps"
+        res = PrefixBitmap()
+        keys_a, containers_a = self.keys, self.containers
+        keys_b, containers_b = other.keys, other.containers
+        i = j = 0
+        # merge of the sorted keys
+        while i < len(keys_a) and j < len(keys_b):
+            if keys_a[i] == keys_b[j]:
+                res.append(keys_a[i], combine(containers_a[i], containers_b[j], operation))
+                i += 1
+                j += 1
+            elif keys_a[i] < keys_b[j]:
+                if operation != 'and':
+                    res.append(keys_a[i], container_copy(containers_a[i]))
+                i += 1
+            else:
+                if operation == 'or':
+                    res.append(keys_b[j], container_copy(containers_b[j]))
+                j += 1
+        if operation != 'and':
+            for i in range(i, len(keys_a)):
+                res.append(keys_a[i], container_copy(containers_a[i]))
+        if operation == 'or':
+            for j in range(j, len(keys_b)):
+                res.append(keys_b[j], container_copy(containers_b[j]))
+        return res
+
+    def combine_update(self, other, operation):
+        "In place union ('or') or difference ('sub'): only the containers of other are computed"
+        for high, b in zip(other.keys, other.containers):
+            i = bisect_left(self.keys, high)
+            if i == len(self.keys) or self.keys[i] != high:
+                if operation == 'or':
+                    self.keys.insert(i, high)
+                    self.containers.insert(i, container_copy(b))
+                    self.size += len(b)
+                continue
+            a = self.containers[i]
+            container = combine(a, b, operation)
+            if container is not None:
+                self.containers[i] = container
+                self.size += len(container) - len(a)
+            else:
+                del self.keys[i]
+                del self.containers[i]
+                self.size -= len(a)
+        return self
+
+    def __or__(self, other):
+        return self.combine(other, 'or')
+
+    def __and__(self, other):
+        return self.combine(other, 'and')
+
+    def __sub__(self, other):
+        return self.combine(other, 'sub')
+
+    def __ior__(self, other):
+        return self.combine_update(other, 'or')
+
+    def __isub__(self, other):
+        return self.combine_update(other, 'sub')
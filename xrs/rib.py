@@ -1,6 +1,8 @@
 
 import logging.handlers
 
+from prefix_bitmap import PrefixBitmap, prefix_ids
+
 class RIBPeer:
     def __init__(self):
         self.rib = {}
@@ -37,6 +39,82 @@ class RIBPeer:
             res += str(i)+'\t'+str(self.rib[i])+'\n'
         return res
 
+"""
+Prefixes of the RIB of a peer by neighbor, the one which announced the route
+in the RIB, as bitmaps of prefix ids. Used to drop the routes of a neighbor
+whose session went down while the other neighbors of the peer are still up.
+"""
+class NeighborPrefixes(object):
+    def __init__(self):
+        self.bitmaps = {}  # neighbor -> PrefixBitmap
+
+    def announce(self, neighbor, prefix):
+        id = prefix_ids.intern(prefix)
+        for other, bitmap in self.bitmaps.iteritems():
+            if other != neighbor:
+                bitmap.discard(id)
+        bitmap = self.bitmaps.get(neighbor)
+        if bitmap is None:
+            bitmap = self.bitmaps[neighbor] = PrefixBitmap()
+        bitmap.add(id)
+
+    def withdraw(self, prefix):
+        id = prefix_ids.get(prefix)
+        if id is not None:
+            for bitmap in self.bitmaps.itervalues():
+                bitmap.discard(id)
+
+    def pop(self, neighbor):
+        "The prefixes of a neighbor, which are forgotten"
+        bitmap = self.bitmaps.pop(neighbor, None)
+        return list(bitmap.prefixes()) if bitmap is not None else []
+
+class AdjRibOut:
+    """
+    Routes last sent to one participant controller, per advertising neighbor and
+    prefix. Used to drop the updates which would not change anything downstream.
+    """
+    def __init__(self):
+        # neighbor -> {prefix: (next_hop, attributes, as_path_vmac)}
+        self.rib = {}
+        self.suppressed = 0
+
+    """
+    Record a route update and returns False if it is a no-op: an announcement
+    identical to the route already sent, or a withdraw of a route never sent.
+    """
+    def update(self, update):
+        if 'announce' in update:
+            route = update['announce']
+            signature = (route.next_hop, route.attributes, route.as_path_vmac)
+            routes = self.rib.get(route.neighbor)
+            if routes is None:
+                routes = self.rib[route.neighbor] = {}
+            elif routes.get(route.prefix) == signature:
+                self.suppressed += 1
+                return False
+            routes[route.prefix] = signature
+
+        elif 'withdraw' in update:
+            route = update['withdraw']
+            routes = self.rib.get(route.neighbor)
+            if routes is None or routes.pop(route.prefix, None) is None:
+                self.suppressed += 1
+                return False
+
+        return True
+
+    """
+    Forget all the routes of a neighbor, e.g. when its session goes down.
+    Returns the number of routes forgotten.
+    """
+    def clear(self, neighbor):
+        return len(self.rib.pop(neighbor, ()))
+
+    def __len__(self):
+        return sum(len(routes) for routes in self.rib.itervalues())
+
+
 # Define the logger
 #LOG_DIRNAME = 'log'
 #rib_logger = logging.getLogger('RibLogger')
@@ -9,6 +9,7 @@ import argparse
 from collections import namedtuple
 import json
 import logging.handlers
+from multiprocessing import Process, Queue as MPQueue
 from multiprocessing.connection import Listener, Client
 import os
 import Queue
@@ -17,6 +18,12 @@ from threading import Thread, Lock
 import time
 from participant_swift import  run_peer
 from bgp_route import BGPRoute
+from batching import UpdateBatcher
+from dispatcher import PriorityDispatcher, PeerQueue, PeerBacklog, message_neighbor, without_epoch
+from rib import AdjRibOut
+from exabgp_parser import UpdateParser, updates_from_object
+from swift_workers import SwiftProcessPool, feed, reset_log_handlers
+from shards import shard_of, announcement_neighbor, ShardOutput
 
 
 
@@ -24,13 +31,18 @@ np = os.path.dirname(os.path.dirname(os.path.realpath(__file__)))
 if np not in sys.path:
     sys.path.append(np)
 import util.log
+from util.trace import tracer, install_dump_handler, XRS_RECEIVE, XRS_SEND
+import util.wire
 
 from server import server as Server
 
 
 logger = util.log.getLogger('XRS')
 
-Config = namedtuple('Config', 'ah_socket')
+Config = namedtuple('Config', 'ah_socket max_batch_size max_batch_delay receiver_queue_size peer_queue_size '
+                               'backlog_high_watermark backlog_low_watermark '
+                               'dispatcher_high_watermark dispatcher_low_watermark trace_sample_every '
+                               'shards shard_base_port')
 
 bgpListener = None
 config = None
@@ -38,12 +50,46 @@ config = None
 participantsLock = Lock()
 participants = dict()
 portip2participant = dict()
+# advertiser id -> tuple of PctrlClients that receive its routes
+recipients = dict()
 
 clientPoolLock = Lock()
 clientActivePool = dict()
 clientDeadPool = set()
 
 
+def add_recipient(client):
+    "Add a client to the fan-out index. Must be called with participantsLock held."
+    # routes advertised by the new client
+    recipients[client.id] = tuple(peer for id, peer in participants.iteritems()
+                                  if id in client.peers_out and client.id in peer.peers_in)
+
+    # routes the new client receives from the other participants
+    for advertise_id in client.peers_in:
+        advertiser = participants.get(advertise_id)
+        if advertiser is None or advertiser is client:
+            continue
+        if client.id in advertiser.peers_out:
+            recipients[advertise_id] = recipients.get(advertise_id, ()) + (client,)
+
+
+def remove_recipient(client):
+    "Remove a client from the fan-out index. Must be called with participantsLock held."
+    recipients.pop(client.id, None)
+
+    for advertise_id in client.peers_in:
+        if advertise_id in recipients:
+            recipients[advertise_id] = tuple(peer for peer in recipients[advertise_id] if peer is not client)
+
+
+def get_recipients(advertise_ip):
+    "Lock-free lookup of the clients that receive routes from the given neighbor"
+    advertise_id = portip2participant.get(advertise_ip)
+    if advertise_id is None:
+        return ()
+    return recipients.get(advertise_id, ())
+
+
 class PctrlClient(object):
     def __init__(self, conn, addr):
         self.conn = conn
@@ -53,6 +99,15 @@ class PctrlClient(object):
         self.peers_in = []
         self.peers_out = []
 
+        # routes sent to this participant, only accessed by the sender thread
+        self.adj_rib_out = AdjRibOut()
+
+        # updates are coalesced into 'bgp_batch' frames if batching is enabled
+        self.send_lock = Lock()
+        self.batcher = None
+        if config.max_batch_size > 1:
+            self.batcher = UpdateBatcher(self.send_batch, config.max_batch_size, config.max_batch_delay, logger)
+
     def start(self):
         logger.info('BGP PctrlClient started for client ip %s.', self.addr)
         while True:
@@ -62,9 +117,11 @@ class PctrlClient(object):
                 break
 
             #logger.debug('Trace: Got rv: %s', rv)
-            if not (rv and self.process_message(**json.loads(rv))):
+            if not (rv and self.process_message(**rv)):
                 break
 
+        if self.batcher is not None:
+            self.batcher.stop()
         self.conn.close()
 
         # remove self
@@ -87,6 +144,9 @@ class PctrlClient(object):
             found = [k for k,v in participants.items() if v == self]
             for k in found:
                 del participants[k]
+            if found:
+                remove_recipient(self)
+            bgpListener.update_registry()
             logger.debug('Trace: PctrlClient.start: portip2participant after: %s', portip2participant)
             logger.debug('Trace: PctrlClient.start: participants after: %s', participants)
 
@@ -109,16 +169,24 @@ class PctrlClient(object):
             logger.warn("hello message from %s is missing something: id: %s, ports: %s, peers_in: %s, peers_out: %s. Closing connection.", self.addr, id, ports, peers_in, peers_out)
             return False
 
-        self.id = id = int(id)
-        self.peers_in = set(peers_in)
-        self.peers_out = set(peers_out)
+        id = int(id)
 
         with participantsLock:
             logger.debug('Trace: PctrlClient.hello: portip2participant before: %s', portip2participant)
             logger.debug('Trace: PctrlClient.hello: participants before: %s', participants)
+            # drop the fan-out entries of a previous session with the same id
+            if id in participants:
+                remove_recipient(participants[id])
+
+            self.id = id
+            self.peers_in = set(peers_in)
+            self.peers_out = set(peers_out)
+
             for port in ports:
                 portip2participant[port] = id
             participants[id] = self
+            add_recipient(self)
+            bgpListener.update_registry()
             logger.debug('Trace: PctrlClient.hello: portip2participant after: %s', portip2participant)
             logger.debug('Trace: PctrlClient.hello: participants after: %s', participants)
 
@@ -132,13 +200,34 @@ class PctrlClient(object):
 
 
     def send(self, route):
+        # drop the updates that do not change what the participant already has
+        if not self.adj_rib_out.update(route):
+            logger.debug('Suppressed a duplicate route update to participant %d', self.id)
+            return
+
         logger.debug('Sending a route update to participant %d', self.id)
-        self.conn.send({'bgp': route})
+        if self.batcher is not None:
+            self.batcher.add(route)
+        else:
+            with self.send_lock:
+                self.conn.send({'bgp': route})
+
+    def send_batch(self, routes):
+        logger.debug('Sending a batch of %d route updates to participant %d', len(routes), self.id)
+        with self.send_lock:
+            self.conn.send({'bgp_batch': routes})
 
     def send_FR(self, route):
         logger.info("sending FR")
         print "sending FR"
-        self.conn.send(route)
+        if 'down' in route:
+            # the participant withdraws the routes of the neighbor itself
+            self.adj_rib_out.clear(route['down'])
+        # deliver the pending updates first to keep the order of the session
+        if self.batcher is not None:
+            self.batcher.flush()
+        with self.send_lock:
+            self.conn.send(route)
 
 class PctrlListener(object):
     def __init__(self):
@@ -151,7 +240,8 @@ class PctrlListener(object):
         logger.info("Starting the BGP PctrlListener")
 
         while self.run:
-            conn = self.listener.accept()
+            # answers each participant controller in the wire format it uses
+            conn = util.wire.WireConnection(self.listener.accept(), route_factory=BGPRoute)
 
             pc = PctrlClient(conn, self.listener.last_accepted)
             t = Thread(target=pc.start)
@@ -176,13 +266,21 @@ class PctrlListener(object):
 
 
 class BGPListener(object):
-    def __init__(self, swift_config):
+    def __init__(self, swift_config, port=6000, server=None):
         logger.info('Initializing the BGPListener')
 
-        # Initialize XRS Server
-        self.server = Server(logger)
+        # Initialize XRS Server, unless one is given (e.g. by the benchmark)
+        self.server = server
+        if self.server is None:
+            self.server = Server(logger, config.receiver_queue_size, port)
         self.run = True
 
+        # neighbor -> number of times its session went down, the updates received
+        # before the last time are dropped
+        self.epochs = {}
+        # neighbor -> epoch of the last session down sent to the participants
+        self.down_epochs = {}
+
         #Get Bpa parameters from sdg_global config file
         self.win_size = swift_config["win_size"]
         self.nb_withdrawals_burst_start = swift_config["nb_withdrawals_burst_start"]
@@ -197,7 +295,39 @@ class BGPListener(object):
         self.run_encoding_threshold = swift_config["run_encoding_threshold"]
         self.silent = swift_config["silent"]
 
-    def start(self):
+        # Parameters of run_peer shared by all the SWIFT workers
+        self.peer_kwargs = dict(win_size=self.win_size,
+                                nb_withdrawals_burst_start=self.nb_withdrawals_burst_start,
+                                nb_withdrawals_burst_end=self.nb_withdrawals_burst_end,
+                                min_bpa_burst_size=self.min_bpa_burst_size,
+                                burst_outdir="bursts",
+                                max_depth=self.max_depth,
+                                nb_withdraws_per_cycle=self.fm_freq,
+                                p_w=self.p_w,
+                                r_w=self.r_w,
+                                bpa_algo=self.bpa_algo,
+                                nb_bits_aspath=self.nb_bits_aspath,
+                                run_encoding_threshold=self.run_encoding_threshold,
+                                silent=self.silent,
+                                snapshot_interval=swift_config.get("snapshot_interval", 0),
+                                snapshot_dir=swift_config.get("snapshot_dir", "snapshots"),
+                                reconcile_timeout=swift_config.get("reconcile_timeout", 60),
+                                incremental_bpa=swift_config.get("incremental_bpa", True),
+                                async_bpa=swift_config.get("async_bpa", False))
+
+        # Run the SWIFT workers in a pool of processes instead of one thread per peer
+        self.swift_pool = None
+        nb_worker_processes = swift_config.get("worker_processes", 0)
+        if nb_worker_processes > 0:
+            self.swift_pool = SwiftProcessPool(logger, nb_worker_processes, self.peer_kwargs, config.peer_queue_size,
+                                               config.backlog_high_watermark, config.backlog_low_watermark)
+            self.swift_pool.start()
+
+    """
+    In a shard process, the messages for the participants go to the given
+    dispatcher and the coordinator sends them.
+    """
+    def start(self, dispatcher=None):
         logger.info("Starting the Server to handle incoming BGP Updates.")
         self.server.start()
 
@@ -205,33 +335,52 @@ class BGPListener(object):
 
         self.peer_queue_dict = {}
 
-        self.peer_queue = Queue.Queue()
-
-        self.FR_queue = Queue.Queue()
+        # FR, down and update messages for the participants, by priority
+        self.dispatcher = dispatcher
+        if self.dispatcher is None:
+            self.dispatcher = PriorityDispatcher(config.dispatcher_high_watermark, config.dispatcher_low_watermark)
+        # messages waiting for room in the queue of their SWIFT worker
+        self.backlog = PeerBacklog(config.backlog_high_watermark, config.backlog_low_watermark)
+        if self.swift_pool:
+            self.swift_pool.start_feeders(self.dispatcher)
 
         self.waiting = 0
+        # decodes the messages of ExaBGP into route updates
+        self.parser = UpdateParser()
 
         route_server_listener_thread = Thread(target= self.Route_server_listener)
 
-        route_server_sender_thread = Thread(target= self.Route_server_sender)
+        if dispatcher is None:
+            route_server_sender_thread = Thread(target= self.Route_server_sender)
+            route_server_sender_thread.start()
 
-        route_server_sender_thread.start()
         route_server_listener_thread.start()
 
     def send(self, announcement):
         self.server.sender_queue.put(announcement)
 
+    def update_registry(self):
+        "Nothing to do, the listener reads portip2participant directly"
+        pass
+
 
     def stop(self):
         logger.info("Stopping BGPListener.")
         self.run = False
+        self.dispatcher.close()
+        if self.swift_pool:
+            self.swift_pool.stop()
 
     def Route_server_listener(self):
 
         while self.run:
             try:
-                route = self.server.receiver_queue.get(True, 1)
+                # the backlog is retried often as long as there is one
+                route = self.server.receiver_queue.get(True, 0.05 if self.backlog else 1)
             except Queue.Empty:
+                if self.backlog:
+                    self.backlog.drain(self.try_submit)
+                    continue
                 if self.waiting == 0:
                     logger.debug("Waiting for BGP update...")
                 self.waiting = (self.waiting+1) % 30
@@ -239,15 +388,13 @@ class BGPListener(object):
 
             self.waiting = 0
 
-            route = json.loads(route)
-
             logger.info("Got route from ExaBGP: %s", route)
             logger.debug("Got route from ExaBGP: %s", route)
 
-            # Received BGP route advertisement from ExaBGP
+            # Received BGP route advertisement from ExaBGP, possibly already decoded by its bridge
             try:
-                advertise_ip = route['neighbor']['ip']
-            except KeyError:
+                advertise_ip, route_list = self.parser.parse(route)
+            except (KeyError, ValueError, TypeError):
                 print "KEYERROR", route
                 logger.debug("KEYERROR" + str(route))
                 continue
@@ -258,202 +405,243 @@ class BGPListener(object):
                 except KeyError:
                     continue
 
-            route_list = self.route_2_bgp_updates(route)
-
             if len(route_list) == 1:
                 if 'down' in route_list[0]:
                     logger.debug("down route received" + str(route_list[0]))
-                    self.peer_queue.put(route_list[0])
+                    self.session_down(advertise_id, advertise_ip)
+                    self.dispatcher.put(dict(route_list[0], epoch=self.epochs[advertise_ip]))
                     continue
-            #@TODO: when no more links to participant are active stop its siwft process
-
-
-            if advertise_id not in self.peer_queue_dict:
-                print "launching swift for peer_id:", advertise_id
-                self.peer_queue_dict[advertise_id] = Queue.Queue()
-                with participantsLock:
-                    self.peer_swift_dict[advertise_id] = Thread(target=run_peer, \
-                                    args=(logger, self.peer_queue_dict[advertise_id], self.peer_queue, self.FR_queue, self.win_size,advertise_id, self.nb_withdrawals_burst_start, \
-                                    self.nb_withdrawals_burst_end, self.min_bpa_burst_size, "bursts", self.max_depth, self.fm_freq, self.p_w, \
-                                    self.r_w, self.bpa_algo, self.nb_bits_aspath, self.run_encoding_threshold, \
-                                    self.silent))
-
-                self.peer_swift_dict[advertise_id].start()
 
+            epoch = self.epochs.get(advertise_ip, 0)
             for route in route_list:
-                self.peer_queue_dict[advertise_id].put(route)
-
+                if epoch:
+                    route['epoch'] = epoch
+                # latency trace of the sampled updates
+                trace = tracer.start(XRS_RECEIVE)
+                if trace is not None:
+                    route['trace'] = trace
+                self.submit(advertise_id, route)
+
+            if self.backlog:
+                self.backlog.drain(self.try_submit)
+
+                # stop reading from ExaBGP until the SWIFT workers caught up
+                if self.backlog.is_overloaded():
+                    logger.info("Backlog of %d updates, pausing the BGP input", len(self.backlog))
+                    self.backlog.drain_until_low(self.try_submit, lambda: self.run)
+                    logger.info("Backlog down to %d updates, resuming the BGP input", len(self.backlog))
 
         for thread in self.peer_swift_dict.items():
             thread.stop()
 
+    """
+    Session down fast path: the updates of the neighbor still in the backlog
+    are dropped, the ones already in the SWIFT worker or the dispatcher are
+    dropped by the sender as stale, and the worker resets its state.
+    """
+    def session_down(self, advertise_id, advertise_ip):
+        self.epochs[advertise_ip] = self.epochs.get(advertise_ip, 0) + 1
+        dropped = self.backlog.purge(advertise_id, advertise_ip)
+        logger.info('Session of %s down, %d updates dropped from the backlog', advertise_ip, dropped)
+
+        if advertise_id in self.peer_queue_dict or (self.swift_pool and advertise_id in self.swift_pool.peer_2_process):
+            self.submit(advertise_id, {'down': advertise_ip})
+
+    def is_stale(self, route):
+        "True for an update received before the last session down of its neighbor"
+        return route.get('epoch', 0) != self.epochs.get(message_neighbor(route), 0)
+
+    def submit(self, advertise_id, route):
+        "Hand a message over to the SWIFT worker of a peer, or queue it in the backlog of the peer"
+        if self.backlog.has_backlog(advertise_id) or not self.try_submit(advertise_id, route):
+            self.backlog.put(advertise_id, route)
+
+    def try_submit(self, advertise_id, route):
+        if self.swift_pool:
+            return self.swift_pool.submit(advertise_id, route, block=False)
+
+        if advertise_id not in self.peer_queue_dict:
+            print "launching swift for peer_id:", advertise_id
+            self.peer_queue_dict[advertise_id] = PeerQueue(config.peer_queue_size, self.backlog.space_available)
+            with participantsLock:
+                self.peer_swift_dict[advertise_id] = Thread(target=run_peer, \
+                                args=(logger, self.peer_queue_dict[advertise_id], self.dispatcher, self.dispatcher), \
+                                kwargs=dict(peer_id=advertise_id, **self.peer_kwargs))
+
+            self.peer_swift_dict[advertise_id].start()
+
+        try:
+            self.peer_queue_dict[advertise_id].put_nowait(route)
+        except Queue.Full:
+            return False
+        return True
+
     def Route_server_sender(self):
         while self.run:
-            route = None
-            try:
-                route = self.FR_queue.get(False)
-            except Queue.Empty:
-                pass
-
+            # blocks until a message arrives, FR messages first
+            route = self.dispatcher.get()
             if route is None:
-                try:
-                    route = self.peer_queue.get(False)
-                except Queue.Empty:
-                    continue
+                break
 
             if 'FR' in route:
                 peer_id = route['FR']['peer_id']
-                found = []
-                with participantsLock:
-                    try:
-                        peers_out = participants[peer_id].peers_out
-                    except KeyError:
-                        continue
-
-                    for id, peer in participants.iteritems():
-                        # Apply the filtering logic
-                        if id in peers_out and peer_id in peer.peers_in:
-                            found.append(peer)
-
-                for peer in found:
+                for peer in recipients.get(peer_id, ()):
                     # Now send this route to participant `id`'s controller'
                     peer.send_FR(route)
 
             elif 'down' in route:
-                try:
-                    advertise_ip = route['down']
-                except KeyError:
-                    print "KEYERROR", route
-                    logger.debug("KEYERROR" + str(route))
-                    continue
-                found = []
-                with participantsLock:
-                    try:
-                        advertise_id = portip2participant[advertise_ip]
-                        peers_out = participants[advertise_id].peers_out
-                    except KeyError:
-                        continue
-
-                    for id, peer in participants.iteritems():
-                        # Apply the filtering logic
-                        if id in peers_out and advertise_id in peer.peers_in:
-                            found.append(peer)
-
-                for peer in found:
-                    # Now send this route to participant `id`'s controller'
-                    peer.send_FR(route)
+                # already sent if the first update of the next session came first
+                if route['epoch'] > self.down_epochs.get(route['down'], 0):
+                    self.send_down(route['down'], route['epoch'])
 
             else:
-
                 if 'announce' in route:
-                    try:
-                        advertise_ip = route['announce'].neighbor
-                    except KeyError:
-                        print "KEYERROR", route
-                        logger.debug("KEYERROR" + str(route))
-                        continue
-                if 'withdraw' in route:
-                    try:
-                        advertise_ip = route['withdraw'].neighbor
-                    except KeyError:
-                        print "KEYERROR", route
-                        logger.debug("KEYERROR" + str(route))
-                        continue
-
-                found = []
-                with participantsLock:
-                    try:
-                        advertise_id = portip2participant[advertise_ip]
-                        peers_out = participants[advertise_id].peers_out
-                    except KeyError:
-                        continue
-
-                    for id, peer in participants.iteritems():
-                        # Apply the filtering logic
-                        if id in peers_out and advertise_id in peer.peers_in:
-                            found.append(peer)
-
-                for peer in found:
+                    advertise_ip = route['announce'].neighbor
+                elif 'withdraw' in route:
+                    advertise_ip = route['withdraw'].neighbor
+                else:
+                    logger.debug("Unknown route type " + str(route))
+                    continue
+
+                epoch = route.get('epoch', 0)
+                if epoch < self.down_epochs.get(advertise_ip, 0):
+                    # received before the last session down of the neighbor
+                    continue
+                if epoch > self.down_epochs.get(advertise_ip, 0):
+                    # the down of the previous session is still on its way (sharded mode)
+                    self.send_down(advertise_ip, epoch)
+                route = without_epoch(route)
+
+                tracer.stamp(route.get('trace'), XRS_SEND)
+
+                for peer in get_recipients(advertise_ip):
                     # Now send this route to participant `id`'s controller'
                     peer.send(route)
 
+    """
+    Send the session down of a neighbor to the participants. The epoch of the
+    down is the one of the updates of the next session: the older ones still
+    queued are dropped by the sender from now on.
+    """
+    def send_down(self, neighbor, epoch):
+        self.down_epochs[neighbor] = epoch
+        route = {'down': neighbor}
+        for peer in get_recipients(neighbor):
+            # Now send this route to participant `id`'s controller'
+            peer.send_FR(route)
+
     def route_2_bgp_updates(self, route):
-        origin = None
-        as_path = None
-        as_path_vmac = None
-        med = None
-        atomic_aggregate = None
-        communities = None
-
-        route_list = []
-
-        if 'state' in route['neighbor'] and route['neighbor']['state'] == 'down':
-            print "state down update received from:", route['neighbor']['ip']
-            down_ip = route['neighbor']['ip']
-            route_list.append({'down': down_ip})
-            return route_list
-
-        # Extract out neighbor information in the given BGP update
-        neighbor = route["neighbor"]["ip"]
-        if 'message' in route['neighbor']:
-            if 'update' in route['neighbor']['message']:
-                time = route['time']
-                if 'attribute' in route['neighbor']['message']['update']:
-                    attribute = route['neighbor']['message']['update']['attribute']
-
-                    origin = attribute['origin'] if 'origin' in attribute else ''
-
-                    as_path = attribute['as-path'] if 'as-path' in attribute else []
-
-                    as_path_vmac = attribute['as_path_vmac'] if 'as_path_vmac' in attribute else None
-
-                    med = attribute['med'] if 'med' in attribute else ''
-
-                    community = attribute['community'] if 'community' in attribute else ''
-                    communities = ''
-                    for c in community:
-                        communities += ':'.join(map(str,c)) + " "
-
-                    atomic_aggregate = attribute['atomic-aggregate'] if 'atomic-aggregate' in attribute else ''
-
-                if 'announce' in route['neighbor']['message']['update']:
-                    announce = route['neighbor']['message']['update']['announce']
-                    if 'ipv4 unicast' in announce:
-                        for next_hop in announce['ipv4 unicast'].keys():
-                            for prefix in announce['ipv4 unicast'][next_hop].keys():
-                                announced_route = BGPRoute(prefix,
-                                                           neighbor,
-                                                           next_hop,
-                                                           origin,
-                                                           as_path,
-                                                           as_path_vmac,
-                                                           communities,
-                                                           med,
-                                                           atomic_aggregate
-                                                           )
-
-                                route_list.append({'announce': announced_route ,'time': time})
-
-                elif 'withdraw' in route['neighbor']['message']['update']:
-                    withdraw = route['neighbor']['message']['update']['withdraw']
-                    if 'ipv4 unicast' in withdraw:
-                        next_hop = None
-                        for prefix in withdraw['ipv4 unicast'].keys():
-                            withdrawn_route = BGPRoute(prefix,
-                                                           neighbor,
-                                                           next_hop,
-                                                           origin,
-                                                           as_path,
-                                                           as_path_vmac,
-                                                           communities,
-                                                           med,
-                                                           atomic_aggregate,
-                                                           )
-                            route_list.append({'withdraw': withdrawn_route, 'time': time})
-
-        return route_list
+        return updates_from_object(route)
+
+
+
+
+class ShardedBGPListener(BGPListener):
+    """
+    Coordinator of the sharded route server. The shard processes receive the
+    BGP updates from their own ExaBGP instance and run the SWIFT workers of
+    their neighbors. The coordinator keeps the participant registry, pushes
+    it to the shards, and sends the messages of all the shards to the
+    participant controllers through one dispatcher, so that the fan-out,
+    the Adj-RIB-outs and the batching are the same as with a single XRS.
+    """
+    def __init__(self, swift_config, nb_shards, base_port):
+        logger.info('Initializing the sharded BGPListener with %d shards', nb_shards)
+        self.run = True
+        self.nb_shards = nb_shards
+        # the shards count the session downs and tag the updates with their epoch,
+        # the coordinator only keeps the epochs of the downs it sent
+        self.epochs = {}
+        self.down_epochs = {}
+
+        self.outbox = MPQueue(config.peer_queue_size)
+        self.fr_outbox = MPQueue()
+
+        self.controls = []
+        self.shards = []
+        for shard_id in range(0, nb_shards):
+            control = MPQueue()
+            p = Process(target=run_shard, args=(shard_id, base_port + shard_id, swift_config,
+                                                control, self.outbox, self.fr_outbox))
+            p.daemon = True
+            self.controls.append(control)
+            self.shards.append(p)
+
+        # forked before any thread of the route server is started
+        for p in self.shards:
+            p.start()
+
+    def start(self):
+        # FR, down and update messages for the participants, by priority
+        self.dispatcher = PriorityDispatcher(config.dispatcher_high_watermark, config.dispatcher_low_watermark)
+
+        for outbox in (self.fr_outbox, self.outbox):
+            t = Thread(target=feed, args=(outbox, self.dispatcher))
+            t.daemon = True
+            t.start()
+
+        self.Route_server_sender()
+
+    def send(self, announcement):
+        "Hand the announcement to the shard which holds the session with its neighbor"
+        neighbor = announcement_neighbor(announcement)
+        if neighbor is None:
+            for control in self.controls:
+                control.put(('announce', announcement))
+        else:
+            self.controls[shard_of(neighbor, self.nb_shards)].put(('announce', announcement))
 
+    def update_registry(self):
+        "Push the registry to the shards. Must be called with participantsLock held."
+        registry = dict(portip2participant)
+        for control in self.controls:
+            control.put(('registry', registry))
 
+    def stop(self):
+        logger.info("Stopping the sharded BGPListener.")
+        self.run = False
+        self.dispatcher.close()
+        for control in self.controls:
+            control.put(None)
+        self.outbox.put(None)
+        self.fr_outbox.put(None)
+
+
+"""
+Main function of a shard process: a BGPListener for the ExaBGP instance
+connected on port, streaming its messages to the coordinator.
+"""
+def run_shard(shard_id, port, swift_config, control, outbox, fr_outbox):
+    global bgpListener
+
+    reset_log_handlers(logger)
+    logger.info('Shard %d waiting for ExaBGP on port %d', shard_id, port)
+
+    # the SWIFT workers of a participant in several shards must not share their snapshots
+    swift_config = dict(swift_config)
+    swift_config["snapshot_dir"] = os.path.join(swift_config.get("snapshot_dir", "snapshots"), 'shard_%d' % shard_id)
+
+    bgpListener = BGPListener(swift_config, port)
+    output = ShardOutput(outbox, fr_outbox, bgpListener.is_stale)
+    bp_thread = Thread(target=bgpListener.start, args=(output,))
+    bp_thread.daemon = True
+    bp_thread.start()
+
+    while True:
+        msg = control.get()
+        if msg is None:
+            break
+
+        msg_type, data = msg
+        if msg_type == 'registry':
+            with participantsLock:
+                for ip in [ip for ip in portip2participant if ip not in data]:
+                    del portip2participant[ip]
+                portip2participant.update(data)
+        elif msg_type == 'announce':
+            bgpListener.send(data)
+
+    bgpListener.stop()
 
 
 def parse_config(config_file):
@@ -467,8 +655,30 @@ def parse_config(config_file):
 
     ah_socket = tuple(config["Route Server"]["AH_SOCKET"])
 
+    # batching of the updates sent to the participant controllers (disabled by default)
+    max_batch_size = int(config["Route Server"].get("Max Batch Size", 1))
+    max_batch_delay = float(config["Route Server"].get("Max Batch Delay", 0))
+
+    # bounds of the queues between the stages, 0 means unbounded
+    queues = config["Route Server"].get("Queues", {})
+    receiver_queue_size = int(queues.get("Receiver Queue Size", 0))
+    peer_queue_size = int(queues.get("Peer Queue Size", 0))
+    backlog_high_watermark = int(queues.get("Backlog High Watermark", 0))
+    backlog_low_watermark = int(queues.get("Backlog Low Watermark", backlog_high_watermark / 2))
+    dispatcher_high_watermark = int(queues.get("Dispatcher High Watermark", 0))
+    dispatcher_low_watermark = int(queues.get("Dispatcher Low Watermark", dispatcher_high_watermark / 2))
+
+    # one update out of "Sample Every" carries a latency trace, 0 disables tracing
+    trace_sample_every = int(config.get("Tracing", {}).get("Sample Every", 0))
+
+    # number of ExaBGP feeds, shard i listens on "Shard Base Port" + i
+    shards = int(config["Route Server"].get("Shards", 1))
+    shard_base_port = int(config["Route Server"].get("Shard Base Port", 6000))
+
     logger.debug("Done parsing config")
-    return Config(ah_socket)
+    return Config(ah_socket, max_batch_size, max_batch_delay, receiver_queue_size, peer_queue_size,
+                  backlog_high_watermark, backlog_low_watermark, dispatcher_high_watermark, dispatcher_low_watermark,
+                  trace_sample_every, shards, shard_base_port)
 
 def parse_swift_config(config_file):
 
@@ -492,6 +702,10 @@ def main():
 
     swift_config = parse_swift_config(config_file)
 
+    # latency histograms are dumped with kill -USR1
+    tracer.configure('XRS', logger, config.trace_sample_every)
+    install_dump_handler()
+
     #swift log directories
     if not os.path.exists('log'):
         os.makedirs('log')
@@ -507,7 +721,10 @@ def main():
     handler.setFormatter(formatter)
     main_logger.addHandler(handler)
 
-    bgpListener = BGPListener(swift_config)
+    if config.shards > 1:
+        bgpListener = ShardedBGPListener(swift_config, config.shards, config.shard_base_port)
+    else:
+        bgpListener = BGPListener(swift_config, config.shard_base_port)
     bp_thread = Thread(target=bgpListener.start)
     bp_thread.start()
 
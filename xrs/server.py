@@ -2,57 +2,97 @@
 #  Author:
 #  Muhammad Shahbaz (muhammad.shahbaz@gatech.edu)
 
-from multiprocessing import Queue
 from multiprocessing.connection import Listener
-from threading import Thread
+from Queue import Queue
+from threading import Condition, Thread
+
+from bridge import encode_lines, decode_frame, drain
 
 ''' bgp server '''
 class server(object):
 
-    def __init__(self, logger):
+    def __init__(self, logger, receiver_queue_size=0, port=6000):
         self.logger = logger
 
-        self.listener = Listener(('localhost', 6000), authkey='xrs', backlog=100)
+        self.listener = Listener(('localhost', port), authkey='xrs', backlog=100)
 
+        # both ends of the queues are threads of the route server
         self.sender_queue = Queue()
-        self.receiver_queue = Queue()
+        # once full, the receiver stops reading and ExaBGP gets blocked
+        self.receiver_queue = Queue(receiver_queue_size)
+
+        # connection to the bridge of ExaBGP, None while it is reconnecting
+        self.conn = None
+        self.conn_cond = Condition()
 
     def start(self):
-        self.conn = self.listener.accept()
-        self.logger.debug('Connection accepted from '+str(self.listener.last_accepted))
+        self.accept()
 
-        self.sender = Thread(target=_sender, args=(self.conn,self.sender_queue))
+        self.sender = Thread(target=self._sender)
+        self.sender.daemon = True
         self.sender.start()
 
-        self.receiver = Thread(target=_receiver, args=(self.conn,self.receiver_queue))
+        self.receiver = Thread(target=self._receiver)
+        self.receiver.daemon = True
         self.receiver.start()
 
-''' sender '''
-def _sender(conn,queue):
-    while True:
-        try:
-            line = queue.get()
-            conn.send(line)
-        except:
-            pass
+    def accept(self):
+        conn = self.listener.accept()
+        self.logger.debug('Connection accepted from '+str(self.listener.last_accepted))
+        with self.conn_cond:
+            self.conn = conn
+            self.conn_cond.notify_all()
 
-''' receiver '''
-def _receiver(conn,queue):
-    while True:
+    def drop(self, conn):
+        "Forget a dead connection, the bridge of ExaBGP connects again"
+        with self.conn_cond:
+            if self.conn is conn:
+                self.conn = None
+                self.logger.info('Lost the connection to ExaBGP, waiting for it to come back')
         try:
-            line = conn.recv()
-            queue.put(line)
-        except:
+            conn.close()
+        except (IOError, OSError):
             pass
 
+    ''' receiver '''
+    def _receiver(self):
+        while True:
+            conn = self.conn
+            if conn is None:
+                self.accept()
+                continue
+            try:
+                data = conn.recv_bytes()
+            except (EOFError, IOError):
+                self.drop(conn)
+                continue
+
+            for item in decode_frame(data):
+                self.receiver_queue.put(item)
+
+    ''' sender '''
+    def _sender(self):
+        while True:
+            # all the announcements waiting go in one frame
+            frame = encode_lines(drain(self.sender_queue, self.sender_queue.get()))
+
+            while True:
+                with self.conn_cond:
+                    while self.conn is None:
+                        self.conn_cond.wait()
+                    conn = self.conn
+                try:
+                    conn.send_bytes(frame)
+                    break
+                except (EOFError, IOError):
+                    self.drop(conn)
+
 ''' main '''
 if __name__ == '__main__':
+    import logging
+    logging.basicConfig(level=logging.DEBUG)
+    server = server(logging.getLogger('xrs-server'))
+    server.start()
     while True:
-        server = server()
-        while True:
-            try:
-                print server.receiver_queue.get()
-                server.sender_queue.put('announce route %s next-hop %s as-path [ %s ]' % ('200.0.0.0/16','172.0.0.1','100'))
-            except:
-                print 'thread ended'
-                break
+        print server.receiver_queue.get()
+        server.sender_queue.put('announce route %s next-hop %s as-path [ %s ]' % ('200.0.0.0/16','172.0.0.1','100'))
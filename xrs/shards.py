@@ -0,0 +1,49 @@
+import zlib
+
+from dispatcher import message_lane, UPDATE_LANE
+from swift_workers import encode_message
+
+
+"""
+Helpers of the sharded route server. In sharded mode, the BGP neighbors are
+partitioned across several shard processes, each one with its own ExaBGP
+instance connected on base port + shard id. The ExaBGP instance of shard i
+must hold the sessions of the neighbors for which shard_of() returns i.
+"""
+def shard_of(neighbor_ip, nb_shards):
+    "Stable shard of a neighbor, the same in every process and across restarts"
+    return (zlib.crc32(str(neighbor_ip)) & 0xffffffff) % nb_shards
+
+
+def announcement_neighbor(announcement):
+    "Neighbor of an ExaBGP command like 'neighbor 172.0.0.1 announce route ...', None if there is none"
+    fields = announcement.split(None, 2)
+    if len(fields) >= 2 and fields[0] == 'neighbor':
+        return fields[1]
+    return None
+
+
+"""
+Stands in for the dispatcher of the route server in a shard process: the
+messages of the SWIFT workers and the listener are flattened and streamed to
+the coordinator, FR and down messages over their own queue so that they are
+never stuck behind updates. The updates for which is_stale returns True are
+dropped, the others keep their epoch: the down of their neighbor may overtake
+them, the coordinator drops them then.
+"""
+class ShardOutput(object):
+    def __init__(self, outbox, fr_outbox, is_stale=None):
+        self.outbox = outbox
+        self.fr_outbox = fr_outbox
+        self.is_stale = is_stale
+
+    def put(self, msg, block=True, timeout=None):
+        if message_lane(msg) == UPDATE_LANE:
+            if self.is_stale is not None and self.is_stale(msg):
+                return
+            self.outbox.put(encode_message(msg), block, timeout)
+        else:
+            self.fr_outbox.put(msg)
+
+    def close(self):
+        pass
@@ -0,0 +1,139 @@
+import cPickle as pickle
+import mmap
+import os
+import struct
+import zlib
+
+
+"""
+Crash-consistent snapshots of the state of a SWIFT worker, used to warm
+restart XRS. The snapshot file is memory-mapped and holds two slots, each
+one with a header (sequence number, length, crc32) and a pickled payload.
+A snapshot is written in the slot not holding the latest one, payload
+first and header last, so that a crash at any time leaves at least one
+valid slot. When a snapshot outgrows its slot, a larger file is written
+next to the current one and renamed over it.
+"""
+FILE_HEADER = struct.Struct('!4sBI')    # magic, version, slot size
+SLOT_HEADER = struct.Struct('!QII')     # sequence number, payload length, crc32 of the payload
+
+MAGIC = 'XRSS'
+VERSION = 1
+MIN_SLOT_SIZE = 1 << 20
+
+
+class SnapshotFile(object):
+    def __init__(self, path):
+        self.path = path
+        self.fd = None
+        self.map = None
+        self.slot_size = 0
+        self.sequence = 0
+
+        dirname = os.path.dirname(path)
+        if dirname and not os.path.exists(dirname):
+            os.makedirs(dirname)
+
+    def slot_offset(self, slot):
+        return FILE_HEADER.size + slot * (SLOT_HEADER.size + self.slot_size)
+
+    def _map(self, fd, slot_size):
+        self.close()
+        self.fd = fd
+        self.slot_size = slot_size
+        self.map = mmap.mmap(fd, self.slot_offset(2))
+
+    def _read_slot(self, slot):
+        "Returns (sequence, payload) of a slot, or None if it is empty or corrupted"
+        offset = self.slot_offset(slot)
+        sequence, length, crc = SLOT_HEADER.unpack_from(self.map, offset)
+        if sequence == 0 or length > self.slot_size:
+            return None
+        payload = self.map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + length]
+        if zlib.crc32(payload) & 0xffffffff != crc:
+            return None
+        return sequence, payload
+
+    """
+    Returns the state of the latest valid snapshot, or None if there is none.
+    """
+    def load(self):
+        if not os.path.exists(self.path):
+            return None
+
+        fd = os.open(self.path, os.O_RDWR)
+        header = os.read(fd, FILE_HEADER.size)
+        if len(header) < FILE_HEADER.size:
+            os.close(fd)
+            return None
+        magic, version, slot_size = FILE_HEADER.unpack(header)
+        if magic != MAGIC or version != VERSION or os.fstat(fd).st_size < FILE_HEADER.size + 2 * (SLOT_HEADER.size + slot_size):
+            os.close(fd)
+            return None
+        self._map(fd, slot_size)
+
+        slots = [s for s in (self._read_slot(0), self._read_slot(1)) if s is not None]
+        if not slots:
+            return None
+        self.sequence, payload = max(slots)
+        try:
+            return pickle.loads(payload)
+        except Exception:
+            return None
+
+    def _write_slot(self, slot, data):
+        offset = self.slot_offset(slot)
+        self.map[offset + SLOT_HEADER.size:offset + SLOT_HEADER.size + len(data)] = data
+        self.map.flush()
+        self.map[offset:offset + SLOT_HEADER.size] = SLOT_HEADER.pack(self.sequence, len(data), zlib.crc32(data) & 0xffffffff)
+        self.map.flush()
+
+    def save(self, state):
+        data = pickle.dumps(state, pickle.HIGHEST_PROTOCOL)
+        self.sequence += 1
+
+        if self.map is not None and len(data) <= self.slot_size:
+            self._write_slot(self.sequence % 2, data)
+            return
+
+        # the current file stays valid until the new one is renamed over it
+        slot_size = max(MIN_SLOT_SIZE, 2 * len(data))
+        tmp_path = self.path + '.tmp'
+        fd = os.open(tmp_path, os.O_RDWR | os.O_CREAT | os.O_TRUNC, 0644)
+        os.ftruncate(fd, FILE_HEADER.size + 2 * (SLOT_HEADER.size + slot_size))
+        os.write(fd, FILE_HEADER.pack(MAGIC, VERSION, slot_size))
+        self._map(fd, slot_size)
+        self._write_slot(self.sequence % 2, data)
+        os.fsync(fd)
+        os.rename(tmp_path, self.path)
+
+    def close(self):
+        if self.map is not None:
+            self.map.close()
+            self.map = None
+        if self.fd is not None:
+            os.close(self.fd)
+            self.fd = None
+
+
+"""
+Prefixes restored from a snapshot and not confirmed yet by the fresh
+session dump. The ones still stale reconcile_timeout seconds (in update
+time) after the first update are gone from the peer and must be removed.
+"""
+class Reconciliation(object):
+    def __init__(self, prefixes, timeout):
+        self.stale = set(prefixes)
+        self.timeout = timeout
+        self.deadline = None
+
+    def confirm(self, prefix):
+        self.stale.discard(prefix)
+
+    def expired(self, now):
+        if self.deadline is None:
+            self.deadline = now + self.timeout
+        return now >= self.deadline
+
+    def __len__(self):
+        return len(self.stale)
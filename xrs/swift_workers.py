@@ -0,0 +1,197 @@
+import logging.handlers
+from multiprocessing import Process, Queue as MPQueue
+import Queue
+from threading import Thread
+
+from bgp_route import BGPRoute
+from dispatcher import PeerQueue, PeerBacklog
+from participant_swift import run_peer
+
+
+"""
+The messages exchanged with the SWIFT worker processes are flattened into
+tuples of plain values, so that no BGPRoute instance has to be pickled:
+    ('announce', time, route record, trace, epoch)
+    ('withdraw', time, route record, trace, epoch)
+FR and down messages only contain plain values and are sent as they are.
+"""
+def route_to_record(route):
+    return (route.prefix, route.neighbor, route.next_hop, route.origin, route.as_path,
+            route.as_path_vmac, route.communities, route.med, route.atomic_aggregate)
+
+
+def record_to_route(record):
+    return BGPRoute(*record)
+
+
+def encode_message(msg):
+    if 'announce' in msg:
+        return ('announce', msg['time'], route_to_record(msg['announce']), msg.get('trace'), msg.get('epoch', 0))
+    elif 'withdraw' in msg:
+        return ('withdraw', msg['time'], route_to_record(msg['withdraw']), msg.get('trace'), msg.get('epoch', 0))
+    return msg
+
+
+def decode_message(record):
+    if isinstance(record, tuple):
+        msg_type, time, route, trace, epoch = record
+        msg = {msg_type: record_to_route(route), 'time': time}
+        if trace is not None:
+            msg['trace'] = trace
+        if epoch:
+            msg['epoch'] = epoch
+        return msg
+    return record
+
+
+class EncodingQueue(object):
+    "Write-only adapter that flattens the messages put into a multiprocessing queue"
+    def __init__(self, queue):
+        self.queue = queue
+
+    def put(self, msg, block=True, timeout=None):
+        self.queue.put(encode_message(msg), block, timeout)
+
+
+def reset_log_handlers(logger):
+    "The socket of the log handler is shared with the parent after a fork"
+    for handler in logger.handlers:
+        if isinstance(handler, logging.handlers.SocketHandler) and handler.sock:
+            handler.sock.close()
+            handler.sock = None
+
+
+"""
+Stream the flattened messages of an outbox into a queue, until None is received.
+"""
+def feed(outbox, queue):
+    while True:
+        record = outbox.get()
+        if record is None:
+            break
+        queue.put(decode_message(record))
+
+
+"""
+Main function of a SWIFT worker process. The process hosts the run_peer
+threads of the peers assigned to it, and dispatches the records it
+receives to them. Updates and FR messages are streamed back over two
+different queues so that FR messages are never stuck behind updates.
+
+As in the route server, the messages of a peer whose queue is full go in
+its backlog, so that the peers sharing the inbox are not blocked by a noisy
+one. Beyond backlog_high_watermark messages, the inbox is not read until
+the backlog is back to backlog_low_watermark, which pushes back on the
+route server.
+"""
+def run_worker_process(logger, inbox, outbox, fr_outbox, peer_kwargs, queue_size=0,
+                       backlog_high_watermark=0, backlog_low_watermark=0):
+    reset_log_handlers(logger)
+
+    peer_queues = {}
+    backlog = PeerBacklog(backlog_high_watermark, backlog_low_watermark)
+    outbox = EncodingQueue(outbox)
+    fr_outbox = EncodingQueue(fr_outbox)
+
+    def try_put(peer_id, msg):
+        try:
+            peer_queues[peer_id].put_nowait(msg)
+        except Queue.Full:
+            return False
+        return True
+
+    while True:
+        if backlog.is_overloaded():
+            backlog.drain_until_low(try_put, lambda: True)
+
+        try:
+            # the backlog is retried often as long as there is one
+            item = inbox.get(True, 0.05) if backlog else inbox.get()
+        except Queue.Empty:
+            backlog.drain(try_put)
+            continue
+        if item is None:
+            break
+
+        peer_id, record = item
+        if peer_id not in peer_queues:
+            peer_queues[peer_id] = PeerQueue(queue_size, backlog.space_available)
+            t = Thread(target=run_peer, args=(logger, peer_queues[peer_id], outbox, fr_outbox),
+                       kwargs=dict(peer_id=peer_id, **peer_kwargs))
+            t.daemon = True
+            t.start()
+
+        msg = decode_message(record)
+        if 'down' in msg:
+            # the updates of the neighbor still in the backlog are stale
+            backlog.purge(peer_id, msg['down'])
+        if backlog.has_backlog(peer_id) or not try_put(peer_id, msg):
+            backlog.put(peer_id, msg)
+        if backlog:
+            backlog.drain(try_put)
+
+
+"""
+Pool of processes running the SWIFT workers. Each advertising peer is
+assigned to one process, round robin, when its first update arrives.
+If queue_size is set, the inboxes, the queues of the peers in the workers
+and the outbox of the updates are bounded, the FR outbox never is. The
+backlog watermarks bound the backlogs of the peers in each worker (see
+run_worker_process).
+"""
+class SwiftProcessPool(object):
+    def __init__(self, logger, nb_processes, peer_kwargs, queue_size=0, backlog_high_watermark=0, backlog_low_watermark=0):
+        self.logger = logger
+        self.peer_2_process = {}
+
+        self.outbox = MPQueue(queue_size)
+        self.fr_outbox = MPQueue()
+
+        self.inboxes = []
+        self.processes = []
+        for i in range(0, nb_processes):
+            inbox = MPQueue(queue_size)
+            p = Process(target=run_worker_process, args=(logger, inbox, self.outbox, self.fr_outbox, peer_kwargs, queue_size,
+                                                         backlog_high_watermark, backlog_low_watermark))
+            p.daemon = True
+            self.inboxes.append(inbox)
+            self.processes.append(p)
+
+        self.feeders = []
+
+    """
+    Fork the worker processes. Must be done before the threads of the route server are started.
+    """
+    def start(self):
+        for p in self.processes:
+            p.start()
+        self.logger.info('Started %d SWIFT worker processes', len(self.processes))
+
+    """
+    Stream the messages coming back from the workers into the given queue.
+    """
+    def start_feeders(self, queue):
+        for outbox in (self.fr_outbox, self.outbox):
+            t = Thread(target=feed, args=(outbox, queue))
+            t.daemon = True
+            t.start()
+            self.feeders.append(t)
+
+    """
+    Returns False if the inbox of the worker is full and block is False.
+    """
+    def submit(self, peer_id, msg, block=True):
+        if peer_id not in self.peer_2_process:
+            self.peer_2_process[peer_id] = len(self.peer_2_process) % len(self.inboxes)
+            self.logger.info('SWIFT for peer_id %s runs in worker process %d', peer_id, self.peer_2_process[peer_id])
+        try:
+            self.inboxes[self.peer_2_process[peer_id]].put((peer_id, encode_message(msg)), block)
+        except Queue.Full:
+            return False
+        return True
+
+    def stop(self):
+        for inbox in self.inboxes:
+            inbox.put(None)
+        self.outbox.put(None)
+        self.fr_outbox.put(None)